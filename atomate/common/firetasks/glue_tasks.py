@@ -102,30 +102,30 @@ class CopyFilesFromCalcLoc(FiretaskBase):
         calc_dir = calc_loc["path"]
         filesystem = calc_loc["filesystem"]
 
-        fileclient = FileClient(filesystem=filesystem)
-        calc_dir = fileclient.abspath(calc_dir)
-        filenames = self.get('filenames')
-        if filenames is None:
-            files_to_copy = fileclient.listdir(calc_dir)
-        elif isinstance(filenames, six.string_types):
-            raise ValueError("filenames must be a list!")
-        elif '$ALL_NO_SUBDIRS' in filenames:
-            files_to_copy = fileclient.listdir(calc_dir)
-        elif '$ALL' in filenames:
-            if self.get('name_prepend') or self.get('name_append'):
-                raise ValueError('name_prepend or name_append options not compatible with "$ALL" option')
-            copy_r(calc_dir, os.getcwd())
-            return
-        else:
-            files_to_copy = filenames
-
-        for f in files_to_copy:
-            prev_path_full = os.path.join(calc_dir, f)
-            dest_fname = self.get('name_prepend', "") + f + self.get(
-                'name_append', "")
-            dest_path = os.path.join(os.getcwd(), dest_fname)
-
-            fileclient.copy(prev_path_full, dest_path)
+        with FileClient(filesystem=filesystem) as fileclient:
+            calc_dir = fileclient.abspath(calc_dir)
+            filenames = self.get('filenames')
+            if filenames is None:
+                files_to_copy = fileclient.listdir(calc_dir)
+            elif isinstance(filenames, six.string_types):
+                raise ValueError("filenames must be a list!")
+            elif '$ALL_NO_SUBDIRS' in filenames:
+                files_to_copy = fileclient.listdir(calc_dir)
+            elif '$ALL' in filenames:
+                if self.get('name_prepend') or self.get('name_append'):
+                    raise ValueError('name_prepend or name_append options not compatible with "$ALL" option')
+                copy_r(calc_dir, os.getcwd())
+                return
+            else:
+                files_to_copy = filenames
+
+            for f in files_to_copy:
+                prev_path_full = os.path.join(calc_dir, f)
+                dest_fname = self.get('name_prepend', "") + f + self.get(
+                    'name_append', "")
+                dest_path = os.path.join(os.getcwd(), dest_fname)
+
+                fileclient.copy(prev_path_full, dest_path)
 
 
 @explicit_serialize
@@ -244,12 +244,22 @@ class CopyFiles(FiretaskBase):
         filesystem (str)
         files_to_copy (list): list of file names.
         exclude_files (list): list of file names to be excluded.
+        transfer_mode (str or dict): how the files are transferred on a local filesystem:
+            "copy" (default), "hardlink", "reflink" or "symlink", see FileClient.copy.
+            Either one mode for all the files or a dict of file name -> mode, the
+            files not in the dict being copied. The links fall back to a copy when
+            they are not possible. Only link the files that are not modified in place,
+            since writing through a hard or symbolic link modifies the source file.
+        transfer_backend (str): how the files are transferred from a remote filesystem:
+            "sftp" (default) or "async", see FileClient. With "async", the files are
+            downloaded all at once by the TransferEngine.
     """
 
-    optional_params = ["from_dir", "to_dir", "filesystem", "files_to_copy", "exclude_files"]
+    optional_params = ["from_dir", "to_dir", "filesystem", "files_to_copy", "exclude_files",
+                       "transfer_mode", "transfer_backend"]
 
     def setup_copy(self, from_dir, to_dir=None, filesystem=None, files_to_copy=None, exclude_files=None,
-                   from_path_dict=None):
+                   from_path_dict=None, transfer_backend=None):
         """
         setup the copy i.e setup the from directory, filesystem, destination directory etc.
 
@@ -261,13 +271,15 @@ class CopyFiles(FiretaskBase):
             exclude_files (list)
             from_path_dict (dict): dict specification of the path. If specified must contain atleast
                 the key "path" that specifies the path to the from_dir.
+            transfer_backend (str): "sftp" or "async", see FileClient. Defaults to "sftp".
         """
         from_path_dict = from_path_dict or {}
         from_dir = from_dir or from_path_dict.get("path", None)
         filesystem = filesystem or from_path_dict.get("filesystem", None)
         if from_dir is None:
             raise ValueError("Must specify from_dir!")
-        self.fileclient = FileClient(filesystem=filesystem)
+        self.fileclient = FileClient(filesystem=filesystem,
+                                     transfer_backend=transfer_backend or "sftp")
         self.from_dir = self.fileclient.abspath(from_dir)
         self.to_dir = to_dir or os.getcwd()
         exclude_files = exclude_files or []
@@ -277,14 +289,36 @@ class CopyFiles(FiretaskBase):
         """
         Defines the copy operation. Override this to customize copying.
         """
+        if self.fileclient.ssh and self.fileclient.transfer_backend == "async":
+            self.fileclient.get([(os.path.join(self.from_dir, f), os.path.join(self.to_dir, f))
+                                 for f in self.files_to_copy])
+            return
         for f in self.files_to_copy:
             prev_path_full = os.path.join(self.from_dir, f)
             dest_path = os.path.join(self.to_dir, f)
-            self.fileclient.copy(prev_path_full, dest_path)
+            self.fileclient.copy(prev_path_full, dest_path,
+                                 transfer_mode=self.get_transfer_mode(f))
+
+    def get_transfer_mode(self, filename):
+        """
+        Args:
+            filename (str): name of the file in from_dir
+
+        Returns:
+            (str) the transfer mode of the file
+        """
+        transfer_mode = self.get("transfer_mode", "copy")
+        if isinstance(transfer_mode, dict):
+            return transfer_mode.get(filename, "copy")
+        return transfer_mode
 
     def run_task(self, fw_spec):
         self.setup_copy(self.get("from_dir", None), to_dir=self.get("to_dir", None),
                         filesystem=self.get("filesystem", None),
                         files_to_copy=self.get("files_to_copy", None),
-                        exclude_files=self.get("exclude_files", []))
-        self.copy_files()
+                        exclude_files=self.get("exclude_files", []),
+                        transfer_backend=self.get("transfer_backend", None))
+        try:
+            self.copy_files()
+        finally:
+            self.fileclient.close()
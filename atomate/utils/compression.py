@@ -0,0 +1,134 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+"""
+This module defines the compression codecs used for the data stored in GridFS.
+The name of the codec is stored along with the data, so that readers can pick
+the matching decoder.
+"""
+
+import importlib
+import zlib
+
+__author__ = 'Kiran Mathew'
+__email__ = 'kmathew@lbl.gov'
+
+
+def _import_codec_module(module, codec):
+    # the optional codec packages are only imported when they are used
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise RuntimeError("'{}' package is NOT installed but is required for the "
+                           "'{}' compression codec.".format(module.split(".")[0], codec))
+
+
+def _zstd_compress(data, level):
+    zstandard = _import_codec_module("zstandard", "zstd")
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data):
+    zstandard = _import_codec_module("zstandard", "zstd")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _lz4_compress(data, level):
+    lz4_frame = _import_codec_module("lz4.frame", "lz4")
+    return lz4_frame.compress(data, compression_level=level)
+
+
+def _lz4_decompress(data):
+    lz4_frame = _import_codec_module("lz4.frame", "lz4")
+    return lz4_frame.decompress(data)
+
+
+class Codec(object):
+    """
+    A named pair of compression and decompression functions.
+    """
+
+    def __init__(self, name, compress, decompress, default_level=None):
+        """
+        Args:
+            name (str): name stored with the compressed data
+            compress (callable): compress(data, level) -> bytes
+            decompress (callable): decompress(data) -> bytes
+            default_level (int): level used if none is given
+        """
+        self.name = name
+        self._compress = compress
+        self._decompress = decompress
+        self.default_level = default_level
+
+    def compress(self, data, level=None):
+        return self._compress(data, self.default_level if level is None else level)
+
+    def decompress(self, data):
+        return self._decompress(data)
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """
+    Make a codec available under its name.
+
+    Args:
+        codec (Codec)
+    """
+    CODECS[codec.name] = codec
+
+
+# zlib level 1 is what insert_gridfs used to get from compress=True
+register_codec(Codec("zlib", zlib.compress, zlib.decompress, default_level=1))
+register_codec(Codec("zstd", _zstd_compress, _zstd_decompress, default_level=3))
+register_codec(Codec("lz4", _lz4_compress, _lz4_decompress, default_level=0))
+register_codec(Codec("none", lambda data, level: data, lambda data: data))
+
+
+def get_codec(name):
+    """
+    Args:
+        name (str): name of the codec. None is the same as "none" (no compression),
+            which is what is recorded for uncompressed data.
+
+    Returns:
+        (Codec)
+    """
+    name = name or "none"
+    if name not in CODECS:
+        raise ValueError("Unknown compression codec: {}. Available codecs: {}".format(
+            name, ", ".join(sorted(CODECS))))
+    return CODECS[name]
+
+
+def compress(data, codec="zlib", level=None):
+    """
+    Compress bytes with the given codec.
+
+    Args:
+        data (bytes): the data
+        codec (str): name of the codec
+        level (int): compression level; the default of the codec if None
+
+    Returns:
+        (bytes)
+    """
+    return get_codec(codec).compress(data, level=level)
+
+
+def decompress(data, codec):
+    """
+    Decompress bytes that were compressed with the given codec.
+
+    Args:
+        data (bytes): the compressed data
+        codec (str): name of the codec recorded with the data
+
+    Returns:
+        (bytes)
+    """
+    return get_codec(codec).decompress(data)
@@ -7,9 +7,10 @@ This module defines a base class for derived database classes that store calcula
 """
 
 import datetime
+from collections import OrderedDict
 from abc import ABCMeta, abstractmethod
 import six
-from pymongo import MongoClient, ReturnDocument
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 
 from monty.json import jsanitize
 from monty.serialization import loadfn
@@ -72,25 +73,95 @@ class CalcDb(six.with_metaclass(ABCMeta)):
             d (dict): task document
             update_duplicates (bool): whether to update the duplicates
         """
-        result = self.collection.find_one({"dir_name": d["dir_name"]}, ["dir_name", "task_id"])
-        if result is None or update_duplicates:
-            d["last_updated"] = datetime.datetime.utcnow()
-            if result is None:
-                if ("task_id" not in d) or (not d["task_id"]):
-                    d["task_id"] = self.db.counter.find_one_and_update(
-                        {"_id": "taskid"}, {"$inc": {"c": 1}},
-                        return_document=ReturnDocument.AFTER)["c"]
-                logger.info("Inserting {} with taskid = {}".format(d["dir_name"], d["task_id"]))
-            elif update_duplicates:
-                d["task_id"] = result["task_id"]
+        task_ids = self.insert_many([d], update_duplicates=update_duplicates)
+        return task_ids[0] if task_ids else None
+
+    def insert_many(self, docs, update_duplicates=True):
+        """
+        Insert task documents into the database collection with one lookup of the
+        existing documents, one task_id counter update and one bulk write.
+
+        Args:
+            docs ([dict]): task documents
+            update_duplicates (bool): whether to update the duplicates
+
+        Returns:
+            ([int]) task_ids of the inserted or updated documents
+        """
+        docs = self.assign_task_ids(docs, update_duplicates=update_duplicates)
+        self.upsert_many(docs)
+        return [d["task_id"] for d in docs]
+
+    def reserve_task_ids(self, n):
+        """
+        Get n consecutive new task_ids with a single update of the counter.
+
+        Args:
+            n (int): number of task_ids
+
+        Returns:
+            ([int]) the task_ids
+        """
+        if n <= 0:
+            return []
+        c = self.db.counter.find_one_and_update(
+            {"_id": "taskid"}, {"$inc": {"c": n}}, return_document=ReturnDocument.AFTER)["c"]
+        return list(range(c - n + 1, c + 1))
+
+    def assign_task_ids(self, docs, update_duplicates=True):
+        """
+        Set the task_id of task documents that are about to be written: documents
+        whose dir_name is already in the collection keep their task_id, the others
+        get a new one unless they already have one.
+
+        Args:
+            docs ([dict]): task documents
+            update_duplicates (bool): whether to update the duplicates
+
+        Returns:
+            ([dict]) the documents to write; duplicates are left out unless
+            update_duplicates is True
+        """
+        existing = {r["dir_name"]: r["task_id"] for r in self.collection.find(
+            {"dir_name": {"$in": [d["dir_name"] for d in docs]}}, ["dir_name", "task_id"])}
+        to_write = []
+        # dir_name -> new documents, so that repeated dir_names share a task_id
+        new_docs = OrderedDict()
+        for d in docs:
+            if d["dir_name"] in existing:
+                if not update_duplicates:
+                    logger.info("Skipping duplicate {}".format(d["dir_name"]))
+                    continue
+                d["task_id"] = existing[d["dir_name"]]
                 logger.info("Updating {} with taskid = {}".format(d["dir_name"], d["task_id"]))
+            elif not d.get("task_id"):
+                new_docs.setdefault(d["dir_name"], []).append(d)
+            else:
+                logger.info("Inserting {} with taskid = {}".format(d["dir_name"], d["task_id"]))
+            to_write.append(d)
+        for same_dir_docs, task_id in zip(new_docs.values(), self.reserve_task_ids(len(new_docs))):
+            for d in same_dir_docs:
+                d["task_id"] = task_id
+                logger.info("Inserting {} with taskid = {}".format(d["dir_name"], d["task_id"]))
+        return to_write
+
+    def upsert_many(self, docs):
+        """
+        Write task documents that already have their task_id (see assign_task_ids)
+        with a single bulk write, matching existing documents by dir_name.
+
+        Args:
+            docs ([dict]): task documents
+        """
+        if not docs:
+            return
+        now = datetime.datetime.utcnow()
+        requests = []
+        for d in docs:
+            d["last_updated"] = now
             d = jsanitize(d, allow_bson=True)
-            self.collection.update_one({"dir_name": d["dir_name"]},
-                                       {"$set": d}, upsert=True)
-            return d["task_id"]
-        else:
-            logger.info("Skipping duplicate {}".format(d["dir_name"]))
-            return None
+            requests.append(UpdateOne({"dir_name": d["dir_name"]}, {"$set": d}, upsert=True))
+        self.collection.bulk_write(requests)
 
     @abstractmethod
     def reset(self):
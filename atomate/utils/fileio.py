@@ -2,9 +2,17 @@
 
 from __future__ import division, print_function, unicode_literals, absolute_import
 
+import errno
+import fnmatch
 import glob
+import gzip
 import os
 import shutil
+import stat
+import threading
+from multiprocessing.pool import ThreadPool
+
+from atomate.utils.utils import get_logger
 
 """
 This module defines the wrapper class for remote file io using paramiko.
@@ -14,6 +22,37 @@ __author__ = 'Kiran Mathew'
 __credits__ = 'Anubhav Jain <ajain@lbl.gov>'
 __email__ = 'kmathew@lbl.gov'
 
+logger = get_logger(__name__)
+
+# size of the chunks streamed by copy_decompress
+COPY_CHUNK_SIZE = 16 * 1024 ** 2
+
+# ways of transferring a file on the local filesystem, see FileClient.copy
+TRANSFER_MODES = ("copy", "hardlink", "reflink", "symlink")
+
+# linux ioctl cloning a file, i.e. _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# ways of copying files to a remote filesystem, see FileClient
+TRANSFER_BACKENDS = ("sftp", "async")
+
+# interval in seconds of the keepalive packets of the pooled ssh connections
+SSH_KEEPALIVE = 30
+
+# ssh connections shared by all the FileClients of the process, by user@host
+_ssh_connections = {}
+_ssh_lock = threading.Lock()
+
+
+def close_ssh_connections():
+    """
+    Close all the pooled ssh connections, e.g. before the process exits.
+    """
+    with _ssh_lock:
+        for ssh in _ssh_connections.values():
+            ssh.close()
+        _ssh_connections.clear()
+
 
 class FileClient(object):
     """
@@ -21,15 +60,29 @@ class FileClient(object):
     of whether those operations are happening locally or via SSH
     """
 
-    def __init__(self, filesystem=None, private_key="~/.ssh/id_rsa"):
+    def __init__(self, filesystem=None, private_key="~/.ssh/id_rsa", nthreads=4,
+                 transfer_backend="sftp"):
         """
         Args:
             filesystem (str): remote filesystem, e.g. username@remote_host.
                 If None, use local
             private_key (str): path to the private key file (for remote
                 connections only). Note: passwordless ssh login must be setup
+            nthreads (int): number of files uploaded concurrently, each over its own
+                sftp channel, when copying a directory to a remote filesystem
+            transfer_backend (str): how files are copied to and from a remote
+                filesystem: "sftp" transfers them with paramiko, "async" uses the
+                TransferEngine of atomate.utils.transfer, which resumes interrupted
+                transfers and verifies the checksums
         """
+        if transfer_backend not in TRANSFER_BACKENDS:
+            raise ValueError("Unknown transfer_backend: {}, must be one of {}".format(
+                transfer_backend, TRANSFER_BACKENDS))
         self.ssh = None
+        self.sftp = None
+        self.nthreads = nthreads
+        self.transfer_backend = transfer_backend
+        self._transfer_engine = None
 
         if filesystem:
             if '@' in filesystem:
@@ -41,12 +94,32 @@ class FileClient(object):
             self.ssh = FileClient.get_ssh_connection(username, host, private_key)
             self.sftp = self.ssh.open_sftp()
 
+    def close(self):
+        """
+        Close the sftp channel of the client. The pooled ssh connection stays open for
+        the other clients; an sshd only allows a limited number of channels
+        (MaxSessions) per connection, so clients must be closed when they are done.
+        """
+        if self.sftp is not None:
+            self.sftp.close()
+            self.sftp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     @staticmethod
     def get_ssh_connection(username, host, private_key):
         """
         Connect to the remote host via paramiko using the private key.
         If the host key is not present it will be added automatically.
 
+        The connections are pooled by user@host and kept alive, so all the FileClients
+        of the process share one connection per remote filesystem; a connection that
+        was dropped is opened again.
+
         Args:
             username (str):
             host (str):
@@ -62,9 +135,20 @@ class FileClient(object):
         if not os.path.exists(private_key):
             raise ValueError("Cannot locate private key file: {}".format(private_key))
 
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        return ssh.connect(host, username=username, key_filename=private_key)
+        key = "{}@{}".format(username, host) if username else host
+        with _ssh_lock:
+            ssh = _ssh_connections.get(key)
+            transport = ssh.get_transport() if ssh else None
+            if transport is None or not transport.is_active():
+                if ssh:
+                    logger.info("Reconnecting to {}".format(key))
+                    ssh.close()
+                ssh = paramiko.SSHClient()
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh.connect(host, username=username, key_filename=private_key)
+                ssh.get_transport().set_keepalive(SSH_KEEPALIVE)
+                _ssh_connections[key] = ssh
+            return ssh
 
     @staticmethod
     def exists(sftp, path):
@@ -78,7 +162,7 @@ class FileClient(object):
         try:
             sftp.stat(path)
         except IOError as e:
-            if e[0] == 2:
+            if e.errno == errno.ENOENT:
                 return False
             raise
         else:
@@ -97,29 +181,170 @@ class FileClient(object):
         if not self.ssh:
             return os.listdir(ldir)
         else:
-            return self.sftp.listdir()
+            return self.sftp.listdir(ldir)
 
-    def copy(self, src, dest):
+    def copy(self, src, dest, transfer_mode="copy"):
         """
         Copy from source to destination.
 
+        On the local filesystem, the file can be linked instead of copied to avoid
+        duplicating the data:
+            "hardlink": the destination is another name of the source file. Needs both
+                on the same filesystem.
+            "reflink": copy-on-write clone sharing the data blocks of the source
+                until one of them is modified (e.g. btrfs, xfs).
+            "symlink": the destination points to the source file.
+        If the mode is not available, the file is copied. Beware that with "hardlink"
+        and "symlink", writing into the destination file modifies the source file, so
+        only use them for inputs that are read, not modified in place (e.g. a CHGCAR
+        read by a non self-consistent run). "reflink" does not have this problem.
+
         Args:
             src (str): source full path
             dest (str): destination file full path
-
+            transfer_mode (str): one of TRANSFER_MODES. Ignored for remote copies,
+                which are always copies.
         """
+        if transfer_mode not in TRANSFER_MODES:
+            raise ValueError("Unknown transfer_mode: {}, must be one of {}".format(
+                transfer_mode, TRANSFER_MODES))
+
         if not self.ssh:
-            shutil.copy2(src, dest)
+            if transfer_mode == "copy" or not self._link(src, dest, transfer_mode):
+                shutil.copy2(src, dest)
 
         else:
             if os.path.isdir(src):
                 if not FileClient.exists(self.sftp, dest):
                     self.sftp.mkdir(dest)
-                for f in os.listdir(src):
-                    if os.path.isfile(os.path.join(src, f)):
-                        self.sftp.put(os.path.join(src, f), os.path.join(dest, f))
+                self._put([(os.path.join(src, f), os.path.join(dest, f))
+                           for f in os.listdir(src) if os.path.isfile(os.path.join(src, f))])
             else:
-                self.sftp.put(src, os.path.join(dest, os.path.basename(src)))
+                self._put([(src, os.path.join(dest, os.path.basename(src)))])
+
+    def _put(self, files):
+        """
+        Upload files concurrently, each thread over its own sftp channel of the ssh
+        connection.
+
+        Args:
+            files ([(str, str)]): local source path and remote destination path of
+                each file
+        """
+        if self.transfer_backend == "async":
+            self._get_transfer_engine().put(files)
+            return
+
+        nthreads = min(self.nthreads, len(files))
+        if nthreads <= 1:
+            for src, dest in files:
+                self.sftp.put(src, dest)
+            return
+
+        local = threading.local()
+        channels = []
+        lock = threading.Lock()
+
+        def put(f):
+            sftp = getattr(local, "sftp", None)
+            if sftp is None:
+                sftp = local.sftp = self.ssh.open_sftp()
+                with lock:
+                    channels.append(sftp)
+            sftp.put(*f)
+
+        pool = ThreadPool(nthreads)
+        try:
+            pool.map(put, files)
+        finally:
+            pool.close()
+            pool.join()
+            for sftp in channels:
+                sftp.close()
+
+    def get(self, files):
+        """
+        Download files from the remote filesystem.
+
+        Args:
+            files ([(str, str)]): remote source path and local destination path of
+                each file
+        """
+        if self.transfer_backend == "async":
+            self._get_transfer_engine().get(files)
+            return
+        for src, dest in files:
+            self.sftp.get(src, dest)
+
+    def _get_transfer_engine(self):
+        if self._transfer_engine is None:
+            from atomate.utils.transfer import TransferEngine
+            self._transfer_engine = TransferEngine(self.ssh, max_concurrency=self.nthreads)
+        return self._transfer_engine
+
+    @staticmethod
+    def _link(src, dest, transfer_mode):
+        """
+        Link or clone a local file.
+
+        Args:
+            src (str): source file full path
+            dest (str): destination file full path
+            transfer_mode (str): "hardlink", "reflink" or "symlink"
+
+        Returns:
+            (bool) whether it succeeded; if not, the file still has to be copied
+        """
+        if os.path.isdir(src):
+            return False
+        if os.path.lexists(dest):
+            if os.path.isdir(dest):
+                dest = os.path.join(dest, os.path.basename(src))
+            if os.path.lexists(dest):
+                if os.path.exists(dest) and os.path.samefile(src, dest):
+                    return True
+                os.remove(dest)
+        try:
+            if transfer_mode == "hardlink":
+                os.link(src, dest)
+            elif transfer_mode == "symlink":
+                os.symlink(os.path.abspath(src), dest)
+            else:
+                import fcntl
+                with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+                    fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                shutil.copystat(src, dest)
+        except (OSError, IOError, ImportError, AttributeError) as e:
+            logger.debug("Cannot {} {} to {}, copying it instead: {}".format(
+                transfer_mode, src, dest, e))
+            if transfer_mode == "reflink" and os.path.lexists(dest):
+                os.remove(dest)
+            return False
+        return True
+
+    def copy_decompress(self, src, dest):
+        """
+        Decompress a gzipped source file into the local destination file. The data is
+        streamed in chunks, so the file is never fully held in memory and no
+        compressed copy is written to the destination.
+
+        Args:
+            src (str): gzipped source file full path, on the remote filesystem if any
+            dest (str): destination file full path
+        """
+        if not self.ssh:
+            fsrc = open(src, "rb")
+        else:
+            # read ahead asynchronously instead of one round trip per read
+            fsrc = self.sftp.open(src, "rb", bufsize=COPY_CHUNK_SIZE)
+            fsrc.prefetch()
+        try:
+            with gzip.GzipFile(fileobj=fsrc, mode="rb") as gz, open(dest, "wb") as fdest:
+                shutil.copyfileobj(gz, fdest, COPY_CHUNK_SIZE)
+        finally:
+            fsrc.close()
+        if not self.ssh:
+            shutil.copystat(src, dest)
 
     def abspath(self, path):
         """
@@ -132,10 +357,10 @@ class FileClient(object):
             return os.path.abspath(path)
 
         else:
-            command = ". ./.bashrc; readlink -f {}".format(path)
-            stdin, stdout, stderr = self.ssh.exec_command(command)
-            full_path = [l.split('\n')[0] for l in stdout]
-            return full_path[0]
+            # relative paths and "~" are relative to the home directory
+            if path == "~" or path.startswith("~/"):
+                path = "." + path[1:]
+            return self.sftp.normalize(path)
 
     def glob(self, path):
         """
@@ -147,6 +372,34 @@ class FileClient(object):
         if not self.ssh:
             return glob.glob(path)
         else:
-            command = ". ./.bashrc; for i in $(ls {}); do readlink -f $i; done".format(path)
-            stdin, stdout, stderr = self.ssh.exec_command(command)
-            return [l.split('\n')[0] for l in stdout]
+            return [self.abspath(p) for p in self._sftp_glob(path)]
+
+    def _sftp_glob(self, path):
+        """
+        glob.glob() over sftp.
+        """
+        dirname, basename = os.path.split(path)
+        if glob.has_magic(dirname):
+            dirs = [d for d in self._sftp_glob(dirname) if self._sftp_isdir(d)]
+        else:
+            dirs = [dirname]
+
+        paths = []
+        for d in dirs:
+            if glob.has_magic(basename):
+                try:
+                    names = self.sftp.listdir(d or ".")
+                except IOError:
+                    continue
+                if not basename.startswith("."):
+                    names = [n for n in names if not n.startswith(".")]
+                paths.extend(os.path.join(d, n) for n in fnmatch.filter(names, basename))
+            elif FileClient.exists(self.sftp, os.path.join(d, basename)):
+                paths.append(os.path.join(d, basename))
+        return paths
+
+    def _sftp_isdir(self, path):
+        try:
+            return stat.S_ISDIR(self.sftp.stat(path).st_mode)
+        except IOError:
+            return False
@@ -0,0 +1,41 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import unittest
+
+from atomate.utils.compression import compress, decompress, get_codec
+
+__author__ = 'Kiran Mathew'
+__email__ = 'kmathew@lbl.gov'
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = b'{"energies": [' + b", ".join([b"-1.2345"] * 1000) + b']}'
+
+    def test_round_trip(self):
+        for codec in ["zlib", "none"]:
+            blob = compress(self.data, codec=codec)
+            self.assertEqual(decompress(blob, codec), self.data)
+        self.assertLess(len(compress(self.data, codec="zlib", level=9)), len(self.data))
+        # uncompressed data is recorded with a None codec
+        self.assertEqual(decompress(self.data, None), self.data)
+
+    def test_optional_codecs(self):
+        for codec, module in [("zstd", "zstandard"), ("lz4", "lz4")]:
+            try:
+                __import__(module)
+            except ImportError:
+                self.assertRaises(RuntimeError, compress, self.data, codec)
+                continue
+            blob = compress(self.data, codec=codec)
+            self.assertEqual(decompress(blob, codec), self.data)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, "bzip3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import errno
+import gzip
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from atomate.utils.fileio import FileClient
+from atomate.utils.transfer import TransferEngine, PART_EXT
+
+__author__ = 'Kiran Mathew'
+__email__ = 'kmathew@lbl.gov'
+
+
+class LocalSFTP(object):
+    """
+    Stand-in for a paramiko sftp channel, on the local filesystem.
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    def open(self, path, mode):
+        return open(path, mode)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def stat(self, path):
+        try:
+            return os.stat(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+
+    def posix_rename(self, src, dest):
+        os.rename(src, dest)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def utime(self, path, times):
+        os.utime(path, times)
+
+    def close(self):
+        self.closed = True
+
+
+class LocalOutput(object):
+    """
+    Stand-in for the stdout of a paramiko exec_command.
+    """
+
+    def __init__(self, out, status):
+        self.out = out
+        self.channel = self
+        self.status = status
+
+    def read(self):
+        return self.out
+
+    def recv_exit_status(self):
+        return self.status
+
+
+class LocalSSH(object):
+    """
+    Stand-in for a paramiko ssh connection, on the local filesystem.
+    """
+
+    def __init__(self):
+        self.channels = []
+        self.commands = []
+
+    def open_sftp(self):
+        sftp = LocalSFTP()
+        self.channels.append(sftp)
+        return sftp
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return None, LocalOutput(out, p.returncode), LocalOutput(err, p.returncode)
+
+
+class TransferEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        self.data = {}
+        for i in range(10):
+            name = "file{}".format(i)
+            self.data[name] = os.urandom(1000 * (i + 1))
+            with open(os.path.join(self.src_dir, name), "wb") as f:
+                f.write(self.data[name])
+        self.files = [(os.path.join(self.src_dir, f), os.path.join(self.dest_dir, f))
+                      for f in sorted(self.data)]
+        self.ssh = LocalSSH()
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def assert_transferred(self):
+        for f, data in self.data.items():
+            with open(os.path.join(self.dest_dir, f), "rb") as fdest:
+                self.assertEqual(fdest.read(), data)
+            self.assertFalse(os.path.exists(os.path.join(self.dest_dir, f + PART_EXT)))
+
+    def test_put(self):
+        engine = TransferEngine(self.ssh, max_concurrency=4, chunk_size=256)
+        results = engine.put(self.files)
+        self.assertEqual([r["status"] for r in results], ["transferred"] * 10)
+        self.assert_transferred()
+        self.assertLessEqual(len(self.ssh.channels), 4)
+        self.assertTrue(all(sftp.closed for sftp in self.ssh.channels))
+        # the remote checksums are computed on the server
+        self.assertEqual(len([c for c in self.ssh.commands if c.startswith("md5sum")]), 10)
+
+        # up to date files are not transferred again
+        results = engine.put(self.files)
+        self.assertEqual([r["status"] for r in results], ["skipped"] * 10)
+
+    def test_get(self):
+        results = TransferEngine(self.ssh).get(self.files)
+        self.assertEqual([r["status"] for r in results], ["transferred"] * 10)
+        self.assert_transferred()
+
+    def test_resume(self):
+        src, dest = self.files[3]
+        data = self.data["file3"]
+        with open(dest + PART_EXT, "wb") as f:
+            f.write(data[:1500])
+        results = TransferEngine(self.ssh, chunk_size=256).put(self.files)
+        self.assertEqual(results[3]["status"], "resumed")
+        self.assertEqual(results[3]["bytes"], len(data) - 1500)
+
+        # a partial file that does not match the source is transferred again
+        os.remove(dest)
+        with open(dest + PART_EXT, "wb") as f:
+            f.write(b"x" * 1500)
+        results = TransferEngine(self.ssh).put(self.files)
+        self.assertEqual(results[3]["status"], "transferred")
+        self.assert_transferred()
+
+    def test_get_resume(self):
+        src, dest = self.files[3]
+        data = self.data["file3"]
+        with open(dest + PART_EXT, "wb") as f:
+            f.write(data[:1500])
+        results = TransferEngine(self.ssh, chunk_size=256).get(self.files)
+        self.assertEqual(results[3]["status"], "resumed")
+        self.assertEqual(results[3]["bytes"], len(data) - 1500)
+
+        # a stale partial download is detected against the remote source
+        os.remove(dest)
+        with open(dest + PART_EXT, "wb") as f:
+            f.write(b"x" * 1500)
+        results = TransferEngine(self.ssh).get(self.files)
+        self.assertEqual(results[3]["status"], "transferred")
+        self.assert_transferred()
+
+    def test_compress(self):
+        results = TransferEngine(self.ssh, compress=True).put(self.files)
+        for r, (f, data) in zip(results, sorted(self.data.items())):
+            self.assertEqual(r["dest"], os.path.join(self.dest_dir, f + ".gz"))
+            with gzip.open(r["dest"], "rb") as fdest:
+                self.assertEqual(fdest.read(), data)
+
+    def test_missing_file(self):
+        files = self.files + [(os.path.join(self.src_dir, "missing"),
+                               os.path.join(self.dest_dir, "missing"))]
+        with self.assertRaises(IOError) as cm:
+            TransferEngine(self.ssh).put(files)
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+        self.assert_transferred()
+
+    def test_file_client_get(self):
+        client = FileClient(transfer_backend="async")
+        client.ssh = self.ssh
+        client.get(self.files)
+        self.assert_transferred()
+        self.assertTrue(all(sftp.closed for sftp in self.ssh.channels))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,371 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import binascii
+import errno
+import hashlib
+import os
+import threading
+import zlib
+
+from six.moves import shlex_quote
+
+from atomate.utils.utils import get_logger
+
+"""
+This module defines an engine transferring many files at once between the local
+filesystem and a remote one over sftp. The blocking paramiko transfers run in a
+ThreadPoolExecutor, each thread with its own sftp channel of the same ssh connection,
+and are gathered on an asyncio event loop, so they can also be awaited along with other
+asynchronous work. A file is written to a ".part" file first, so an
+interrupted transfer is resumed where it stopped, and is checked with a md5 checksum
+before it is renamed. Files can also be gzipped on the fly.
+"""
+
+__author__ = 'Kiran Mathew'
+__email__ = 'kmathew@lbl.gov'
+
+logger = get_logger(__name__)
+
+# size of the chunks read and written by the transfers
+CHUNK_SIZE = 1024 ** 2
+
+# extension of the files being transferred
+PART_EXT = ".part"
+
+
+def _md5_file(files, path, chunk_size=CHUNK_SIZE):
+    md5 = hashlib.md5()
+    with files.open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class LocalFiles(object):
+    """
+    The file operations used by the TransferEngine, on the local filesystem.
+    """
+
+    is_local = True
+
+    def open(self, path, mode):
+        return open(path, mode)
+
+    def stat(self, path):
+        """
+        Returns:
+            the stat of the path or None if it does not exist
+        """
+        try:
+            return os.stat(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def rename(self, src, dest):
+        if os.path.exists(dest):
+            os.remove(dest)
+        os.rename(src, dest)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def utime(self, path, times):
+        os.utime(path, times)
+
+    def md5(self, path):
+        return _md5_file(self, path)
+
+
+class SFTPFiles(LocalFiles):
+    """
+    The file operations used by the TransferEngine, over a sftp channel.
+    """
+
+    is_local = False
+
+    def __init__(self, sftp, ssh=None):
+        """
+        Args:
+            sftp (SFTPClient): the sftp channel
+            ssh (SSHClient): the ssh connection of the channel, used to compute the
+                checksums on the server
+        """
+        self.sftp = sftp
+        self.ssh = ssh
+
+    def open(self, path, mode):
+        f = self.sftp.open(path, mode)
+        if "r" not in mode and hasattr(f, "set_pipelined"):
+            # do not wait for the acknowledgment of each write
+            f.set_pipelined(True)
+        return f
+
+    def stat(self, path):
+        try:
+            return self.sftp.stat(path)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def rename(self, src, dest):
+        if hasattr(self.sftp, "posix_rename"):
+            self.sftp.posix_rename(src, dest)
+        else:
+            if self.stat(dest) is not None:
+                self.sftp.remove(dest)
+            self.sftp.rename(src, dest)
+
+    def remove(self, path):
+        self.sftp.remove(path)
+
+    def utime(self, path, times):
+        self.sftp.utime(path, times)
+
+    def md5(self, path):
+        # the server computes the checksum with md5sum or, if it supports it, the
+        # check-file extension; otherwise the file is read back
+        if self.ssh is not None:
+            try:
+                stdin, stdout, stderr = self.ssh.exec_command(
+                    "md5sum {}".format(shlex_quote(path)))
+                out = stdout.read().decode("ascii", "ignore").split()
+                if stdout.channel.recv_exit_status() == 0 and out:
+                    return out[0]
+            except Exception as e:
+                logger.debug("Cannot run md5sum on the server: {}".format(e))
+        with self.sftp.open(path, "rb") as f:
+            try:
+                return binascii.hexlify(f.check("md5")).decode("ascii")
+            except (IOError, AttributeError):
+                pass
+        return _md5_file(self, path)
+
+
+def _import_asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        raise RuntimeError("'asyncio' package is NOT installed but is required for "
+                           "the async transfer backend.")
+    return asyncio
+
+
+class TransferEngine(object):
+    """
+    Transfers many files concurrently over one ssh connection.
+    """
+
+    def __init__(self, ssh, max_concurrency=8, verify=True, resume=True, compress=False,
+                 chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            ssh (SSHClient): the ssh connection
+            max_concurrency (int): maximum number of files transferred at the same time,
+                each over its own sftp channel
+            verify (bool): compare the md5 checksums of the source and the transferred
+                file. Remote checksums are computed by md5sum on the server; the file
+                is only read back if that is not possible.
+            resume (bool): continue the transfers interrupted before, from their
+                ".part" files. Compressed transfers always start over.
+            compress (bool): gzip the files on the fly; the destination file gets a
+                ".gz" extension
+            chunk_size (int): size of the chunks read and written
+        """
+        self.ssh = ssh
+        self.max_concurrency = max_concurrency
+        self.verify = verify
+        self.resume = resume
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self._local = threading.local()
+        self._channels = []
+        self._lock = threading.Lock()
+
+    def put(self, files):
+        """
+        Upload files.
+
+        Args:
+            files ([(str, str)]): local source path and remote destination path of
+                each file
+
+        Returns:
+            ([dict]) for each file, the source, destination, status ("transferred",
+            "resumed" or "skipped" if the destination is up to date) and number of
+            bytes written
+        """
+        return self._run(files, upload=True)
+
+    def get(self, files):
+        """
+        Download files.
+
+        Args:
+            files ([(str, str)]): remote source path and local destination path of
+                each file
+
+        Returns:
+            ([dict]) the results of the transfers, see put
+        """
+        return self._run(files, upload=False)
+
+    def transfer_async(self, files, upload=True, loop=None):
+        """
+        Schedule the transfers on an event loop.
+
+        Args:
+            files ([(str, str)]): source and destination paths of each file
+            upload (bool): upload if True, download if False
+            loop (AbstractEventLoop): the event loop, by default the current one
+
+        Returns:
+            (Future) the results of the transfers, see put, with the exception in place
+            of the result of the failed transfers
+        """
+        asyncio = _import_asyncio()
+        from concurrent.futures import ThreadPoolExecutor
+        loop = loop or asyncio.get_event_loop()
+        executor = ThreadPoolExecutor(max(1, min(self.max_concurrency, len(files))))
+        transfers = asyncio.gather(
+            *[loop.run_in_executor(executor, self._transfer, src, dest, upload)
+              for src, dest in files], return_exceptions=True)
+
+        def cleanup(future):
+            executor.shutdown(wait=False)
+            self._close_channels()
+
+        transfers.add_done_callback(cleanup)
+        return transfers
+
+    def _run(self, files, upload):
+        asyncio = _import_asyncio()
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(self.transfer_async(files, upload, loop))
+        finally:
+            loop.close()
+        errors = [r for r in results if isinstance(r, Exception)]
+        for e in errors[1:]:
+            logger.error("Transfer failed: {}".format(e))
+        if errors:
+            raise errors[0]
+        return results
+
+    def _get_sftp_files(self):
+        files = getattr(self._local, "files", None)
+        if files is None:
+            sftp = self.ssh.open_sftp()
+            with self._lock:
+                self._channels.append(sftp)
+            files = self._local.files = SFTPFiles(sftp, ssh=self.ssh)
+        return files
+
+    def _close_channels(self):
+        with self._lock:
+            for sftp in self._channels:
+                sftp.close()
+            self._channels = []
+        self._local = threading.local()
+
+    def _transfer(self, src, dest, upload):
+        local, remote = LocalFiles(), self._get_sftp_files()
+        if upload:
+            return self.transfer_file(local, remote, src, dest)
+        return self.transfer_file(remote, local, src, dest)
+
+    def transfer_file(self, src_files, dest_files, src, dest):
+        """
+        Transfer one file.
+
+        Args:
+            src_files (LocalFiles): file operations on the source filesystem
+            dest_files (LocalFiles): file operations on the destination filesystem
+            src (str): source file path
+            dest (str): destination file path
+
+        Returns:
+            (dict) the result of the transfer, see put
+        """
+        src_stat = src_files.stat(src)
+        if src_stat is None:
+            raise IOError(errno.ENOENT, "No such file", src)
+        if self.compress:
+            dest += ".gz"
+
+        # the destination is up to date if it has the modification time of the source
+        dest_stat = dest_files.stat(dest)
+        if dest_stat is not None and int(dest_stat.st_mtime) == int(src_stat.st_mtime) and \
+                (self.compress or dest_stat.st_size == src_stat.st_size):
+            return {"src": src, "dest": dest, "status": "skipped", "bytes": 0}
+
+        part = dest + PART_EXT
+        offset = 0
+        if self.resume and not self.compress:
+            part_stat = dest_files.stat(part)
+            if part_stat is not None and part_stat.st_size <= src_stat.st_size:
+                offset = part_stat.st_size
+
+        # a resumed transfer that does not match the source is started over
+        for start in ([offset, 0] if offset else [0]):
+            nbytes, checksum = self._copy(src_files, dest_files, src, part, start)
+            if not self.verify or dest_files.md5(part) == checksum:
+                break
+            logger.warning("Checksum mismatch transferring {} to {}".format(src, dest))
+        else:
+            dest_files.remove(part)
+            raise IOError("Checksum mismatch transferring {} to {}".format(src, dest))
+
+        dest_files.rename(part, dest)
+        dest_files.utime(dest, (src_stat.st_atime, src_stat.st_mtime))
+        return {"src": src, "dest": dest, "status": "resumed" if start else "transferred",
+                "bytes": nbytes}
+
+    def _copy(self, src_files, dest_files, src, part, offset):
+        """
+        Copy the source into the part file, from the offset on.
+
+        Returns:
+            (int, str) the number of bytes written and the md5 checksum of the whole
+            part file
+        """
+        md5 = hashlib.md5()
+        nbytes = 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) \
+            if self.compress else None
+
+        # the checksum of a resumed transfer has to come from the source, not from the
+        # part already transferred: a local source is read from the start, the
+        # checksum of a remote one is computed separately
+        src_checksum = None
+        with src_files.open(src, "rb") as fsrc:
+            if offset and src_files.is_local:
+                remaining = offset
+                while remaining:
+                    chunk = fsrc.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    remaining -= len(chunk)
+            elif offset:
+                fsrc.seek(offset)
+                src_checksum = src_files.md5(src)
+
+            with dest_files.open(part, "ab" if offset else "wb") as fdest:
+                for chunk in iter(lambda: fsrc.read(self.chunk_size), b""):
+                    if compressor:
+                        chunk = compressor.compress(chunk)
+                    fdest.write(chunk)
+                    md5.update(chunk)
+                    nbytes += len(chunk)
+                if compressor:
+                    chunk = compressor.flush()
+                    fdest.write(chunk)
+                    md5.update(chunk)
+                    nbytes += len(chunk)
+
+        return nbytes, src_checksum or md5.hexdigest()
@@ -1,8 +1,13 @@
 from __future__ import division
 
+import numbers
+import traceback
+
+import numpy as np
+from pymongo import UpdateOne
 from tqdm import tqdm
-import math
 from atomate.utils.utils import get_logger, get_database
+from atomate.vasp.builders.base import AbstractBuilder, BuilderState
 
 logger = get_logger(__name__)
 
@@ -19,8 +24,12 @@ for gaps approximately ~2 eV and higher. Smaller gaps are less accurate. Prelimi
 """
 
 
-class BandgapEstimationBuilder:
-    def __init__(self, materials_write):
+class BandgapEstimationBuilder(AbstractBuilder):
+
+    inputs = ("dielectric_avg",)
+    outputs = ("bandgap_estimation",)
+
+    def __init__(self, materials_write, chunk_size=1000):
         """
         Starting with an existing materials collection with dielectric constant data, adds
         estimated band gaps that may be more accurate than typical GGA calculations.
@@ -29,40 +38,106 @@ class BandgapEstimationBuilder:
 
         Args:
             materials_write: mongodb collection for materials (write access needed)
+            chunk_size: (int) number of materials computed and written together
         """
         self._materials = materials_write
+        self.chunk_size = chunk_size
 
     def run(self):
         logger.info("{} starting...".format(self.__class__.__name__))
-        q = {"dielectric.epsilon_static_avg": {"$gt": 0}, "bandgap_estimation": {"$exists": False}}
-
-        for m in tqdm(self._materials.find(q, projection=["material_id", "dielectric"])):
+        self.changed_material_ids = set()
+        q = {"dielectric.epsilon_static_avg": {"$gt": 0}}
+        missing = {"bandgap_estimation": {"$exists": False}}
+        if self.material_ids is not None:
+            # the materials that failed or were skipped before are retried too
+            q["$or"] = [{"material_id": {"$in": list(self.material_ids)}}, missing]
+        else:
+            q.update(missing)
+
+        pbar = tqdm(total=self._materials.find(q).count())
+        for mats in self.find_chunks(self._materials, q, ["material_id", "dielectric"],
+                                     state=self._get_state()):
+            pbar.update(len(mats))
+            # a malformed material is skipped on its own, not with its whole chunk
+            valid = []
+            for m in mats:
+                eps = self._get_eps(m)
+                if eps is None:
+                    logger.error("Invalid dielectric.epsilon_static_avg for material_id: "
+                                 "{}".format(m.get("material_id")))
+                else:
+                    valid.append((m, eps))
+            if not valid:
+                continue
             try:
-                eps = m["dielectric"]["epsilon_static_avg"]  # electronic portion of eps ("eps_static") approximates eps_inf
-                n = math.sqrt(eps)  # sqrt(eps_inf) to get refractive index
-                d = {}
-                d["gap_moss"] = (95 / n**4) if n > 0 else None
-                d["gap_gupta-ravindra"] = (4.16-n)/0.85 if n <= 4.16 else None
-                d["gap_reddy-anjaneyulu"] = 36.3/math.exp(n)
-                d["gap_reddy-ahamed"] = 154/n**4+0.365 if n > 0 else None
-                d["gap_herve_vandamme"] = 13.47/math.sqrt(n**2-1)-3.47 if n > 1 else None
-
-                d = {"bandgap_estimation": d}
-                self._materials.update_one({"material_id": m["material_id"]}, {"$set": d})
-
-            except:
-                import traceback
-                logger.exception(traceback.format_exc())
+                # electronic portion of eps ("eps_static") approximates eps_inf
+                estimates = self.get_estimates(np.array([eps for m, eps in valid]))
+                requests = []
+                for i, (m, eps) in enumerate(valid):
+                    d = {k: v[i] for k, v in estimates.items()}
+                    requests.append(UpdateOne({"material_id": m["material_id"]},
+                                              {"$set": {"bandgap_estimation": d}}))
+                self._materials.bulk_write(requests, ordered=False)
+                self.changed_material_ids.update(m["material_id"] for m, eps in valid)
+
+            except Exception:
+                logger.exception("There was an error processing material_ids: {}\n{}".format(
+                    [m["material_id"] for m, eps in valid], traceback.format_exc()))
+        pbar.close()
 
         logger.info("{} finished.".format(self.__class__.__name__))
 
+    def _get_state(self):
+        return BuilderState(self._materials.database,
+                            "BandgapEstimationBuilder.{}".format(self._materials.name))
+
+    @staticmethod
+    def _get_eps(m):
+        """
+        Returns:
+            (float) the eps_inf of a materials document, or None if it is not a positive
+            finite number
+        """
+        try:
+            eps = m["dielectric"]["epsilon_static_avg"]
+        except (KeyError, TypeError):
+            return None
+        if isinstance(eps, bool) or not isinstance(eps, numbers.Real) or \
+                not np.isfinite(eps) or eps <= 0:
+            return None
+        return float(eps)
+
+    @staticmethod
+    def get_estimates(eps):
+        """
+        Band gap estimates for an array of eps_inf values, vectorized.
+
+        Args:
+            eps (numpy.ndarray): positive eps_inf values
+
+        Returns:
+            (dict) name of the estimate -> list of gaps, with None where the relation does
+            not apply
+        """
+        n = np.sqrt(eps)  # sqrt(eps_inf) to get refractive index
+        with np.errstate(divide="ignore", invalid="ignore"):
+            estimates = {
+                "gap_moss": np.where(n > 0, 95 / n**4, np.nan),
+                "gap_gupta-ravindra": np.where(n <= 4.16, (4.16 - n) / 0.85, np.nan),
+                "gap_reddy-anjaneyulu": 36.3 / np.exp(n),
+                "gap_reddy-ahamed": np.where(n > 0, 154 / n**4 + 0.365, np.nan),
+                "gap_herve_vandamme": np.where(n > 1, 13.47 / np.sqrt(n**2 - 1) - 3.47, np.nan)}
+        return {k: [None if np.isnan(x) else float(x) for x in v]
+                for k, v in estimates.items()}
+
     def reset(self):
         logger.info("Resetting {} starting!".format(self.__class__.__name__))
         self._materials.update_many({}, {"$unset": {"bandgap_estimation": 1}})
+        self._get_state().reset()
         logger.info("Resetting {} finished!".format(self.__class__.__name__))
 
-    @staticmethod
-    def from_file(db_file, m="materials", **kwargs):
+    @classmethod
+    def from_file(cls, db_file, m="materials", **kwargs):
         """
         Get builder using only a db file.
 
@@ -75,4 +150,4 @@ class BandgapEstimationBuilder:
             BandgapEstimationBuilder
         """
         db_write = get_database(db_file, admin=True)
-        return BandgapEstimationBuilder(db_write[m], **kwargs)
\ No newline at end of file
+        return cls(db_write[m], **kwargs)
\ No newline at end of file
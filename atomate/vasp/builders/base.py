@@ -2,18 +2,43 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import json
 import six
 from abc import ABCMeta, abstractmethod
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, UpdateOne
+
+from atomate.utils.utils import get_logger
 
 __author__ = "Kiran Mathew"
 __email__ = "kmathew@lbl.gov"
 
+logger = get_logger(__name__)
+
 
 class AbstractBuilder(six.with_metaclass(ABCMeta)):
     """
     Abstract builder class. Defines the contract and must be subclassed by all builders.
     """
 
+    # names of the data read and written by the builder, i.e. collections (e.g. "tasks")
+    # or fields of the materials (e.g. "stability"); BuilderPipeline orders builders by them
+    inputs = ()
+    outputs = ()
+
+    # material_ids whose inputs changed, set by BuilderPipeline. Builders that compute
+    # properties of existing materials (re)process these if set, besides the materials
+    # still missing the property; None means only the materials the builder would
+    # process on its own.
+    material_ids = None
+
+    # material_ids modified by the last run, or None if the builder does not track them
+    changed_material_ids = None
+
+    # default number of documents per chunk of find_chunks
+    chunk_size = 1000
+
     @abstractmethod
     def run(self):
         """
@@ -35,3 +60,244 @@ class AbstractBuilder(six.with_metaclass(ABCMeta)):
         Set the builder from a config file, e.g., a db file
         """
         pass
+
+    def find_chunks(self, collection, query, projection=None, chunk_size=None, state=None):
+        """
+        Iterate over the documents matching a query in chunks, in the order of their _id.
+        Each chunk is fetched with its own query on the _id range after the previous
+        chunk, so that only one chunk is held in memory and no cursor stays open while
+        the chunks are processed.
+
+        If a builder state is given, the _id of the last document of each chunk is saved
+        as a checkpoint once the caller asks for the next chunk, i.e. once the chunk has
+        been processed. A run with the same query that was interrupted resumes after the
+        last checkpoint, and the checkpoint is removed when the iteration completes.
+
+        Args:
+            collection (pymongo.collection): the collection to read
+            query (dict): pymongo query
+            projection (dict/list): pymongo projection; must not exclude _id
+            chunk_size (int): number of documents per chunk. Defaults to the chunk_size
+                of the builder.
+            state (BuilderState): state used to save checkpoints
+
+        Yields:
+            ([dict]) the documents of each chunk
+        """
+        chunk_size = chunk_size or self.chunk_size
+        key = "{}:{}".format(collection.name, json.dumps(query, sort_keys=True, default=str))
+        last_id = state.get_checkpoint(key) if state else None
+        if last_id is not None:
+            logger.info("Resuming {} after _id {}".format(collection.name, last_id))
+        while True:
+            q = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+            chunk = list(collection.find(q, projection).sort("_id", ASCENDING).
+                         limit(chunk_size).batch_size(chunk_size))
+            if not chunk:
+                break
+            yield chunk
+            last_id = chunk[-1]["_id"]
+            if state:
+                state.set_checkpoint(key, last_id)
+        if state:
+            state.set_checkpoint(key, None)
+
+
+class BuilderState(object):
+    """
+    Incremental processing state of a builder. It records the ids of the documents
+    the builder has processed and a high-water mark on an increasing field of its
+    source collection (e.g. task_id or _id), so that new work is found with one
+    indexed range query and set lookups instead of scanning the processed ids stored
+    in all the materials.
+
+    The increasing field is not written in order: insert_tasks reserves a block of
+    task_ids, uploads the GridFS data and only then writes the tasks, so a task can
+    appear after tasks with higher task_ids. Only the documents written more than
+    `lag` ago are therefore allowed to move the high-water mark (see is_settled);
+    the later ones are looked at again by the next runs, and skipped if they were
+    processed. The lag must be longer than the longest insertion (plus the clock
+    differences between the machines writing and building).
+
+    The documents that failed are not held below the high-water mark: their values
+    of the increasing field are kept in a retry set that the next run queries with
+    $in, so a document that always fails does not make every run rescan what comes
+    after it.
+
+    The state is kept in the "builder_state" collection of the database, with one
+    document per builder, and the processed ids in "builder_state.processed".
+    """
+
+    # number of ids per query when looking up processed ids
+    chunk_size = 10000
+
+    # documents written less than this long ago do not move the high-water mark
+    lag = timedelta(hours=1)
+
+    def __init__(self, db, name):
+        """
+        Args:
+            db (pymongo.database.Database): database of the state collections
+            name (str): unique name of the builder, e.g. "TagsBuilder.materials"
+        """
+        self.name = name
+        self._state = db["builder_state"]
+        self._processed = db["builder_state"]["processed"]
+        self._processed.create_index([("builder", ASCENDING), ("id", ASCENDING)], unique=True)
+
+    @property
+    def exists(self):
+        """
+        Whether the builder has saved a state, i.e. whether it needs to be seeded.
+        """
+        return self._state.find_one({"_id": self.name}, {"_id": 1}) is not None
+
+    def get_checkpoint(self, key):
+        """
+        Args:
+            key (str): what the checkpoint is for, e.g. the collection and query
+
+        Returns:
+            the checkpoint saved for the key, or None
+        """
+        doc = self._state.find_one({"_id": self.name}, {"checkpoint": 1}) or {}
+        checkpoint = doc.get("checkpoint") or {}
+        return checkpoint.get("value") if checkpoint.get("key") == key else None
+
+    def set_checkpoint(self, key, value):
+        """
+        Save the position of an interrupted iteration; only one checkpoint is kept.
+
+        Args:
+            key (str): what the checkpoint is for, e.g. the collection and query
+            value: the checkpoint; None to remove it
+        """
+        checkpoint = None if value is None else {"key": key, "value": value}
+        self._state.update_one({"_id": self.name}, {"$set": {"checkpoint": checkpoint}},
+                               upsert=True)
+
+    @property
+    def high_water_mark(self):
+        doc = self._state.find_one({"_id": self.name}, {"high_water_mark": 1}) or {}
+        return doc.get("high_water_mark")
+
+    @property
+    def retry(self):
+        """
+        The values of the increasing field of the documents to retry.
+        """
+        doc = self._state.find_one({"_id": self.name}, {"retry": 1}) or {}
+        return doc.get("retry") or []
+
+    def get_query(self, field):
+        """
+        Query for the source documents at or above the high-water mark and the
+        documents to retry.
+
+        Args:
+            field (str): the increasing field of the source documents
+
+        Returns:
+            (dict) pymongo query; empty if there is no high-water mark yet
+        """
+        hwm = self.high_water_mark
+        if hwm is None:
+            return {}
+        retry = self.retry
+        if not retry:
+            return {field: {"$gte": hwm}}
+        return {"$or": [{field: {"$gte": hwm}}, {field: {"$in": retry}}]}
+
+    def get_cutoff(self):
+        """
+        Returns:
+            (datetime) documents written after the cutoff are not settled yet
+        """
+        return datetime.utcnow() - self.lag
+
+    @staticmethod
+    def is_settled(written_at, cutoff):
+        """
+        Whether a document was written long enough ago for its value of the increasing
+        field to move the high-water mark.
+
+        Args:
+            written_at (datetime): when the document was written (UTC), e.g. the
+                last_updated of a task or the generation time of an ObjectId. None
+                counts as written long ago.
+            cutoff (datetime): result of get_cutoff
+
+        Returns:
+            (bool)
+        """
+        if written_at is None:
+            return True
+        return written_at.replace(tzinfo=None) <= cutoff
+
+    def get_processed(self, ids):
+        """
+        Args:
+            ids ([]): candidate ids
+
+        Returns:
+            (set) the ids that were already processed
+        """
+        ids = list(ids)
+        processed = set()
+        for i in range(0, len(ids), self.chunk_size):
+            processed.update(d["id"] for d in self._processed.find(
+                {"builder": self.name, "id": {"$in": ids[i:i + self.chunk_size]}}, {"id": 1}))
+        return processed
+
+    def add_processed(self, ids):
+        """
+        Record processed ids.
+
+        Args:
+            ids ([]): the processed ids
+        """
+        requests = [UpdateOne({"builder": self.name, "id": i},
+                              {"$setOnInsert": {"builder": self.name, "id": i}}, upsert=True)
+                    for i in ids]
+        if requests:
+            self._processed.bulk_write(requests, ordered=False)
+
+    def seed(self, ids):
+        """
+        Initialize the state of a builder that tracked its processed ids elsewhere.
+
+        Args:
+            ids ([]): the ids processed so far
+        """
+        self.add_processed(ids)
+        self._state.update_one({"_id": self.name},
+                               {"$set": {"high_water_mark": None, "updated_at": datetime.utcnow()}},
+                               upsert=True)
+
+    def update(self, processed_ids, marks, failed_marks=None):
+        """
+        Record the result of a run: advance the high-water mark to the highest mark
+        seen and replace the retry set with the failed documents.
+
+        Args:
+            processed_ids ([]): ids processed successfully
+            marks ([]): values of the increasing field of the settled documents seen,
+                see is_settled
+            failed_marks ([]): values of the increasing field of the failed documents
+        """
+        self.add_processed(processed_ids)
+        hwm = self.high_water_mark
+        if marks:
+            hwm = max(marks) if hwm is None else max(max(marks), hwm)
+        self._state.update_one({"_id": self.name},
+                               {"$set": {"high_water_mark": hwm,
+                                         "retry": sorted(set(failed_marks or [])),
+                                         "updated_at": datetime.utcnow()}},
+                               upsert=True)
+
+    def reset(self):
+        """
+        Forget everything that was processed.
+        """
+        self._state.delete_one({"_id": self.name})
+        self._processed.delete_many({"builder": self.name})
@@ -0,0 +1,418 @@
+# coding: utf-8
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+"""
+This module defines a benchmark harness for the builders. It fills a scratch database
+with synthetic tasks, runs the builders on it and reports, for each builder, the elapsed
+time per phase (discovery, matching, updating), the throughput, the number of database
+calls per document and the peak memory allocated by the builder, as JSON, along with the
+peak resident memory of the whole process.
+
+The scratch database is either an in-memory mongomock database or a database on a
+running mongod, which is dropped before the benchmark.
+"""
+
+import platform
+import random
+import sys
+import time
+from collections import defaultdict, OrderedDict
+
+from pymatgen import Lattice, Structure
+
+from atomate.utils.utils import get_logger
+from atomate.vasp.builders.bandgap_estimation import BandgapEstimationBuilder
+from atomate.vasp.builders.dielectric import DielectricBuilder
+from atomate.vasp.builders.materials_descriptor import MaterialsDescriptorBuilder
+from atomate.vasp.builders.tags import TagsBuilder
+from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
+
+__author__ = 'Anubhav Jain <ajain@lbl.gov>'
+
+logger = get_logger(__name__)
+
+# collection methods that make a call to the database
+DB_METHODS = {"find", "find_one", "find_one_and_update", "find_one_and_replace",
+              "find_one_and_delete", "insert_one", "insert_many", "update_one",
+              "update_many", "replace_one", "delete_one", "delete_many", "bulk_write",
+              "count", "count_documents", "distinct", "aggregate", "create_index",
+              "update", "insert", "remove"}
+
+# methods of the builders timed as the matching and updating phases; the rest of the
+# run is the discovery phase (finding the documents to process, reading them, ...)
+PHASE_METHODS = {"TasksMaterialsBuilder": {"matching": ["_match_material"],
+                                           "updating": ["_create_new_material",
+                                                        "_update_material",
+                                                        "_flush_updates"]},
+                 "MaterialsDescriptorBuilder": {"updating": ["_process_chunk"]}}
+
+# elements and prototypes of the synthetic materials
+ELEMENTS = ["Li", "Na", "K", "Rb", "Cs", "Be", "Mg", "Ca", "Sr", "Ba", "Sc", "Ti", "V",
+            "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Y", "Zr", "Nb", "Mo", "Ag", "Cd",
+            "Al", "Ga", "In", "Sn", "Pb", "Bi", "O", "S", "Se", "Te", "F", "Cl", "Br", "I"]
+PROTOTYPES = [
+    # name, space group number, space group symbol, fractional coordinates by species
+    ("CsCl", 221, "Pm-3m", [[[0, 0, 0]], [[0.5, 0.5, 0.5]]]),
+    ("NaCl", 225, "Fm-3m", [[[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5], [0.5, 0.5, 0]],
+                            [[0.5, 0.5, 0.5], [0.5, 0, 0], [0, 0.5, 0], [0, 0, 0.5]]])]
+TASK_LABELS = ["structure optimization", "static", "static dielectric"]
+
+
+class CountingCollection(object):
+    """
+    Stand-in for a collection that counts the calls to the database by method. The
+    getMore calls made while iterating over a cursor are not counted.
+    """
+
+    def __init__(self, collection, counts):
+        """
+        Args:
+            collection (pymongo.collection): the collection
+            counts (defaultdict): full collection name -> method -> number of calls,
+                shared by all the counting collections of a benchmark
+        """
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in DB_METHODS:
+            counts = self._counts[self._collection.full_name]
+
+            def counted(*args, **kwargs):
+                counts[name] += 1
+                return attr(*args, **kwargs)
+            return counted
+        return _wrap(attr, self._counts)
+
+    def __getitem__(self, name):
+        return _wrap(self._collection[name], self._counts)
+
+
+class CountingDatabase(object):
+    """
+    Stand-in for a database whose collections are CountingCollections.
+    """
+
+    def __init__(self, db, counts):
+        self._db = db
+        self._counts = counts
+
+    def __getattr__(self, name):
+        return _wrap(getattr(self._db, name), self._counts)
+
+    def __getitem__(self, name):
+        return _wrap(self._db[name], self._counts)
+
+
+def _wrap(obj, counts):
+    # collections and databases of pymongo and mongomock are recognized by their methods
+    if hasattr(obj, "find_one") and hasattr(obj, "full_name"):
+        return CountingCollection(obj, counts)
+    if hasattr(obj, "get_collection") and hasattr(obj, "command"):
+        return CountingDatabase(obj, counts)
+    return obj
+
+
+class PhaseTimer(object):
+    """
+    Times the calls to some methods of an object, by phase.
+    """
+
+    def __init__(self):
+        self.elapsed = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap(self, obj, method, phase):
+        """
+        Replace a method of an object by a wrapper that times it.
+
+        Args:
+            obj: the object, e.g. a builder
+            method (str): name of the method
+            phase (str): phase the time of the method is added to
+        """
+        func = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.elapsed[phase] += time.time() - start
+                self.calls[phase] += 1
+        setattr(obj, method, timed)
+
+
+def start_memory_trace():
+    """
+    Start tracing the memory allocations of the Python code, to measure the peak
+    memory of a builder with stop_memory_trace. Tracing slows down the allocations.
+
+    Returns:
+        (bool) whether the allocations are traced; tracemalloc needs Python 3
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return False
+    tracemalloc.start()
+    return True
+
+
+def stop_memory_trace():
+    """
+    Stop tracing the memory allocations.
+
+    Returns:
+        (float) the peak memory allocated since start_memory_trace in MB
+    """
+    import tracemalloc
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+def get_peak_rss():
+    """
+    Returns:
+        (float) peak resident memory of the process in MB, or None if it is not
+        available on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+def get_scratch_database(backend="mongomock", host="localhost", port=27017,
+                         name="atomate_benchmark"):
+    """
+    Get an empty database for a benchmark.
+
+    Args:
+        backend (str): "mongomock" for an in-memory database or "mongod" for a
+            database on a running mongod
+        host (str): host of the mongod
+        port (int): port of the mongod
+        name (str): name of the database. It is dropped if it exists!
+
+    Returns:
+        (Database)
+    """
+    if backend == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError("'mongomock' package is NOT installed but is required for "
+                               "the mongomock benchmark backend.")
+        client = mongomock.MongoClient()
+    elif backend == "mongod":
+        from pymongo import MongoClient
+        client = MongoClient(host, port)
+    else:
+        raise ValueError("Unknown benchmark backend: {}".format(backend))
+    client.drop_database(name)
+    return client[name]
+
+
+def get_synthetic_materials(n_materials):
+    """
+    Get distinct synthetic binary materials: the pairs of elements in the CsCl and NaCl
+    structures, which have the same formula but different structures.
+
+    Args:
+        n_materials (int): number of materials
+
+    Returns:
+        ([(Structure, int, str)]) structures with their space group numbers and symbols
+    """
+    materials = []
+    for i, a in enumerate(ELEMENTS):
+        for b in ELEMENTS[i + 1:]:
+            for _, sg_number, sg_symbol, coords in PROTOTYPES:
+                species = [a] * len(coords[0]) + [b] * len(coords[1])
+                structure = Structure(Lattice.cubic(4.0), species, coords[0] + coords[1])
+                materials.append((structure, sg_number, sg_symbol))
+                if len(materials) == n_materials:
+                    return materials
+    raise ValueError("At most {} synthetic materials are available.".format(len(materials)))
+
+
+def insert_synthetic_tasks(db, n_materials=100, tasks_per_material=3, seed=0):
+    """
+    Insert synthetic tasks in the tasks collection: tasks_per_material tasks of each
+    material, with different lattice constants and task labels. The dielectric tasks
+    have dielectric tensors, so that all the materials builders have work to do.
+
+    Args:
+        db (Database): the database
+        n_materials (int): number of distinct materials
+        tasks_per_material (int): number of tasks per material
+        seed (int): seed of the random energies and properties
+
+    Returns:
+        (int) number of inserted tasks
+    """
+    rng = random.Random(seed)
+    tasks = []
+    for structure, sg_number, sg_symbol in get_synthetic_materials(n_materials):
+        comp = structure.composition
+        elements = sorted(el.symbol for el in comp.elements)
+        for i in range(tasks_per_material):
+            s = structure.copy()
+            s.scale_lattice(structure.volume * (1 + 0.02 * i) ** 3)
+            energy_per_atom = -5 + rng.random()
+            bandgap = rng.random() * 3
+            output = {"structure": s.as_dict(),
+                      "spacegroup": {"number": sg_number, "symbol": sg_symbol},
+                      "energy": energy_per_atom * len(s), "energy_per_atom": energy_per_atom,
+                      "bandgap": bandgap, "cbm": bandgap, "vbm": 0.0,
+                      "is_gap_direct": rng.random() < 0.5, "is_metal": bandgap == 0}
+            task_label = TASK_LABELS[i % len(TASK_LABELS)]
+            if task_label == "static dielectric":
+                eps = 1 + rng.random() * 10
+                for k in ["epsilon_static", "epsilon_ionic", "epsilon_static_wolfe"]:
+                    output[k] = [[eps if r == c else 0.0 for c in range(3)] for r in range(3)]
+            tasks.append({
+                "task_id": len(tasks) + 1, "state": "successful", "task_label": task_label,
+                "formula_pretty": comp.reduced_formula,
+                "formula_reduced_abc": comp.reduced_composition.alphabetical_formula,
+                "formula_anonymous": comp.anonymized_formula, "elements": elements,
+                "nelements": len(elements), "chemsys": "-".join(elements),
+                "tags": ["benchmark", "set-{}".format(len(tasks) % 5)],
+                "input": {"is_hubbard": False, "hubbards": {},
+                          "potcar_spec": [{"titel": "PAW_PBE {} 01Jan2000".format(el),
+                                           "hash": None} for el in elements]},
+                "output": output})
+    db["tasks"].insert_many(tasks)
+    return len(tasks)
+
+
+def get_builders(db, counts):
+    """
+    Get the builders to benchmark, in the order they run, on counting collections.
+
+    Returns:
+        ([(AbstractBuilder, CountingCollection)]) each builder with the collection of the
+        documents it processes
+    """
+    cdb = CountingDatabase(db, counts)
+    tasks, materials, counter = cdb["tasks"], cdb["materials"], cdb["counter"]
+    # one process, so that all the calls are timed and counted
+    return [(TasksMaterialsBuilder(materials, counter, tasks, nproc=1), tasks),
+            (TagsBuilder(materials, tasks), tasks),
+            (MaterialsDescriptorBuilder(materials), materials),
+            (DielectricBuilder(materials), materials),
+            (BandgapEstimationBuilder(materials), materials)]
+
+
+def benchmark_builder(builder, source, counts, trace_memory=True):
+    """
+    Run a builder and measure it.
+
+    Args:
+        builder (AbstractBuilder): the builder
+        source (CountingCollection): collection of the documents the builder processes
+        counts (defaultdict): the call counts of the counting collections
+        trace_memory (bool): measure the peak memory allocated by the builder, at the
+            cost of slower allocations during the run
+
+    Returns:
+        (dict) the measurements; the peak memory is None if it is not measured
+    """
+    name = builder.__class__.__name__
+    n_docs = source.find({}).count()
+    timer = PhaseTimer()
+    for phase, methods in PHASE_METHODS.get(name, {}).items():
+        for method in methods:
+            timer.wrap(builder, method, phase)
+
+    counts.clear()
+    traced = trace_memory and start_memory_trace()
+    start = time.time()
+    try:
+        builder.run()
+    finally:
+        elapsed = time.time() - start
+        peak_memory = stop_memory_trace() if traced else None
+
+    phases = OrderedDict([("discovery", {"elapsed": elapsed - sum(timer.elapsed.values()),
+                                         "calls": 1})])
+    for phase in ["matching", "updating"]:
+        if phase in timer.elapsed:
+            phases[phase] = {"elapsed": timer.elapsed[phase], "calls": timer.calls[phase]}
+    db_calls = {c: dict(methods) for c, methods in counts.items()}
+    n_calls = sum(sum(methods.values()) for methods in db_calls.values())
+    return {"elapsed": elapsed, "n_docs": n_docs,
+            "docs_per_sec": n_docs / elapsed if elapsed else 0.0,
+            "db_calls": db_calls, "db_calls_per_doc": n_calls / n_docs if n_docs else 0.0,
+            "phases": phases, "peak_memory_mb": peak_memory}
+
+
+def run_benchmark(backend="mongomock", n_materials=100, tasks_per_material=3, seed=0,
+                  trace_memory=True, **db_kwargs):
+    """
+    Fill a scratch database with synthetic tasks and benchmark the builders on it.
+
+    Args:
+        backend (str): "mongomock" or "mongod", see get_scratch_database
+        n_materials (int): number of distinct materials
+        tasks_per_material (int): number of tasks per material
+        seed (int): seed of the synthetic data
+        trace_memory (bool): measure the peak memory of each builder, see
+            benchmark_builder
+        **db_kwargs: host, port and name of the scratch database
+
+    Returns:
+        (dict) the configuration, the environment, the measurements of each builder and
+        the peak resident memory of the process over the whole benchmark
+    """
+    db = get_scratch_database(backend, **db_kwargs)
+    start = time.time()
+    n_tasks = insert_synthetic_tasks(db, n_materials, tasks_per_material, seed=seed)
+    logger.info("Inserted {} synthetic tasks in {:.1f} s".format(n_tasks, time.time() - start))
+
+    counts = defaultdict(lambda: defaultdict(int))
+    results = OrderedDict()
+    for builder, source in get_builders(db, counts):
+        name = builder.__class__.__name__
+        logger.info("Benchmarking {}".format(name))
+        results[name] = benchmark_builder(builder, source, counts, trace_memory=trace_memory)
+
+    return {"config": {"backend": backend, "n_materials": n_materials,
+                       "tasks_per_material": tasks_per_material, "n_tasks": n_tasks,
+                       "seed": seed, "trace_memory": trace_memory},
+            "environment": {"python": platform.python_version(),
+                            "platform": platform.platform()},
+            "builders": results, "process_peak_rss_mb": get_peak_rss()}
+
+
+def compare_benchmarks(results, baseline, tolerance=0.2):
+    """
+    Find the regressions of a benchmark against a baseline run with the same
+    configuration.
+
+    Args:
+        results (dict): output of run_benchmark
+        baseline (dict): output of a previous run_benchmark
+        tolerance (float): allowed relative increase of the elapsed time and of the
+            database calls per document
+
+    Returns:
+        ([str]) descriptions of the regressions; empty if there are none
+    """
+    regressions = []
+    for name, r in results["builders"].items():
+        b = baseline["builders"].get(name)
+        if not b:
+            continue
+        for key in ["elapsed", "db_calls_per_doc"]:
+            if b[key] and r[key] > b[key] * (1 + tolerance):
+                regressions.append("{} {}: {:.3g} vs. {:.3g} in the baseline".format(
+                    name, key, r[key], b[key]))
+    return regressions
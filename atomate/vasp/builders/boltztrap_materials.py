@@ -7,10 +7,10 @@ from tqdm import tqdm
 from atomate.utils.utils import get_logger , get_database
 
 from pymatgen import Structure
-from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
 from pymatgen.electronic_structure.boltztrap import BoltztrapAnalyzer
 
-from atomate.vasp.builders.base import AbstractBuilder
+from atomate.vasp.builders.base import AbstractBuilder, BuilderState
+from atomate.vasp.builders.material_matcher import MaterialMatcher
 
 logger = get_logger(__name__)
 
@@ -18,6 +18,10 @@ __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
 class BoltztrapMaterialsBuilder(AbstractBuilder):
+
+    inputs = ("boltztrap", "materials")
+    outputs = ("transport",)
+
     def __init__(self, materials_write, boltztrap_read):
         """
         Update materials collection based on boltztrap collection.
@@ -28,48 +32,76 @@ class BoltztrapMaterialsBuilder(AbstractBuilder):
         """
         self._materials = materials_write
         self._boltztrap = boltztrap_read
+        # MaterialMatchers by (ltol, stol, angle_tol)
+        self._matchers = {}
 
     def run(self):
         logger.info("BoltztrapMaterialsBuilder starting...")
+        self.changed_material_ids = set()
         logger.info("Initializing list of all new boltztrap ids to process ...")
-        previous_oids = []
-        for m in self._materials.find({}, {"_boltztrapbuilder.all_object_ids": 1}):
-            if '_boltztrapbuilder' in m:
+        state = self._get_state()
+        if not state.exists:
+            previous_oids = []
+            for m in self._materials.find({"_boltztrapbuilder": {"$exists": True}},
+                                          {"_boltztrapbuilder.all_object_ids": 1}):
                 previous_oids.extend(m["_boltztrapbuilder"]["all_object_ids"])
-
-        if not previous_oids:
-            self._build_indexes()
-
-        all_btrap_ids = [i["_id"] for i in self._boltztrap.find({}, {"_id": 1})]
-        new_btrap_ids = [o_id for o_id in all_btrap_ids if o_id not in previous_oids]
-
-        logger.info("There are {} new boltztrap ids to process.".format(len(new_btrap_ids)))
-
-        pbar = tqdm(new_btrap_ids)
-        for o_id in pbar:
-            pbar.set_description("Processing object_id: {}".format(o_id))
-            try:
-                doc = self._boltztrap.find_one({"_id": o_id})
-                m_id = self._match_material(doc)
-                if not m_id:
-                    raise ValueError("Cannot find matching material for object_id: {}".format(o_id))
-                self._update_material(m_id, doc)
-            except:
-                import traceback
-                logger.exception("<---")
-                logger.exception("There was an error processing task_id: {}".format(o_id))
-                logger.exception(traceback.format_exc())
-                logger.exception("--->")
-
+            if not previous_oids:
+                self._build_indexes()
+            state.seed(previous_oids)
+
+        q = state.get_query("_id")
+        failed = []
+        max_oid = None
+        cutoff = state.get_cutoff()
+        pbar = tqdm(total=self._boltztrap.find(q).count())
+        # only the ids are read in chunks, the (large) documents one at a time
+        for chunk in self.find_chunks(self._boltztrap, q, {"_id": 1}):
+            btrap_ids = [i["_id"] for i in chunk]
+            settled = [o_id for o_id in btrap_ids
+                       if state.is_settled(o_id.generation_time, cutoff)]
+            if settled:
+                max_oid = settled[-1] if max_oid is None else max(max_oid, settled[-1])
+            previous_oids = state.get_processed(btrap_ids)
+            processed = []
+            for o_id in btrap_ids:
+                pbar.update(1)
+                if o_id in previous_oids:
+                    continue
+                pbar.set_description("Processing object_id: {}".format(o_id))
+                try:
+                    doc = self._boltztrap.find_one({"_id": o_id})
+                    m_id = self._match_material(doc)
+                    if not m_id:
+                        raise ValueError("Cannot find matching material for object_id: {}".format(o_id))
+                    self._update_material(m_id, doc)
+                    processed.append(o_id)
+                    self.changed_material_ids.add(m_id)
+                except:
+                    failed.append(o_id)
+                    import traceback
+                    logger.exception("<---")
+                    logger.exception("There was an error processing task_id: {}".format(o_id))
+                    logger.exception(traceback.format_exc())
+                    logger.exception("--->")
+            # an interrupted run does not process these again
+            state.add_processed(processed)
+        pbar.close()
+
+        state.update([], [] if max_oid is None else [max_oid], failed)
         logger.info("BoltztrapMaterialsBuilder finished processing.")
 
     def reset(self):
         logger.info("Resetting BoltztrapMaterialsBuilder")
         self._materials.update_many({}, {"$unset": {"_boltztrapbuilder": 1,
                                                     "transport": 1}})
+        self._get_state().reset()
         self._build_indexes()
         logger.info("Finished resetting BoltztrapMaterialsBuilder")
 
+    def _get_state(self):
+        return BuilderState(self._materials.database,
+                            "BoltztrapMaterialsBuilder.{}".format(self._materials.name))
+
     def _match_material(self, doc, ltol=0.2, stol=0.3, angle_tol=5):
         """
         Returns the material_id that has the same structure as this doc as
@@ -84,24 +116,15 @@ class BoltztrapMaterialsBuilder(AbstractBuilder):
         Returns:
             (int) matching material_id or None
         """
-        formula = doc["formula_reduced_abc"]
-        sgnum = doc["spacegroup"]["number"]
-
-        for m in self._materials.find({"formula_reduced_abc": formula, "sg_number": sgnum},
-                                      {"structure": 1, "material_id": 1}):
-
-            m_struct = Structure.from_dict(m["structure"])
-            t_struct = Structure.from_dict(doc["structure"])
-
-            sm = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
-                                  primitive_cell=True, scale=True,
-                                  attempt_supercell=False, allow_subset=False,
-                                  comparator=ElementComparator())
-
-            if sm.fit(m_struct, t_struct):
-                return m["material_id"]
-
-        return None
+        key = (ltol, stol, angle_tol)
+        if key not in self._matchers:
+            # the boltztrap runs are matched on the structures of the materials
+            self._matchers[key] = MaterialMatcher(self._materials, ltol=ltol, stol=stol,
+                                                  angle_tol=angle_tol,
+                                                  structure_field="structure")
+        q = {"formula_reduced_abc": doc["formula_reduced_abc"],
+             "sg_number": doc["spacegroup"]["number"]}
+        return self._matchers[key].match(Structure.from_dict(doc["structure"]), q)
 
     def _update_material(self, m_id, doc):
         """
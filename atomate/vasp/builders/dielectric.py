@@ -4,14 +4,20 @@ from atomate.utils.utils import get_logger
 
 import numpy as np
 
+from pymongo import UpdateOne
+
 from atomate.utils.utils import get_database
+from atomate.vasp.builders.base import AbstractBuilder, BuilderState
 
 logger = get_logger(__name__)
 
 __author__ = 'Shyue Ping Ong <ongsp@uscd.edu>, Anubhav Jain <ajain@lbl.gov>'
 
 
-class DielectricBuilder:
+class DielectricBuilder(AbstractBuilder):
+
+    inputs = ("materials",)
+    outputs = ("dielectric_avg",)
 
     def __init__(self, materials_write):
         """
@@ -25,27 +31,45 @@ class DielectricBuilder:
 
     def run(self):
         logger.info("EpsilonBuilder starting...")
-        q = {"dielectric": {"$exists": True}, "dielectric.eps_ionic_avg": {"$exists": False}}
-
-        for m in tqdm(self._materials.find(q, projection=["material_id", "dielectric"])):
-            try:
-                eps = m["dielectric"]
-                d = {}
-                eig_ionic = np.linalg.eig(eps["epsilon_ionic"])[0]
-                eig_static = np.linalg.eig(eps["epsilon_static"])[0]
-
-                d["dielectric.epsilon_ionic_avg"] = float(np.average(eig_ionic))
-                d["dielectric.epsilon_static_avg"] = float(np.average(eig_static))
-                d["dielectric.epsilon_avg"] = d["dielectric.epsilon_ionic_avg"] + \
-                                              d["dielectric.epsilon_static_avg"]
-                d["dielectric.has_neg_eps"] = bool(np.any(eig_ionic < -0.1) or
-                                                   np.any(eig_static < -0.1))
-
-                self._materials.update_one({"material_id": m["material_id"]}, {"$set": d})
-
-            except:
-                import traceback
-                logger.exception(traceback.format_exc())
+        self.changed_material_ids = set()
+        q = {"dielectric": {"$exists": True}}
+        missing = {"dielectric.eps_ionic_avg": {"$exists": False}}
+        if self.material_ids is not None:
+            # the materials that failed or were skipped before are retried too
+            q["$or"] = [{"material_id": {"$in": list(self.material_ids)}}, missing]
+        else:
+            q.update(missing)
+
+        pbar = tqdm(total=self._materials.find(q).count())
+        for mats in self.find_chunks(self._materials, q, ["material_id", "dielectric"],
+                                     state=self._get_state()):
+            requests = []
+            m_ids = []
+            for m in mats:
+                try:
+                    eps = m["dielectric"]
+                    d = {}
+                    eig_ionic = np.linalg.eig(eps["epsilon_ionic"])[0]
+                    eig_static = np.linalg.eig(eps["epsilon_static"])[0]
+
+                    d["dielectric.epsilon_ionic_avg"] = float(np.average(eig_ionic))
+                    d["dielectric.epsilon_static_avg"] = float(np.average(eig_static))
+                    d["dielectric.epsilon_avg"] = d["dielectric.epsilon_ionic_avg"] + \
+                                                  d["dielectric.epsilon_static_avg"]
+                    d["dielectric.has_neg_eps"] = bool(np.any(eig_ionic < -0.1) or
+                                                       np.any(eig_static < -0.1))
+
+                    requests.append(UpdateOne({"material_id": m["material_id"]}, {"$set": d}))
+                    m_ids.append(m["material_id"])
+
+                except:
+                    import traceback
+                    logger.exception(traceback.format_exc())
+            if requests:
+                self._materials.bulk_write(requests, ordered=False)
+                self.changed_material_ids.update(m_ids)
+            pbar.update(len(mats))
+        pbar.close()
 
         logger.info("EpsilonBuilder finished processing.")
 
@@ -57,10 +81,15 @@ class DielectricBuilder:
                 "dielectric.has_neg_eps"]
 
         self._materials.update_many({}, {"$unset": {k: "" for k in keys}})
+        self._get_state().reset()
         logger.info("Finished resetting EpsilonBuilder")
 
-    @staticmethod
-    def from_file(db_file, m="materials", **kwargs):
+    def _get_state(self):
+        return BuilderState(self._materials.database,
+                            "DielectricBuilder.{}".format(self._materials.name))
+
+    @classmethod
+    def from_file(cls, db_file, m="materials", **kwargs):
         """
         Get a MaterialsEhullBuilder using only a db file.
 
@@ -73,4 +102,4 @@ class DielectricBuilder:
             DielectricBuilder
         """
         db_write = get_database(db_file, admin=True)
-        return DielectricBuilder(db_write[m], **kwargs)
+        return cls(db_write[m], **kwargs)
@@ -10,6 +10,7 @@ from atomate.vasp.builders.dielectric import DielectricBuilder
 from atomate.vasp.builders.fix_tasks import FixTasksBuilder
 from atomate.vasp.builders.materials_descriptor import MaterialsDescriptorBuilder
 from atomate.vasp.builders.materials_ehull import MaterialsEhullBuilder
+from atomate.vasp.builders.pipeline import BuilderPipeline
 from atomate.vasp.builders.tags import TagsBuilder
 from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
 
@@ -24,13 +25,23 @@ if __name__ == "__main__":
     build_sequence = [FixTasksBuilder, TasksMaterialsBuilder, TagsBuilder,
                       MaterialsDescriptorBuilder, BandgapEstimationBuilder, DielectricBuilder,
                       BoltztrapMaterialsBuilder]
-    for cls in build_sequence:
-        b = cls.from_file(dbfile)
-        # b.reset()  # uncomment if you want to start a builder from scratch!
-        b.run()
+    builders = [cls.from_file(dbfile) for cls in build_sequence]
+    # for b in builders:
+    #     b.reset()  # uncomment if you want to start the builders from scratch!
+
+    # the builders run in the order given by their inputs and outputs, concurrently where
+    # possible; use full=False in later runs to only process the materials that changed
+    # upstream
+    metrics = BuilderPipeline(builders).run(full=True)
 
     # Uncomment below to run MP Ehull builder
 
     # mapi_key = None  # Replace with your Materials API key!
     # ehull_builder = MaterialsEhullBuilder.from_file(dbfile, mapi_key=mapi_key)
+    # ehull_builder.run()
+
+    # Without access to the Materials API, use a snapshot of the Materials Project entries
+    # saved elsewhere with materials_ehull.fetch_reference_entries
+
+    # ehull_builder = MaterialsEhullBuilder.from_file(dbfile, entries_file="mp_entries.json.gz")
     # ehull_builder.run()
\ No newline at end of file
@@ -17,6 +17,11 @@ __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
 class FileMaterialsBuilder(AbstractBuilder):
+
+    # the properties set from the file are not known in advance
+    inputs = ("materials",)
+    outputs = ("file_properties",)
+
     def __init__(self, materials_write, data_file, delimiter=",", header_lines=0):
         """
         Updates the database using a data file. Format of file must be:
@@ -39,9 +44,7 @@ class FileMaterialsBuilder(AbstractBuilder):
         logger.info("Starting FileMaterials Builder.")
         with open(self._data_file, 'rt') as f:
             line_no = 0
-            lines = [line for line in f]  # only good for smaller files
-            pbar = tqdm(lines)
-            for line in pbar:
+            for line in tqdm(f):
                 line = line.strip()
                 if line and not line.startswith("#"):
                     line_no += 1
@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import itertools
+
 from atomate.utils.utils import get_database
 
 from atomate.utils.utils import get_logger
@@ -13,6 +15,10 @@ __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
 class FixTasksBuilder(AbstractBuilder):
+
+    inputs = ("tasks",)
+    outputs = ("tasks",)
+
     def __init__(self, tasks_write):
         """
         Fix historical problems in the tasks database
@@ -23,29 +29,32 @@ class FixTasksBuilder(AbstractBuilder):
         self._tasks = tasks_write
 
     def run(self):
-        # change spacegroup numbers from string to integer where needed
         logger.info("FixTasksBuilder started.")
-        for t in self._tasks.find({"output.spacegroup.number": {"$type": 2}},
-                                  {"task_id": 1, "output": 1}):
+        # only the tasks are modified
+        self.changed_material_ids = set()
+
+        # change spacegroup numbers from string to integer where needed
+        for t in self._find({"output.spacegroup.number": {"$type": 2}},
+                            {"task_id": 1, "output": 1}):
             logger.info("Fixing string spacegroup, tid: {}".format(t["task_id"]))
             sg = int(t["output"]["spacegroup"]["number"])
             self._tasks.update_one({"task_id": t["task_id"]},
                                    {"$set": {"output.spacegroup.number": sg}})
 
         # change tags from string to list where needed
-        for t in self._tasks.find({"tags": {"$exists": True}, "tags.0": {"$exists": False}}, {"task_id": 1, "tags": 1}):
+        for t in self._find({"tags": {"$exists": True}, "tags.0": {"$exists": False}}, {"task_id": 1, "tags": 1}):
             logger.info("Fixing tag (converting to list), tid: {}".format(t["task_id"]))
             self._tasks.update_one({"task_id": t["task_id"]},
                                    {"$set": {"tags": [t["tags"]]}})
 
         # fix old (incorrect) delta volume percent
-        for t in self._tasks.find({"analysis.delta_volume_percent": {"$exists": True}, "analysis.delta_volume_as_percent": {"$exists": False}}, {"task_id": 1, "analysis": 1}):
+        for t in self._find({"analysis.delta_volume_percent": {"$exists": True}, "analysis.delta_volume_as_percent": {"$exists": False}}, {"task_id": 1, "analysis": 1}):
             logger.info("Converting delta_volume_percent to be on a percentage scale, tid: {}".format(t["task_id"]))
             self._tasks.update_one({"task_id": t["task_id"]},
                                    {"$set": {"analysis.delta_volume_as_percent": t["analysis"]["delta_volume_percent"] * 100}})
 
         # remove old (incorrect) delta volume percent
-        for t in self._tasks.find(
+        for t in self._find(
                 {"analysis.delta_volume_percent": {"$exists": True},
                  "analysis.delta_volume_as_percent": {"$exists": True}},
                 {"task_id": 1}):
@@ -56,6 +65,10 @@ class FixTasksBuilder(AbstractBuilder):
 
         logger.info("FixTasksBuilder finished.")
 
+    def _find(self, query, projection):
+        # the tasks are updated while they are read, so they are read in chunks
+        return itertools.chain.from_iterable(self.find_chunks(self._tasks, query, projection))
+
     def reset(self):
         logger.warning("Cannot reset FixTasksBuilder!")
 
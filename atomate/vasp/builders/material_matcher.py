@@ -0,0 +1,231 @@
+# coding: utf-8
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+from collections import OrderedDict
+
+from pymatgen import Structure
+from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
+
+__author__ = 'Anubhav Jain <ajain@lbl.gov>'
+
+"""
+Maps structures onto the materials of a materials collection with the StructureMatcher.
+The primitive structures of the materials are deserialized and reduced once per process:
+they are kept in a cache, with a bounded number of structures, that is shared by all the
+MaterialMatchers of the process, so the builders that merge other collections (tasks,
+boltztrap, ...) into the materials do not deserialize the materials again.
+
+The candidate materials are pre-filtered with the match index stored by the
+TasksMaterialsBuilder in "_tasksbuilder.match_index".
+"""
+
+# field of the materials documents with the match index
+MATCH_INDEX_KEY = "_tasksbuilder.match_index"
+
+# structures a material can be matched on: None for its parent structure if it has one
+# (what the TasksMaterialsBuilder matches tasks on), "structure" for its own structure
+STRUCTURE_FIELDS = (None, "structure")
+
+
+class StructureCache(object):
+    """
+    Thread-safe LRU cache of primitive structures by (materials collection, material_id).
+    """
+
+    def __init__(self, max_size=20000):
+        """
+        Args:
+            max_size (int): maximum number of structures kept
+        """
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            structure = self._cache.pop(key, None)
+            if structure is not None:
+                self._cache[key] = structure
+            return structure
+
+    def set(self, key, structure):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = structure
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def remove(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+# the cache shared by all the MaterialMatchers of the process
+STRUCTURE_CACHE = StructureCache()
+
+
+def get_match_index(structure):
+    """
+    Get the lattice invariants used to pre-filter the candidate materials before
+    structure matching. They do not depend on the volume, like the matcher (scale=True).
+
+    Args:
+        structure (Structure): the structure
+
+    Returns:
+        (dict, Structure) the match index, with the number of sites of the primitive
+        cell and the length of the shortest vector of its reduced lattice normalized
+        by the volume per site, and the primitive structure
+    """
+    prim = structure.get_primitive_structure()
+    lattice = prim.lattice.get_niggli_reduced_lattice()
+    shortest = min(lattice.abc) / (lattice.volume / len(prim)) ** (1 / 3)
+    return {"nsites": len(prim), "shortest": shortest}, prim
+
+
+def get_material_structure_dict(m, structure_field=None):
+    """
+    The structure a material is matched on.
+
+    Args:
+        m (dict): materials document
+        structure_field (str): one of STRUCTURE_FIELDS; by default the parent structure
+            of the material if it has one
+
+    Returns:
+        (dict) the structure
+    """
+    if structure_field is None:
+        return m["parent_structure"]["structure"] if "parent_structure" in m else m["structure"]
+    return m[structure_field]
+
+
+class MaterialMatcher(object):
+    """
+    Finds the material of a materials collection with the same structure as a given
+    structure. The materials are matched either on their parent structure, if they
+    have one, or on their own structure (see STRUCTURE_FIELDS); the primitive
+    structures are cached separately for each.
+    """
+
+    def __init__(self, materials, ltol=0.2, stol=0.3, angle_tol=5, cache=None,
+                 structure_field=None):
+        """
+        Args:
+            materials (pymongo.collection): materials collection
+            ltol (float): StructureMatcher tuning parameter
+            stol (float): StructureMatcher tuning parameter
+            angle_tol (float): StructureMatcher tuning parameter
+            cache (StructureCache): cache of the primitive structures of the materials.
+                Defaults to the cache shared by the process.
+            structure_field (str): one of STRUCTURE_FIELDS, the structure of the
+                materials to match on. The match index is computed from the parent
+                structure, so it only pre-filters the candidates with the default.
+        """
+        if structure_field not in STRUCTURE_FIELDS:
+            raise ValueError("Unknown structure field: {}".format(structure_field))
+        self._materials = materials
+        self.ltol = ltol
+        self.stol = stol
+        self.angle_tol = angle_tol
+        self.structure_field = structure_field
+        self.cache = STRUCTURE_CACHE if cache is None else cache
+        self.matcher = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
+                                        primitive_cell=True, scale=True,
+                                        attempt_supercell=False, allow_subset=False,
+                                        comparator=ElementComparator())
+
+    def _get_key(self, material_id, structure_field=None):
+        return self._materials.full_name, structure_field, material_id
+
+    def get_structure(self, m):
+        """
+        Args:
+            m (dict): materials document with the material_id and the structure (and
+                parent structure, if any); the structure is only read if not cached
+
+        Returns:
+            (Structure) the primitive structure of the material
+        """
+        key = self._get_key(m["material_id"], self.structure_field)
+        prim = self.cache.get(key)
+        if prim is None:
+            prim = Structure.from_dict(
+                get_material_structure_dict(m, self.structure_field)).get_primitive_structure()
+            self.cache.set(key, prim)
+        return prim
+
+    def add(self, material_id, prim):
+        """
+        Cache the primitive structure of a new material, i.e. of the structure it is
+        matched on.
+        """
+        self.cache.set(self._get_key(material_id, self.structure_field), prim)
+
+    def invalidate(self, material_id):
+        """
+        Forget the cached structures of a material, e.g. after its structure changed.
+        """
+        for structure_field in STRUCTURE_FIELDS:
+            self.cache.remove(self._get_key(material_id, structure_field))
+
+    def match(self, structure, query):
+        """
+        Get the material with the same structure as determined by the structure matcher.
+
+        Args:
+            structure (Structure): the structure to match
+            query (dict): pymongo query selecting the candidate materials, e.g. on the
+                formula and space group
+
+        Returns:
+            (str) the matching material_id or None if there is no match
+        """
+        index, prim = get_match_index(structure)
+        q = dict(query)
+        use_index = self.structure_field is None
+        if use_index:
+            q["$or"] = [{MATCH_INDEX_KEY + ".nsites": index["nsites"]},
+                        {MATCH_INDEX_KEY: {"$exists": False}}]
+        # loose bound: the matcher allows a fractional length mismatch of ltol
+        max_ratio = (1 + self.ltol) ** 2
+
+        for m in self._materials.find(q, {"material_id": 1, MATCH_INDEX_KEY: 1}):
+            m_index = m.get("_tasksbuilder", {}).get("match_index")
+            if m_index and use_index:
+                m_shortest = m_index["shortest"]
+                if max(m_shortest, index["shortest"]) > \
+                        max_ratio * min(m_shortest, index["shortest"]):
+                    continue
+            m_prim = self.cache.get(self._get_key(m["material_id"], self.structure_field))
+            if m_prim is None:
+                m_prim = self.get_structure(self._materials.find_one(
+                    {"material_id": m["material_id"]},
+                    {"material_id": 1, "parent_structure": 1, "structure": 1}))
+
+            if self.matcher.fit(m_prim, prim):
+                return m["material_id"]
+
+        return None
+
+    def backfill_match_index(self):
+        """
+        Add the match index to the materials created before it existed.
+        """
+        q = {MATCH_INDEX_KEY: {"$exists": False}}
+        for m in self._materials.find(q, {"parent_structure": 1, "structure": 1,
+                                           "material_id": 1}):
+            match_index, prim = get_match_index(
+                Structure.from_dict(get_material_structure_dict(m)))
+            self._materials.update_one({"material_id": m["material_id"]},
+                                       {"$set": {MATCH_INDEX_KEY: match_index}})
+            self.add(m["material_id"], prim)
@@ -1,59 +1,125 @@
+from multiprocessing import Pool
+
+import numpy as np
+from pymongo import UpdateOne
 from tqdm import tqdm
 
 from atomate.utils.utils import get_database
 
 from pymatgen import Structure
 from pymatgen.analysis.structure_analyzer import get_dimensionality
+from pymatgen.core.units import Length, Mass
 
 from atomate.utils.utils import get_logger
-from atomate.vasp.builders.base import AbstractBuilder
+from atomate.vasp.builders.base import AbstractBuilder, BuilderState
 
 logger = get_logger(__name__)
 
 __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
+# amu / A^3 -> g / cm^3, as in Structure.density
+DENSITY_FACTOR = float(Mass(1, "amu").to("g") / Length(1, "ang").to("cm") ** 3)
+
+
+def _get_weight_and_dimensionality(structure_dict):
+    # the per-structure part of the descriptors, run in the worker processes
+    struct = Structure.from_dict(structure_dict)
+    return struct.composition.weight, get_dimensionality(struct)
+
 
 class MaterialsDescriptorBuilder(AbstractBuilder):
-    def __init__(self, materials_write, update_all=False):
+
+    inputs = ("materials",)
+    outputs = ("descriptors",)
+
+    def __init__(self, materials_write, update_all=False, chunk_size=1000, nproc=1):
         """
         Starting with an existing materials collection, adds some compositional and structural
         descriptors.
+
+        The materials are processed in chunks: the dimensionality is computed in a pool of
+        processes, the volumes and densities of the whole chunk at once from the lattices,
+        and the chunk is written back with a single bulk write.
         
         Args:
             materials_write: mongodb collection for materials (write access needed)
             update_all: (bool) - if true, updates all docs. If false, updates incrementally
+            chunk_size: (int) number of materials processed and written together
+            nproc: (int) number of processes computing the dimensionality
         """
         self._materials = materials_write
         self.update_all = update_all
+        self.chunk_size = chunk_size
+        self.nproc = nproc
 
     def run(self):
         logger.info("MaterialsDescriptorBuilder starting...")
         self._build_indexes()
+        self.changed_material_ids = set()
 
         q = {}
-        if not self.update_all:
-            q["descriptors.density"] = {"$exists": False}
-
-        mats = [m for m in self._materials.find(q, {"structure": 1, "material_id": 1})]
-
-        pbar = tqdm(mats)
-        for m in pbar:
-            pbar.set_description("Processing materials_id: {}".format(m['material_id']))
-            struct = Structure.from_dict(m["structure"])
-            d = {"descriptors": {}}
-            d["descriptors"]["dimensionality"] = get_dimensionality(struct)
-            d["descriptors"]["density"] = struct.density
-            d["descriptors"]["nsites"] = len(struct)
-            d["descriptors"]["volume"] = struct.volume
+        missing = {"descriptors.density": {"$exists": False}}
+        if self.material_ids is not None:
+            ids = {"material_id": {"$in": list(self.material_ids)}}
+            # the materials that failed or were skipped before are retried too
+            q = ids if self.update_all else {"$or": [ids, missing]}
+        elif not self.update_all:
+            q = missing
+
+        pool = Pool(self.nproc) if self.nproc > 1 else None
+        try:
+            pbar = tqdm(total=self._materials.find(q).count())
+            for mats in self.find_chunks(self._materials, q, {"structure": 1, "material_id": 1},
+                                         state=self._get_state()):
+                self._process_chunk(mats, pool)
+                pbar.update(len(mats))
+            pbar.close()
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def _process_chunk(self, mats, pool=None):
+        """
+        Compute and write the descriptors of a chunk of materials.
 
-            self._materials.update_one({"material_id": m["material_id"]}, {"$set": d})
+        Args:
+            mats ([dict]): materials documents with the structure and material_id
+            pool (Pool): process pool for the dimensionality; the current process if None
+        """
+        structures = [m["structure"] for m in mats]
+        if pool:
+            results = pool.map(_get_weight_and_dimensionality, structures)
+        else:
+            results = [_get_weight_and_dimensionality(s) for s in structures]
+        weights = np.array([r[0] for r in results])
+
+        lattices = np.array([s["lattice"]["matrix"] for s in structures], dtype=float)
+        volumes = np.abs(np.linalg.det(lattices))
+        densities = weights / volumes * DENSITY_FACTOR
+
+        requests = []
+        for i, m in enumerate(mats):
+            d = {"descriptors": {"dimensionality": results[i][1],
+                                 "density": float(densities[i]),
+                                 "nsites": len(m["structure"]["sites"]),
+                                 "volume": float(volumes[i])}}
+            requests.append(UpdateOne({"material_id": m["material_id"]}, {"$set": d}))
+        if requests:
+            self._materials.bulk_write(requests, ordered=False)
+        self.changed_material_ids.update(m["material_id"] for m in mats)
 
     def reset(self):
         logger.info("Resetting MaterialsDescriptorBuilder")
         self._materials.update_many({}, {"$unset": {"descriptors": 1}})
+        self._get_state().reset()
         self._build_indexes()
         logger.info("Finished resetting MaterialsDescriptorBuilder")
 
+    def _get_state(self):
+        return BuilderState(self._materials.database,
+                            "MaterialsDescriptorBuilder.{}".format(self._materials.name))
+
     def _build_indexes(self):
         for i in ["descriptors.dimensionality", "descriptors.density", "descriptors.nsites"]:
             self._materials.create_index(i)
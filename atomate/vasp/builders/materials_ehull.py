@@ -2,11 +2,19 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import itertools
+from collections import defaultdict
+
 from tqdm import tqdm
 
+from monty.serialization import dumpfn, loadfn
+
 from atomate.utils.utils import get_database
 
 from pymatgen import MPRester, Structure
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
+from pymatgen.entries.compatibility import MaterialsProjectCompatibility
 from pymatgen.entries.computed_entries import ComputedEntry
 
 from atomate.utils.utils import get_logger
@@ -17,69 +25,161 @@ logger = get_logger(__name__)
 __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
+def fetch_reference_entries(chemsys, filename, mapi_key=None):
+    """
+    Save a snapshot of the Materials Project entries of some chemical systems, to be
+    used as the entries_file of a MaterialsEhullBuilder on a machine without access
+    to the Materials API. Run this where the API is reachable and copy the file.
+
+    Args:
+        chemsys ([str]): chemical systems, e.g. ["Li-Fe-O", "Na-Cl"]. The entries of
+            all their subsystems are included.
+        filename (str): output file, e.g. "mp_entries.json.gz"
+        mapi_key (str): Materials API key (if MAPI_KEY env. var. not set)
+
+    Returns:
+        (int) number of saved entries
+    """
+    mpr = MPRester(api_key=mapi_key)
+    entries = {}
+    for c in sorted(set(chemsys)):
+        for e in mpr.get_entries_in_chemsys(c.split("-"), compatible_only=True,
+                                            inc_structure=True):
+            entries[e.entry_id] = e
+    dumpfn(list(entries.values()), filename)
+    return len(entries)
+
+
 class MaterialsEhullBuilder(AbstractBuilder):
-    def __init__(self, materials_write, mapi_key=None, update_all=False):
+
+    inputs = ("materials",)
+    outputs = ("stability",)
+
+    def __init__(self, materials_write, mapi_key=None, update_all=False, entries_file=None):
         """
         Starting with an existing materials collection, adds stability information and
         The Materials Project ID.
+
+        The phase diagrams are computed locally, once per chemical system, from the
+        Materials Project entries of that system and the materials of the collection
+        itself. The Materials Project entries are fetched from the Materials API once
+        per chemical system or, offline, read from a snapshot file written by
+        fetch_reference_entries.
+
         Args:
             materials_write: mongodb collection for materials (write access needed)
             mapi_key: (str) Materials API key (if MAPI_KEY env. var. not set)
             update_all: (bool) - if true, updates all docs. If false, only updates
                 docs w/o a stability key
+            entries_file: (str) snapshot of Materials Project entries (a list of
+                ComputedStructureEntry in any format supported by loadfn). If set, the
+                Materials API is never used.
         """
         self._materials = materials_write
-        self.mpr = MPRester(api_key=mapi_key)
+        self.mapi_key = mapi_key
         self.update_all = update_all
+        self.entries_file = entries_file
+
+        self._compatibility = MaterialsProjectCompatibility()
+        self._matcher = StructureMatcher(primitive_cell=True, scale=True,
+                                         attempt_supercell=False, allow_subset=False,
+                                         comparator=ElementComparator())
+        self._mpr = None
+        # frozenset of elements -> Materials Project entries with exactly those elements
+        self._reference_entries = None
+        self._reference_ids = set()
+        self._fetched_chemsys = set()
+
+    @property
+    def mpr(self):
+        if self._mpr is None:
+            self._mpr = MPRester(api_key=self.mapi_key)
+        return self._mpr
 
     def run(self):
         logger.info("MaterialsEhullBuilder starting...")
         self._build_indexes()
+        self.changed_material_ids = set()
 
-        q = {"thermo.energy": {"$exists": True}}
-        if not self.update_all:
-            q["stability"] = {"$exists": False}
+        changed_systems = None
+        if self.material_ids is not None:
+            # a changed material changes the hull of all the systems that contain its elements
+            changed_systems = {frozenset(m["elements"]) for m in self._materials.find(
+                {"material_id": {"$in": list(self.material_ids)}}, {"elements": 1})}
 
-        mats = [m for m in self._materials.find(q, {"calc_settings": 1, "structure": 1,
-                                                    "thermo.energy": 1, "material_id": 1})]
-        pbar = tqdm(mats)
-        for m in pbar:
-            pbar.set_description("Processing materials_id: {}".format(m['material_id']))
-            try:
-                params = {}
-                for x in ["is_hubbard", "hubbards", "potcar_spec"]:
-                    params[x] = m["calc_settings"][x]
-
-                structure = Structure.from_dict(m["structure"])
-                energy = m["thermo"]["energy"]
-                my_entry = ComputedEntry(structure.composition, energy, parameters=params)
-
-                # TODO: @computron This only calculates Ehull with respect to Materials Project.
-                # It should also account for the current database's results. -computron
-                self._materials.update_one({"material_id": m["material_id"]},
-                                           {"$set": {"stability": self.mpr.get_stability([my_entry])[0]}})
-
-                # TODO: @computron: also add additional properties like inverse hull energy?
-
-                # TODO: @computron it's better to use PD tool or reaction energy calculator
-                # Otherwise the compatibility schemes might have issues...one strategy might be
-                # use MP only to retrieve entries but compute the PD locally -computron
-                for el, elx in my_entry.composition.items():
-                    entries = self.mpr.get_entries(el.symbol, compatible_only=True)
-                    min_e = min(entries, key=lambda x: x.energy_per_atom).energy_per_atom
-                    energy -= elx * min_e
-                self._materials.update_one({"material_id": m["material_id"]},
-                                           {"$set": {"thermo.formation_energy_per_atom": energy / structure.num_sites}})
-
-                mpids = self.mpr.find_structure(structure)
-                self._materials.update_one({"material_id": m["material_id"]}, {"$set": {"mpids": mpids}})
+        # the materials of the collection are part of the phase diagrams of all runs; their
+        # entries are corrected once here. Only the entries are kept, the structures of
+        # the materials to update are read again per chemical system.
+        own_entries = defaultdict(list)
+        to_update = set()
+        for mats in self.find_chunks(self._materials, {"thermo.energy": {"$exists": True}},
+                                     {"calc_settings": 1, "structure": 1, "thermo.energy": 1,
+                                      "material_id": 1, "stability": 1}):
+            for m in mats:
+                try:
+                    structure = Structure.from_dict(m["structure"])
+                    entry = self._compatibility.process_entry(self._get_entry(m, structure))
+                except:
+                    entry = None
+                if entry is None:
+                    logger.warning("No compatible entry for material_id: {}".format(
+                        m["material_id"]))
+                    continue
+                own_entries[frozenset(entry.composition.elements)].append(entry)
+                if changed_systems is not None:
+                    symbols = {el.symbol for el in entry.composition.elements}
+                    # the materials that never got a stability are retried as well
+                    update = any(c <= symbols for c in changed_systems) or \
+                        "stability" not in m
+                else:
+                    update = self.update_all or "stability" not in m
+                if update:
+                    to_update.add(m["material_id"])
 
+        # materials to update, grouped by chemical system
+        by_chemsys = defaultdict(list)
+        for entries in own_entries.values():
+            for entry in entries:
+                if entry.entry_id in to_update:
+                    by_chemsys[frozenset(entry.composition.elements)].append(entry)
+
+        # larger systems first, so that their subsystems need no more API calls
+        pbar = tqdm(sorted(by_chemsys.items(), key=lambda x: -len(x[0])))
+        for elements, entries in pbar:
+            chemsys = "-".join(sorted(el.symbol for el in elements))
+            pbar.set_description("Processing chemsys: {}".format(chemsys))
+            try:
+                ref_entries = self._get_reference_entries(elements)
+                pd = PhaseDiagram(ref_entries + self._get_subsystem_entries(own_entries,
+                                                                            elements))
+                elemental_energies = {el: pd.el_refs[el].energy_per_atom for el in elements}
+                m_ids = [e.entry_id for e in entries]
+                structures = {m["material_id"]: Structure.from_dict(m["structure"]) for m in
+                              self._materials.find({"material_id": {"$in": m_ids}},
+                                                   {"structure": 1, "material_id": 1})}
             except:
                 import traceback
                 logger.exception("<---")
-                logger.exception("There was an error processing material_id: {}".format(m))
+                logger.exception("There was an error processing chemsys: {}".format(chemsys))
                 logger.exception(traceback.format_exc())
                 logger.exception("--->")
+                continue
+
+            for my_entry in entries:
+                m_id = my_entry.entry_id
+                try:
+                    self._materials.update_one(
+                        {"material_id": m_id},
+                        {"$set": self._get_material_update(
+                            my_entry, structures[m_id], pd, elemental_energies,
+                            ref_entries)})
+                    self.changed_material_ids.add(m_id)
+                except:
+                    import traceback
+                    logger.exception("<---")
+                    logger.exception("There was an error processing material_id: {}".format(m_id))
+                    logger.exception(traceback.format_exc())
+                    logger.exception("--->")
 
         logger.info("MaterialsEhullBuilder finished processing.")
 
@@ -92,6 +192,92 @@ class MaterialsEhullBuilder(AbstractBuilder):
     def _build_indexes(self):
         self._materials.create_index("stability.e_above_hull")
 
+    @staticmethod
+    def _get_entry(m, structure):
+        params = {}
+        for x in ["is_hubbard", "hubbards", "potcar_spec"]:
+            params[x] = m["calc_settings"][x]
+        return ComputedEntry(structure.composition, m["thermo"]["energy"], parameters=params,
+                             entry_id=m["material_id"])
+
+    @staticmethod
+    def _get_subsystem_entries(entries, elements):
+        """
+        Args:
+            entries (dict): frozenset of elements -> entries with exactly those elements
+            elements (frozenset): elements of a chemical system
+
+        Returns:
+            ([ComputedEntry]) the entries of the chemical system and of all its subsystems
+        """
+        subsystem_entries = []
+        for n in range(1, len(elements) + 1):
+            for subsystem in itertools.combinations(elements, n):
+                subsystem_entries.extend(entries.get(frozenset(subsystem), []))
+        return subsystem_entries
+
+    def _get_reference_entries(self, elements):
+        """
+        The Materials Project entries of a chemical system and its subsystems, read from
+        the snapshot file or fetched once per chemical system from the Materials API.
+
+        Args:
+            elements (frozenset): elements of the chemical system
+
+        Returns:
+            ([ComputedStructureEntry])
+        """
+        if self._reference_entries is None:
+            self._reference_entries = defaultdict(list)
+            if self.entries_file:
+                for e in loadfn(self.entries_file):
+                    self._reference_entries[frozenset(e.composition.elements)].append(e)
+                logger.info("Loaded {} reference entries from {}".format(
+                    sum(len(x) for x in self._reference_entries.values()), self.entries_file))
+
+        # a system that was already fetched includes all its subsystems
+        if not self.entries_file and not any(elements <= c for c in self._fetched_chemsys):
+            for e in self.mpr.get_entries_in_chemsys([el.symbol for el in elements],
+                                                     compatible_only=True, inc_structure=True):
+                if e.entry_id not in self._reference_ids:
+                    self._reference_ids.add(e.entry_id)
+                    self._reference_entries[frozenset(e.composition.elements)].append(e)
+            self._fetched_chemsys.add(elements)
+
+        return self._get_subsystem_entries(self._reference_entries, elements)
+
+    def _get_material_update(self, my_entry, structure, pd, elemental_energies, ref_entries):
+        """
+        Args:
+            my_entry (ComputedEntry): corrected entry of the material
+            structure (Structure): structure of the material
+            pd (PhaseDiagram): phase diagram of the chemical system of the material
+            elemental_energies (dict): Element -> lowest energy per atom
+            ref_entries ([ComputedStructureEntry]): Materials Project entries of the
+                chemical system
+
+        Returns:
+            (dict) the fields to set in the materials document
+        """
+        decomp, e_above_hull = pd.get_decomp_and_e_above_hull(my_entry, allow_negative=True)
+        stability = {"e_above_hull": e_above_hull,
+                     "decomposes_to": [{"material_id": e.entry_id,
+                                        "formula": e.composition.reduced_formula,
+                                        "amount": amount} for e, amount in decomp.items()]}
+
+        energy = my_entry.uncorrected_energy
+        for el, elx in my_entry.composition.items():
+            energy -= elx * elemental_energies[el]
+
+        formula = my_entry.composition.reduced_formula
+        mpids = [e.entry_id for e in ref_entries
+                 if e.composition.reduced_formula == formula
+                 and self._matcher.fit(structure, e.structure)]
+
+        return {"stability": stability,
+                "thermo.formation_energy_per_atom": energy / structure.num_sites,
+                "mpids": mpids}
+
     @classmethod
     def from_file(cls, db_file, m="materials", **kwargs):
         """
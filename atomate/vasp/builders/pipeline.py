@@ -0,0 +1,163 @@
+# coding: utf-8
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from atomate.utils.utils import get_logger
+from atomate.vasp.builders.bandgap_estimation import BandgapEstimationBuilder
+from atomate.vasp.builders.boltztrap_materials import BoltztrapMaterialsBuilder
+from atomate.vasp.builders.dielectric import DielectricBuilder
+from atomate.vasp.builders.fix_tasks import FixTasksBuilder
+from atomate.vasp.builders.materials_descriptor import MaterialsDescriptorBuilder
+from atomate.vasp.builders.tags import TagsBuilder
+from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
+
+logger = get_logger(__name__)
+
+__author__ = 'Anubhav Jain <ajain@lbl.gov>'
+
+"""
+Runs a set of builders in the order given by the data they read and write. A builder
+runs after all the builders that write one of its inputs, and the builders that do not
+depend on each other run concurrently in threads. The material_ids changed by the
+upstream builders are passed on, so that the builders computing properties of existing
+materials only process the materials whose inputs changed.
+"""
+
+DEFAULT_BUILDERS = [FixTasksBuilder, TasksMaterialsBuilder, TagsBuilder,
+                    MaterialsDescriptorBuilder, DielectricBuilder, BandgapEstimationBuilder,
+                    BoltztrapMaterialsBuilder]
+
+
+class BuilderPipeline(object):
+    def __init__(self, builders, nthreads=None):
+        """
+        Args:
+            builders ([AbstractBuilder]): the builders, with their inputs and outputs
+            nthreads (int): maximum number of builders running at the same time. Defaults
+                to the number of builders that can run concurrently.
+        """
+        self.builders = builders
+        self.nthreads = nthreads
+        self.levels = self.get_levels()
+
+    def get_upstream(self, builder):
+        """
+        Args:
+            builder (AbstractBuilder): one of the builders
+
+        Returns:
+            ([AbstractBuilder]) the other builders writing an input of builder
+        """
+        return [b for b in self.builders
+                if b is not builder and set(b.outputs) & set(builder.inputs)]
+
+    def get_levels(self):
+        """
+        Sort the builders into levels, each level depending only on the previous ones.
+
+        Returns:
+            ([[AbstractBuilder]]) the levels, in the order they are run
+        """
+        levels = []
+        done = []
+        todo = list(self.builders)
+        while todo:
+            level = [b for b in todo
+                     if all(any(u is d for d in done) for u in self.get_upstream(b))]
+            if not level:
+                raise ValueError("The inputs and outputs of the builders have a cycle: {}".format(
+                    ", ".join(b.__class__.__name__ for b in todo)))
+            levels.append(level)
+            done.extend(level)
+            todo = [b for b in todo if not any(b is x for x in level)]
+        return levels
+
+    def run(self, full=False):
+        """
+        Run all the builders.
+
+        Args:
+            full (bool): let every builder find the materials to process on its own
+                instead of passing on the changed material_ids, e.g. for the first run
+
+        Returns:
+            (dict) metrics of each builder, by class name: elapsed time, number of
+            changed materials, throughput in changed materials per second and error
+            traceback (None if it succeeded)
+        """
+        metrics = {}
+        failed = []
+        for i, level in enumerate(self.levels):
+            logger.info("BuilderPipeline level {}: {}".format(
+                i, ", ".join(b.__class__.__name__ for b in level)))
+            for b in level:
+                b.material_ids = None if full else self._get_material_ids(b, failed)
+
+            nthreads = min(self.nthreads or len(level), len(level))
+            if nthreads > 1:
+                pool = ThreadPool(nthreads)
+                try:
+                    results = pool.map(self._run_builder, level)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [self._run_builder(b) for b in level]
+
+            for b, m in zip(level, results):
+                metrics[b.__class__.__name__] = m
+                if m["error"]:
+                    failed.append(b)
+
+        logger.info("BuilderPipeline finished: {}".format(", ".join(
+            "{} {:.1f} s ({} changed)".format(name, m["elapsed"], m["n_changed"])
+            for name, m in metrics.items())))
+        return metrics
+
+    def _get_material_ids(self, builder, failed):
+        """
+        The material_ids changed by the upstream builders, or None if there are no
+        upstream builders or any of them failed or does not track its changes.
+        """
+        upstream = self.get_upstream(builder)
+        if not upstream:
+            return None
+        material_ids = set()
+        for u in upstream:
+            if u.changed_material_ids is None or any(u is f for f in failed):
+                return None
+            material_ids.update(u.changed_material_ids)
+        return material_ids
+
+    @staticmethod
+    def _run_builder(builder):
+        name = builder.__class__.__name__
+        start = time.time()
+        error = None
+        try:
+            builder.run()
+        except:
+            error = traceback.format_exc()
+            logger.exception("There was an error running {}:\n{}".format(name, error))
+        elapsed = time.time() - start
+        n_changed = len(builder.changed_material_ids or [])
+        return {"elapsed": elapsed, "n_changed": n_changed,
+                "throughput": n_changed / elapsed if elapsed else 0.0, "error": error}
+
+    @classmethod
+    def from_file(cls, db_file, builders=None, **kwargs):
+        """
+        Get a BuilderPipeline using only a db file.
+
+        Args:
+            db_file (str): path to db file
+            builders ([class]): builder classes, created with their from_file. Defaults
+                to DEFAULT_BUILDERS.
+            **kwargs: other params to put into BuilderPipeline
+        """
+        builders = [b.from_file(db_file) for b in (builders or DEFAULT_BUILDERS)]
+        return cls(builders, **kwargs)
@@ -9,7 +9,7 @@ from atomate.utils.utils import get_database
 
 from atomate.utils.utils import get_logger
 from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
-from atomate.vasp.builders.base import AbstractBuilder
+from atomate.vasp.builders.base import AbstractBuilder, BuilderState
 
 logger = get_logger(__name__)
 
@@ -17,6 +17,10 @@ __author__ = 'Alireza Faghanina <albalu@lbl.gov>, Anubhav Jain <ajain@lbl.gov>'
 
 
 class TagsBuilder(AbstractBuilder):
+
+    inputs = ("tasks", "materials")
+    outputs = ("tags",)
+
     def __init__(self, materials_write, tasks_read, tasks_prefix="t"):
         """
         Starting with an existing materials collection, searches all its component tasks for 
@@ -35,58 +39,91 @@ class TagsBuilder(AbstractBuilder):
 
     def run(self):
         logger.info("TagsBuilder starting...")
+        self.changed_material_ids = set()
         self._build_indexes()
 
         logger.info("Initializing list of all new task_ids to process ...")
-        previous_task_ids = []
-        for m in self._materials.find({"_tagsbuilder": {"$exists": True}},
-                                      {"_tagsbuilder.all_task_ids": 1}):
-            previous_task_ids.extend(m["_tagsbuilder"]["all_task_ids"])
-
-        previous_task_ids = [dbid_to_int(t) for t in previous_task_ids]
-
-        q = {"tags": {"$exists": True}, "task_id": {"$nin": previous_task_ids},
-             "state": "successful"}
-
-        tasks = [t for t in self._tasks.find(q, {"task_id": 1, "tags": 1})]
-        pbar = tqdm(tasks)
-        for t in pbar:
-            try:
-                pbar.set_description("Processing task_id: {}".format(t['task_id']))
-
-                # get the corresponding materials id
-                m = self._materials.find_one({"_tasksbuilder.all_task_ids":
-                                                  dbid_to_str(self._tasks_prefix, t["task_id"])},
-                                             {"material_id": 1, "tags": 1,
-                                              "_tagsbuilder": 1})
-                if m:
-                    all_tags = t["tags"]
-                    if "tags" in m and m["tags"]:
-                        all_tags.extend(m["tags"])
-
-                    all_tasks = [dbid_to_str(self._tasks_prefix, t["task_id"])]
-                    if "_tagsbuilder" in m:
-                        all_tasks.extend(m["_tagsbuilder"]["all_task_ids"])
-
-                    all_tags = list(set(all_tags))  # filter duplicates
-                    self._materials.update_one({"material_id": m["material_id"]},
-                                               {"$set": {"tags": all_tags,
-                                                         "_tagsbuilder.all_task_ids": all_tasks}})
-
-            except:
-                import traceback
-                logger.exception("<---")
-                logger.exception("There was an error processing task_id: {}".format(t["task_id"]))
-                logger.exception(traceback.format_exc())
-                logger.exception("--->")
+        state = self._get_state()
+        if not state.exists:
+            previous_task_ids = []
+            for m in self._materials.find({"_tagsbuilder": {"$exists": True}},
+                                          {"_tagsbuilder.all_task_ids": 1}):
+                previous_task_ids.extend(m["_tagsbuilder"]["all_task_ids"])
+            state.seed([dbid_to_int(t) for t in previous_task_ids])
+
+        q = {"tags": {"$exists": True}, "state": "successful"}
+        q.update(state.get_query("task_id"))
+
+        # tasks without a material are not failures, but they are retried with the
+        # failed ones by the next runs, in case their material is created meanwhile
+        failed = []
+        no_material = []
+        max_task_id = None
+        cutoff = state.get_cutoff()
+        pbar = tqdm(total=self._tasks.find(q).count())
+        for candidates in self.find_chunks(self._tasks, q,
+                                           {"task_id": 1, "tags": 1, "last_updated": 1}):
+            previous_task_ids = state.get_processed([t["task_id"] for t in candidates])
+            processed = []
+            for t in candidates:
+                if state.is_settled(t.get("last_updated"), cutoff):
+                    max_task_id = t["task_id"] if max_task_id is None else \
+                        max(max_task_id, t["task_id"])
+                if t["task_id"] in previous_task_ids:
+                    continue
+                try:
+                    pbar.set_description("Processing task_id: {}".format(t['task_id']))
+
+                    # get the corresponding materials id
+                    m = self._materials.find_one({"_tasksbuilder.all_task_ids":
+                                                      dbid_to_str(self._tasks_prefix, t["task_id"])},
+                                                 {"material_id": 1, "tags": 1,
+                                                  "_tagsbuilder": 1})
+                    if m:
+                        all_tags = t["tags"]
+                        if "tags" in m and m["tags"]:
+                            all_tags.extend(m["tags"])
+
+                        all_tasks = [dbid_to_str(self._tasks_prefix, t["task_id"])]
+                        if "_tagsbuilder" in m:
+                            all_tasks.extend(m["_tagsbuilder"]["all_task_ids"])
+
+                        all_tags = list(set(all_tags))  # filter duplicates
+                        self._materials.update_one({"material_id": m["material_id"]},
+                                                   {"$set": {"tags": all_tags,
+                                                             "_tagsbuilder.all_task_ids": all_tasks}})
+                        processed.append(t["task_id"])
+                        self.changed_material_ids.add(m["material_id"])
+                    else:
+                        no_material.append(t["task_id"])
+
+                except Exception:
+                    failed.append(t["task_id"])
+                    import traceback
+                    logger.exception("<---")
+                    logger.exception("There was an error processing task_id: {}".format(t["task_id"]))
+                    logger.exception(traceback.format_exc())
+                    logger.exception("--->")
+            # an interrupted run does not process these again
+            state.add_processed(processed)
+            pbar.update(len(candidates))
+        pbar.close()
+        if no_material:
+            logger.info("{} tagged tasks have no material yet.".format(len(no_material)))
+        state.update([], [] if max_task_id is None else [max_task_id], failed + no_material)
         logger.info("TagsBuilder finished processing.")
 
     def reset(self):
         logger.info("Resetting TagsBuilder")
         self._materials.update_many({}, {"$unset": {"tags": 1, "_tagsbuilder": 1}})
+        self._get_state().reset()
         self._build_indexes()
         logger.info("Finished resetting TagsBuilder")
 
+    def _get_state(self):
+        return BuilderState(self._materials.database,
+                            "TagsBuilder.{}".format(self._materials.name))
+
     def _build_indexes(self):
         self._materials.create_index("tags")
         self._materials.create_index("_tagsbuilder.all_task_ids")
@@ -3,18 +3,22 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import os
+import traceback
+from collections import defaultdict, OrderedDict
 from datetime import datetime
+from multiprocessing import Pool
 
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
 from tqdm import tqdm
 
 from atomate.utils.utils import get_mongolike, get_logger
-from atomate.vasp.builders.base import AbstractBuilder
+from atomate.vasp.builders.base import AbstractBuilder, BuilderState
 from atomate.vasp.builders.utils import dbid_to_str, dbid_to_int
 from atomate.utils.utils import get_database
 from monty.serialization import loadfn
 from pymatgen import Structure
-from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
+
+from atomate.vasp.builders.material_matcher import MaterialMatcher, get_match_index
 
 logger = get_logger(__name__)
 
@@ -22,6 +26,22 @@ __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 module_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
 
+# the builder used by each worker process of a sharded run, set by the pool initializer
+_worker_builder = None
+
+
+def _init_worker(config):
+    global _worker_builder
+    kwargs = dict(config["kwargs"], nproc=1)
+    _worker_builder = TasksMaterialsBuilder.from_file(
+        config["db_file"], m=config["m"], c=config["c"], t=config["t"], **kwargs)
+
+
+def _process_group(task_ids):
+    _worker_builder.changed_material_ids = set()
+    failed = _worker_builder._process_tasks(task_ids)
+    return len(task_ids), failed, list(_worker_builder.changed_material_ids)
+
 """
 This class collects all "tasks" (individual calculations) on a single compound and produces a 
 summary report in a new collection ("materials"). The tasks are matched based on having the same 
@@ -32,8 +52,13 @@ There is lots of config for this builder in the accompanying "tasks_materials_se
 """
 
 class TasksMaterialsBuilder(AbstractBuilder):
+
+    inputs = ("tasks",)
+    outputs = ("materials",)
+
     def __init__(self, materials_write, counter_write, tasks_read, tasks_prefix="t",
-                 materials_prefix="m", query=None, settings_file=None):
+                 materials_prefix="m", query=None, settings_file=None, nproc=1,
+                 batch_size=100):
         """
         Create a materials collection from a tasks collection.
 
@@ -45,6 +70,12 @@ class TasksMaterialsBuilder(AbstractBuilder):
             materials_prefix (str): a string prefix to prepend to material_ids
             query (dict): a pymongo query on tasks_read for which tasks to include in the builder
             settings_file (str): filepath to a custom settings path
+            nproc (int): number of processes. With more than one, the new tasks are grouped
+                by formula_reduced_abc and the groups, which never match materials of
+                other groups, are processed in parallel. Requires a builder created with
+                from_file, since each process needs its own database connections.
+            batch_size (int): number of tasks whose material updates are written to the
+                database together
         """
 
         settings_file = settings_file or os.path.join(
@@ -67,13 +98,29 @@ class TasksMaterialsBuilder(AbstractBuilder):
         self._t_prefix = tasks_prefix
         self._m_prefix = materials_prefix
         self.query = query
+        self.nproc = nproc
+        self.batch_size = batch_size
+        # set by from_file, used to create the builders of the worker processes
+        self._config = None
+
+        # MaterialMatchers by (ltol, stol, angle_tol)
+        self._matchers = {}
+
+        # material updates not yet written: material_id -> {"metadata": prop_metadata as
+        # updated in memory, "set": fields to $set, "task_ids": task_ids to $push}
+        self._pending = OrderedDict()
 
     def run(self):
         logger.info("MaterialsTaskBuilder starting...")
+        self.changed_material_ids = set()
         logger.info("Initializing list of all new task_ids to process ...")
-        previous_task_ids = []
-        for m in self._materials.find({}, {"_tasksbuilder.all_task_ids": 1}):
-            previous_task_ids.extend(m["_tasksbuilder"]["all_task_ids"])
+        state = self._get_state()
+        if not state.exists:
+            logger.info("Seeding the builder state with the task_ids of the materials ...")
+            previous_task_ids = []
+            for m in self._materials.find({}, {"_tasksbuilder.all_task_ids": 1}):
+                previous_task_ids.extend(m["_tasksbuilder"]["all_task_ids"])
+            state.seed(previous_task_ids)
 
         q = {"state": "successful", "task_label": {"$in": self.supported_task_labels}}
 
@@ -83,35 +130,105 @@ class TasksMaterialsBuilder(AbstractBuilder):
                 raise ValueError("User query parameter cannot contain key(s): {}".
                                  format(common_keys))
             q.update(self.query)
-
-        all_task_ids = [dbid_to_str(self._t_prefix, t["task_id"]) for t in
-                        self._tasks.find(q, {"task_id": 1})]
-        task_ids = [t_id for t_id in all_task_ids if t_id not in previous_task_ids]
+        state_q = state.get_query("task_id")
+        if state_q:
+            q = {"$and": [q, state_q]}
+
+        # only the tasks written before the cutoff move the high-water mark, since
+        # insert_tasks may still be writing tasks with lower task_ids
+        formulas = OrderedDict()
+        marks = []
+        cutoff = state.get_cutoff()
+        for chunk in self.find_chunks(self._tasks, q, {"task_id": 1, "formula_reduced_abc": 1,
+                                                       "last_updated": 1}):
+            for t in chunk:
+                formulas[dbid_to_str(self._t_prefix, t["task_id"])] = t.get("formula_reduced_abc")
+                if state.is_settled(t.get("last_updated"), cutoff):
+                    marks.append(dbid_to_int(t["task_id"]))
+        previous_task_ids = state.get_processed(formulas.keys())
+        task_ids = [t_id for t_id in formulas if t_id not in previous_task_ids]
 
         logger.info("There are {} new task_ids to process.".format(len(task_ids)))
 
-        pbar = tqdm(task_ids)
+        self._get_matcher().backfill_match_index()
+
+        if self.nproc > 1 and self._config is None:
+            logger.warning("Sharded runs need a builder created with from_file; "
+                           "processing the tasks serially.")
+        if self.nproc > 1 and self._config is not None:
+            groups = defaultdict(list)
+            for t_id in task_ids:
+                groups[formulas[t_id]].append(t_id)
+            logger.info("Processing {} formula groups with {} processes.".format(
+                len(groups), self.nproc))
+            failed = []
+            pool = Pool(self.nproc, initializer=_init_worker, initargs=(self._config,))
+            try:
+                pbar = tqdm(total=len(task_ids))
+                for n, group_failed, group_changed in pool.imap_unordered(
+                        _process_group, list(groups.values())):
+                    failed.extend(group_failed)
+                    self.changed_material_ids.update(group_changed)
+                    pbar.update(n)
+                pbar.close()
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            failed = self._process_tasks(task_ids, progress=True)
+
+        state.update([], marks, [dbid_to_int(t_id) for t_id in failed])
+        logger.info("TasksMaterialsBuilder finished processing.")
+
+    def _get_state(self):
+        return BuilderState(self._materials.database,
+                            "TasksMaterialsBuilder.{}".format(self._materials.name))
+
+    def _process_tasks(self, task_ids, progress=False):
+        """
+        Match each task to a material, creating it if needed, and update the material.
+        The processed task_ids are recorded in the builder state as they are done.
+
+        Args:
+            task_ids ([str]): task_ids with prefix
+            progress (bool): show a progress bar
+
+        Returns:
+            ([str]) the task_ids that could not be processed
+        """
+        state = self._get_state()
+        failed = []
+        n_pending = 0
+        pbar = tqdm(task_ids) if progress else task_ids
         for t_id in pbar:
-            pbar.set_description("Processing task_id: {}".format(t_id))
+            if progress:
+                pbar.set_description("Processing task_id: {}".format(t_id))
             try:
                 taskdoc = self._tasks.find_one({"task_id": dbid_to_int(t_id)})
                 m_id = self._match_material(taskdoc)
                 if not m_id:
                     m_id = self._create_new_material(taskdoc)
                 self._update_material(m_id, taskdoc)
+                n_pending += 1
+                if n_pending >= self.batch_size:
+                    # a task only counts as processed once its material update is written
+                    state.add_processed(self._flush_updates())
+                    n_pending = 0
 
             except:
-                import traceback
+                failed.append(t_id)
                 logger.exception("<---")
                 logger.exception("There was an error processing task_id: {}".format(t_id))
                 logger.exception(traceback.format_exc())
                 logger.exception("--->")
-
-        logger.info("TasksMaterialsBuilder finished processing.")
+        state.add_processed(self._flush_updates())
+        return failed
 
     def reset(self):
         logger.info("Resetting TasksMaterialsBuilder")
         self._materials.delete_many({})
+        self._get_state().reset()
+        self._get_matcher().cache.clear()
         self._counter.delete_one({"_id": "materialid"})
         self._counter.insert_one({"_id": "materialid", "c": 0})
         self._build_indexes()
@@ -136,7 +253,9 @@ class TasksMaterialsBuilder(AbstractBuilder):
         except:
             logger.warning("Warning: could not get read-only database; using write creds")
             db_read = get_database(db_file, admin=True)
-        return cls(db_write[m], db_write[c], db_read[t], **kwargs)
+        builder = cls(db_write[m], db_write[c], db_read[t], **kwargs)
+        builder._config = {"db_file": db_file, "m": m, "c": c, "t": t, "kwargs": kwargs}
+        return builder
 
     def _build_indexes(self):
         """
@@ -146,10 +265,18 @@ class TasksMaterialsBuilder(AbstractBuilder):
         for index in self.indexes:
             self._materials.create_index(index)
 
+    def _get_matcher(self, ltol=0.2, stol=0.3, angle_tol=5):
+        key = (ltol, stol, angle_tol)
+        if key not in self._matchers:
+            self._matchers[key] = MaterialMatcher(self._materials, ltol=ltol, stol=stol,
+                                                  angle_tol=angle_tol)
+        return self._matchers[key]
+
     def _match_material(self, taskdoc, ltol=0.2, stol=0.3, angle_tol=5):
         """
         Returns the material_id that has the same structure as this task as
          determined by the structure matcher. Returns None if no match.
+        The primitive structures of the materials are cached by the MaterialMatcher.
 
         Args:
             taskdoc (dict): a JSON-like task document
@@ -173,19 +300,7 @@ class TasksMaterialsBuilder(AbstractBuilder):
             t_struct = Structure.from_dict(taskdoc["output"]["structure"])
             q = {"formula_reduced_abc": formula, "sg_number": sgnum}
 
-        for m in self._materials.find(q, {"parent_structure": 1, "structure": 1, "material_id": 1}):
-            s_dict = m["parent_structure"]["structure"] if "parent_structure" in m else m[
-                "structure"]
-            m_struct = Structure.from_dict(s_dict)
-            sm = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
-                                  primitive_cell=True, scale=True,
-                                  attempt_supercell=False, allow_subset=False,
-                                  comparator=ElementComparator())
-
-            if sm.fit(m_struct, t_struct):
-                return m["material_id"]
-
-        return None
+        return self._get_matcher(ltol, stol, angle_tol).match(t_struct, q)
 
     def _create_new_material(self, taskdoc):
         """
@@ -219,8 +334,12 @@ class TasksMaterialsBuilder(AbstractBuilder):
             doc["parent_structure"] = taskdoc["parent_structure"]
             t_struct = Structure.from_dict(taskdoc["parent_structure"]["structure"])
             doc["parent_structure"]["formula_reduced_abc"] = t_struct.composition.reduced_formula
+        else:
+            t_struct = Structure.from_dict(doc["structure"])
 
+        doc["_tasksbuilder"]["match_index"], prim = get_match_index(t_struct)
         self._materials.insert_one(doc)
+        self._get_matcher().add(doc["material_id"], prim)
 
         return doc["material_id"]
 
@@ -233,14 +352,26 @@ class TasksMaterialsBuilder(AbstractBuilder):
             taskdoc (dict): a JSON-like task document
         """
 
+        # the material as updated by the previous tasks of the batch, or as in the database
+        pending = self._pending.get(m_id)
+        if pending is None:
+            prop_metadata = self._materials.find_one(
+                {"material_id": m_id}, {"_tasksbuilder.prop_metadata": 1})[
+                "_tasksbuilder"]["prop_metadata"]
+            pending = {"metadata": prop_metadata, "set": {}, "task_ids": []}
+            self._pending[m_id] = pending
+        prop_metadata = pending["metadata"]
+        prop_metadata.setdefault("task_ids", {})
+        prop_metadata.setdefault("energies", {})
+
         # For each materials property, figure out what kind of task the data is currently based on
         # as defined by the task label.  This is used to decide if the new taskdoc is a type of
         # calculation that provides higher quality data for that property
-        prop_tlabels = self._materials.find_one(
-            {"material_id": m_id}, {"_tasksbuilder.prop_metadata.labels": 1})[
-            "_tasksbuilder"]["prop_metadata"]["labels"]
+        prop_tlabels = prop_metadata["labels"]
 
         task_label = taskdoc["task_label"]  # task label of new doc that updates this material
+        t_id = dbid_to_str(self._t_prefix, taskdoc["task_id"])
+        energy = taskdoc["output"]["energy_per_atom"]
 
         # figure out what materials properties need to be updated based on new task
         for x in self.property_settings:
@@ -258,10 +389,7 @@ class TasksMaterialsBuilder(AbstractBuilder):
                     # iii) task quality equal to materials; use lowest energy task
                     if not m_quality or t_quality > m_quality \
                             or (t_quality == m_quality
-                                and taskdoc["output"]["energy_per_atom"] <
-                                    self._materials.find_one({"material_id": m_id}, {
-                                        "_tasksbuilder": 1})["_tasksbuilder"]["prop_metadata"][
-                                        "energies"][p]):
+                                and energy < prop_metadata["energies"][p]):
 
                         # this task has better quality data
                         # figure out where the property data lives in the materials doc and
@@ -270,25 +398,49 @@ class TasksMaterialsBuilder(AbstractBuilder):
                             if x.get("materials_key") else p
                         tasks_key = "{}.{}".format(x["tasks_key"], p) \
                             if x.get("tasks_key") else p
+                        value = get_mongolike(taskdoc, tasks_key)
 
                         # insert property data AND metadata about this task
-                        self._materials.\
-                            update_one({"material_id": m_id},
-                                       {"$set": {materials_key: get_mongolike(taskdoc, tasks_key),
-                                                 "_tasksbuilder.prop_metadata.labels.{}".format(p): task_label,
-                                                 "_tasksbuilder.prop_metadata.task_ids.{}".format(p): dbid_to_str(
-                                                     self._t_prefix, taskdoc["task_id"]),
-                                                 "_tasksbuilder.prop_metadata.energies.{}".format(p): taskdoc["output"]["energy_per_atom"],
-                                                 "_tasksbuilder.updated_at": datetime.utcnow()}})
+                        pending["set"].update({
+                            materials_key: value,
+                            "_tasksbuilder.prop_metadata.labels.{}".format(p): task_label,
+                            "_tasksbuilder.prop_metadata.task_ids.{}".format(p): t_id,
+                            "_tasksbuilder.prop_metadata.energies.{}".format(p): energy,
+                            "_tasksbuilder.updated_at": datetime.utcnow()})
+                        prop_tlabels[p] = task_label
+                        prop_metadata["task_ids"][p] = t_id
+                        prop_metadata["energies"][p] = energy
 
                         # copy property to document root if in properties_root
                         # i.e., intentionally duplicate some data to the root level
                         if p in self.properties_root:
-                            self._materials.\
-                            update_one({"material_id": m_id},
-                                       {"$set": {p: get_mongolike(taskdoc, tasks_key)}})
-
-        # update the database to reflect that this task_id was already processed
-        self._materials.update_one({"material_id": m_id},
-                                   {"$push": {"_tasksbuilder.all_task_ids": dbid_to_str(
-                                       self._t_prefix, taskdoc["task_id"])}})
+                            pending["set"][p] = value
+
+        # record that this task_id was processed, see _flush_updates
+        pending["task_ids"].append(t_id)
+
+    def _flush_updates(self):
+        """
+        Write the pending material updates, with one update per material in a single
+        bulk write.
+
+        Returns:
+            ([str]) the task_ids whose updates were written
+        """
+        requests = []
+        task_ids = []
+        for m_id, pending in self._pending.items():
+            update = {"$push": {"_tasksbuilder.all_task_ids": {"$each": pending["task_ids"]}}}
+            if pending["set"]:
+                update["$set"] = pending["set"]
+            requests.append(UpdateOne({"material_id": m_id}, update))
+            task_ids.extend(pending["task_ids"])
+        if requests:
+            self._materials.bulk_write(requests)
+        for m_id, pending in self._pending.items():
+            if "structure" in pending["set"]:
+                self._get_matcher().invalidate(m_id)
+        if self.changed_material_ids is not None:
+            self.changed_material_ids.update(self._pending)
+        self._pending = OrderedDict()
+        return task_ids
@@ -0,0 +1 @@
+__author__ = 'Anubhav Jain <ajain@lbl.gov>'
@@ -0,0 +1,85 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import unittest
+from datetime import datetime, timedelta
+
+from bson.tz_util import utc
+
+from atomate.vasp.builders.base import BuilderState
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+__author__ = 'Kiran Mathew'
+__email__ = 'kmathew@lbl.gov'
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class BuilderStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient()["atomate_unittest"]
+        self.state = BuilderState(self.db, "TestBuilder.materials")
+
+    def test_seed(self):
+        self.assertFalse(self.state.exists)
+        self.state.seed([1, 2])
+        self.assertTrue(self.state.exists)
+        self.assertEqual(self.state.get_processed([1, 2, 3]), {1, 2})
+        self.assertIsNone(self.state.high_water_mark)
+        # everything is looked at until there is a high-water mark
+        self.assertEqual(self.state.get_query("task_id"), {})
+
+        # the states of the builders are separate
+        other = BuilderState(self.db, "OtherBuilder.materials")
+        self.assertFalse(other.exists)
+        self.assertEqual(other.get_processed([1, 2, 3]), set())
+
+    def test_update(self):
+        self.state.update([3, 5], [5, 7, 3], failed_marks=[4, 2, 4])
+        self.assertEqual(self.state.high_water_mark, 7)
+        self.assertEqual(self.state.retry, [2, 4])
+        self.assertEqual(self.state.get_processed([2, 3, 4, 5]), {3, 5})
+        self.assertEqual(self.state.get_query("task_id"),
+                         {"$or": [{"task_id": {"$gte": 7}}, {"task_id": {"$in": [2, 4]}}]})
+
+        # the high-water mark never goes down and the retry set is replaced
+        self.state.update([4], [6])
+        self.assertEqual(self.state.high_water_mark, 7)
+        self.assertEqual(self.state.retry, [])
+        self.assertEqual(self.state.get_query("task_id"), {"task_id": {"$gte": 7}})
+
+        # without settled documents the high-water mark stays where it is
+        self.state.update([], [], failed_marks=[8])
+        self.assertEqual(self.state.high_water_mark, 7)
+        self.assertEqual(self.state.retry, [8])
+
+    def test_is_settled(self):
+        cutoff = self.state.get_cutoff()
+        now = datetime.utcnow()
+        self.assertTrue(BuilderState.is_settled(None, cutoff))
+        self.assertFalse(BuilderState.is_settled(now, cutoff))
+        self.assertTrue(BuilderState.is_settled(now - self.state.lag - timedelta(minutes=1),
+                                                cutoff))
+        # the dates of ObjectIds are timezone aware
+        self.assertFalse(BuilderState.is_settled(now.replace(tzinfo=utc), cutoff))
+
+    def test_checkpoint_and_reset(self):
+        self.state.set_checkpoint("tasks", 10)
+        self.assertEqual(self.state.get_checkpoint("tasks"), 10)
+        self.assertIsNone(self.state.get_checkpoint("materials"))
+        self.state.update([1], [1], failed_marks=[2])
+
+        self.state.reset()
+        self.assertFalse(self.state.exists)
+        self.assertIsNone(self.state.high_water_mark)
+        self.assertEqual(self.state.retry, [])
+        self.assertEqual(self.state.get_processed([1]), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import unittest
+
+from atomate.vasp.builders.benchmark import compare_benchmarks, start_memory_trace, \
+    stop_memory_trace
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__author__ = 'Anubhav Jain'
+__email__ = 'ajain@lbl.gov'
+
+
+def get_results(**builders):
+    return {"builders": {name: {"elapsed": elapsed, "db_calls_per_doc": calls}
+                         for name, (elapsed, calls) in builders.items()}}
+
+
+class CompareBenchmarksTest(unittest.TestCase):
+
+    def test_no_regression(self):
+        baseline = get_results(TagsBuilder=(1.0, 2.0), DielectricBuilder=(2.0, 1.0))
+        results = get_results(TagsBuilder=(1.1, 2.0), DielectricBuilder=(1.0, 0.5))
+        self.assertEqual(compare_benchmarks(results, baseline), [])
+        self.assertEqual(compare_benchmarks(baseline, baseline, tolerance=0), [])
+
+    def test_regressions(self):
+        baseline = get_results(TagsBuilder=(1.0, 2.0), DielectricBuilder=(2.0, 1.0))
+        results = get_results(TagsBuilder=(1.5, 2.0), DielectricBuilder=(2.0, 1.3))
+        regressions = compare_benchmarks(results, baseline)
+        self.assertEqual(sorted(r.split(":")[0] for r in regressions),
+                         ["DielectricBuilder db_calls_per_doc", "TagsBuilder elapsed"])
+        # the tolerance is relative
+        self.assertEqual(compare_benchmarks(results, baseline, tolerance=0.5), [])
+
+    def test_new_builder(self):
+        # builders missing from the baseline and zero baselines are not compared
+        baseline = get_results(TagsBuilder=(0.0, 0.0))
+        results = get_results(TagsBuilder=(1.0, 1.0), DielectricBuilder=(5.0, 5.0))
+        self.assertEqual(compare_benchmarks(results, baseline), [])
+
+
+class MemoryTraceTest(unittest.TestCase):
+
+    @unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+    def test_peak_memory(self):
+        self.assertTrue(start_memory_trace())
+        data = bytearray(20 * 1024 ** 2)
+        del data
+        self.assertGreaterEqual(stop_memory_trace(), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import unittest
+
+from pymatgen import Lattice, Structure
+
+from atomate.vasp.builders.material_matcher import MaterialMatcher, StructureCache, \
+    get_match_index, MATCH_INDEX_KEY
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+__author__ = 'Anubhav Jain'
+__email__ = 'ajain@lbl.gov'
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class MaterialMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.materials = mongomock.MongoClient()["atomate_unittest"]["materials"]
+        self.cscl = Structure(Lattice.cubic(4.1), ["Cs", "Cl"],
+                              [[0, 0, 0], [0.5, 0.5, 0.5]])
+        self.nacl = Structure.from_spacegroup("Fm-3m", Lattice.cubic(6.9), ["Cs", "Cl"],
+                                              [[0, 0, 0], [0.5, 0.5, 0.5]])
+        # a material matched on its parent structure but with another final structure
+        match_index, _ = get_match_index(self.nacl)
+        self.materials.insert_one({
+            "material_id": "mp-1", "formula_reduced_abc": "Cl1 Cs1",
+            "structure": self.cscl.as_dict(),
+            "parent_structure": {"structure": self.nacl.as_dict()},
+            "_tasksbuilder": {"match_index": match_index}})
+        self.cache = StructureCache()
+
+    def test_match_parent_structure(self):
+        matcher = MaterialMatcher(self.materials, cache=self.cache)
+        q = {"formula_reduced_abc": "Cl1 Cs1"}
+        self.assertEqual(matcher.match(self.nacl, q), "mp-1")
+        self.assertIsNone(matcher.match(self.cscl, q))
+        self.assertIsNone(matcher.match(self.nacl, {"formula_reduced_abc": "Cl1 Na1"}))
+
+    def test_match_structure(self):
+        parent_matcher = MaterialMatcher(self.materials, cache=self.cache)
+        matcher = MaterialMatcher(self.materials, cache=self.cache,
+                                  structure_field="structure")
+        q = {"formula_reduced_abc": "Cl1 Cs1"}
+        self.assertEqual(parent_matcher.match(self.nacl, q), "mp-1")
+        # the structures are cached separately, and the match index of the parent
+        # structure does not exclude the material
+        self.assertEqual(matcher.match(self.cscl, q), "mp-1")
+        self.assertIsNone(matcher.match(self.nacl, q))
+        self.assertEqual(len(self.cache), 2)
+
+        matcher.invalidate("mp-1")
+        self.assertEqual(len(self.cache), 0)
+
+        with self.assertRaises(ValueError):
+            MaterialMatcher(self.materials, structure_field="parent_structure")
+
+    def test_backfill_match_index(self):
+        self.materials.update_one({"material_id": "mp-1"},
+                                  {"$unset": {"_tasksbuilder": 1}})
+        MaterialMatcher(self.materials, cache=self.cache).backfill_match_index()
+        m = self.materials.find_one({"material_id": "mp-1"})
+        self.assertEqual(m["_tasksbuilder"]["match_index"]["nsites"], 2)
+        self.assertIsNotNone(self.materials.find_one({MATCH_INDEX_KEY: {"$exists": True}}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import unittest
+
+from atomate.vasp.builders.base import AbstractBuilder
+from atomate.vasp.builders.pipeline import BuilderPipeline
+
+__author__ = 'Anubhav Jain'
+__email__ = 'ajain@lbl.gov'
+
+
+class FakeBuilder(AbstractBuilder):
+
+    def __init__(self, name, inputs, outputs, changed=None, error=False):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.changed = changed
+        self.error = error
+        self.received_material_ids = "not run"
+
+    def run(self):
+        self.received_material_ids = self.material_ids
+        if self.error:
+            raise RuntimeError("{} failed".format(self.name))
+        self.changed_material_ids = self.changed
+
+    def reset(self):
+        pass
+
+
+def get_names(levels):
+    return [sorted(b.name for b in level) for level in levels]
+
+
+class BuilderPipelineTest(unittest.TestCase):
+
+    def test_get_levels(self):
+        tasks = FakeBuilder("tasks", ("tasks",), ("materials",))
+        tags = FakeBuilder("tags", ("tasks", "materials"), ("tags",))
+        ehull = FakeBuilder("ehull", ("materials",), ("stability",))
+        report = FakeBuilder("report", ("tags", "stability"), ())
+        # the order of the builders does not matter
+        pipeline = BuilderPipeline([report, ehull, tags, tasks])
+        self.assertEqual(get_names(pipeline.levels),
+                         [["tasks"], ["ehull", "tags"], ["report"]])
+
+    def test_missing_inputs(self):
+        # inputs that no builder writes, e.g. the tasks collection, do not hold back
+        a = FakeBuilder("a", ("tasks",), ("materials",))
+        b = FakeBuilder("b", ("boltztrap",), ("transport",))
+        c = FakeBuilder("c", ("materials", "dielectric"), ())
+        pipeline = BuilderPipeline([a, b, c])
+        self.assertEqual(get_names(pipeline.levels), [["a", "b"], ["c"]])
+
+    def test_own_output(self):
+        # a builder reading what it writes does not depend on itself
+        a = FakeBuilder("a", ("materials",), ("materials",))
+        self.assertEqual(get_names(BuilderPipeline([a]).levels), [["a"]])
+
+    def test_cycle(self):
+        a = FakeBuilder("a", ("x",), ("y",))
+        b = FakeBuilder("b", ("y",), ("z",))
+        c = FakeBuilder("c", ("z",), ("x",))
+        d = FakeBuilder("d", ("tasks",), ("w",))
+        with self.assertRaises(ValueError) as cm:
+            BuilderPipeline([a, b, c, d])
+        self.assertIn("FakeBuilder", str(cm.exception))
+
+    def test_run(self):
+        tasks = FakeBuilder("tasks", ("tasks",), ("materials",), changed={"mp-1"})
+        tags = FakeBuilder("tags", ("materials",), ("tags",), error=True)
+        ehull = FakeBuilder("ehull", ("materials",), ("stability",), changed=set())
+        report = FakeBuilder("report", ("tags", "stability"), ())
+        BuilderPipeline([tasks, tags, ehull, report], nthreads=2).run()
+        self.assertIsNone(tasks.received_material_ids)
+        self.assertEqual(ehull.received_material_ids, {"mp-1"})
+        # the downstream builders of a failed builder look for their work themselves
+        self.assertIsNone(report.received_material_ids)
+
+        BuilderPipeline([tasks, tags, ehull, report]).run(full=True)
+        self.assertIsNone(ehull.received_material_ids)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+"""
+This module defines a columnar storage format for band structures and densities of
+states in GridFS. The arrays (energies, bands, k-points, projections, site and
+element projected DOS) are stored as separately compressed segments after a JSON
+header that records their offsets, so that readers can seek to and decode only the
+segments they need, e.g. the total DOS without the projections.
+"""
+
+import json
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+from monty.json import MontyEncoder
+
+from pymatgen.core.periodic_table import Element
+from pymatgen.core.structure import Structure
+from pymatgen.electronic_structure.bandstructure import BandStructure, BandStructureSymmLine
+from pymatgen.electronic_structure.core import Orbital, OrbitalType, Spin
+from pymatgen.electronic_structure.dos import CompleteDos, Dos
+
+from atomate.utils.compression import compress, decompress
+
+__author__ = 'Kiran Mathew'
+__email__ = 'kmathew@lbl.gov'
+
+# first bytes of the columnar format; JSON blobs start with "{"
+COLUMNAR_MAGIC = b"ATOMATE-COLUMNAR-1\n"
+
+
+def _pack(cls_name, meta, arrays, codec="zlib", level=None):
+    """
+    Serialize a JSON header and float arrays into the columnar format: the magic
+    bytes, the length of the header as an unsigned 64 bit integer, the header and
+    the compressed segments.
+
+    Args:
+        cls_name (str): class of the serialized object
+        meta (dict): JSON serializable data that is not stored in segments
+        arrays (OrderedDict): segment name -> array
+        codec (str): compression codec of the segments
+        level (int): compression level; the default of the codec if None
+
+    Returns:
+        (bytes)
+    """
+    segments = OrderedDict()
+    blobs = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array, dtype="<f8")
+        blob = compress(array.tobytes(), codec=codec, level=level)
+        segments[name] = {"offset": offset, "size": len(blob), "dtype": array.dtype.str,
+                          "shape": list(array.shape)}
+        offset += len(blob)
+        blobs.append(blob)
+    header = json.dumps({"@class": cls_name, "codec": codec, "meta": meta,
+                         "segments": segments}, cls=MontyEncoder).encode()
+    return b"".join([COLUMNAR_MAGIC, struct.pack("<Q", len(header)), header] + blobs)
+
+
+class ColumnarReader(object):
+    """
+    Reads the segments of a columnar blob from a seekable file object, such as a
+    GridOut, without reading the other segments.
+    """
+
+    def __init__(self, f):
+        """
+        Args:
+            f (file): file object positioned after the magic bytes
+        """
+        self._f = f
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        self.header = json.loads(f.read(header_size).decode())
+        self._start = len(COLUMNAR_MAGIC) + 8 + header_size
+
+    @property
+    def cls_name(self):
+        return self.header["@class"]
+
+    @property
+    def meta(self):
+        return self.header["meta"]
+
+    def __contains__(self, name):
+        return name in self.header["segments"]
+
+    def read(self, name):
+        """
+        Args:
+            name (str): name of the segment
+
+        Returns:
+            (numpy.ndarray)
+        """
+        segment = self.header["segments"][name]
+        self._f.seek(self._start + segment["offset"])
+        blob = decompress(self._f.read(segment["size"]), self.header["codec"])
+        return np.frombuffer(blob, dtype=segment["dtype"]).reshape(segment["shape"])
+
+
+def band_structure_to_columnar(bs_dict, codec="zlib", level=None):
+    """
+    Serialize a band structure dict (BandStructure.as_dict()) into the columnar
+    format with one segment for the k-points and one segment per spin for the
+    bands and the projections.
+
+    Args:
+        bs_dict (dict): the band structure
+        codec (str): compression codec of the segments
+        level (int): compression level; the default of the codec if None
+
+    Returns:
+        (bytes)
+    """
+    meta = {k: v for k, v in bs_dict.items() if k not in ("bands", "projections", "kpoints")}
+    meta["spins"] = [int(s) for s in bs_dict["bands"]]
+    arrays = OrderedDict([("kpoints", bs_dict["kpoints"])])
+    for spin, bands in bs_dict["bands"].items():
+        arrays["bands:{}".format(int(spin))] = bands
+    for spin, projections in (bs_dict.get("projections") or {}).items():
+        arrays["projections:{}".format(int(spin))] = projections
+    return _pack(bs_dict["@class"], meta, arrays, codec=codec, level=level)
+
+
+def band_structure_from_columnar(reader, projections=True):
+    """
+    Read a band structure written by band_structure_to_columnar.
+
+    Args:
+        reader (ColumnarReader)
+        projections (bool): whether to read the projections
+
+    Returns:
+        (BandStructure or BandStructureSymmLine)
+    """
+    d = dict(reader.meta)
+    spins = d.pop("spins")
+    d["kpoints"] = reader.read("kpoints")
+    d["bands"] = {str(s): reader.read("bands:{}".format(s)) for s in spins}
+    d["projections"] = {}
+    if projections:
+        d["projections"] = {str(s): reader.read("projections:{}".format(s)) for s in spins
+                            if "projections:{}".format(s) in reader}
+    if reader.cls_name == "BandStructure":
+        return BandStructure.from_dict(d)
+    elif reader.cls_name == "BandStructureSymmLine":
+        return BandStructureSymmLine.from_dict(d)
+    else:
+        raise ValueError("Unknown class for band structure! {}".format(reader.cls_name))
+
+
+def dos_to_columnar(dos_dict, codec="zlib", level=None):
+    """
+    Serialize a complete DOS dict (CompleteDos.as_dict()) into the columnar format
+    with one segment for the energies and one segment per spin for the total DOS,
+    the site and orbital projected DOS and the element projected DOS.
+
+    Args:
+        dos_dict (dict): the DOS
+        codec (str): compression codec of the segments
+        level (int): compression level; the default of the codec if None
+
+    Returns:
+        (bytes)
+    """
+    spins = [int(s) for s in dos_dict["densities"]]
+    site_elements = [site["species"][0]["element"] for site in dos_dict["structure"]["sites"]]
+    elements = sorted(set(site_elements), key=lambda el: Element(el).Z)
+    pdos_orbitals = [list(site_pdos.keys()) for site_pdos in dos_dict["pdos"]]
+    meta = {"efermi": dos_dict["efermi"], "structure": dos_dict["structure"], "spins": spins,
+            "pdos_orbitals": pdos_orbitals, "elements": elements}
+    arrays = OrderedDict([("energies", dos_dict["energies"])])
+    for spin in spins:
+        arrays["densities:{}".format(spin)] = dos_dict["densities"][str(spin)]
+    if pdos_orbitals:
+        n_energies = len(dos_dict["energies"])
+        for spin in spins:
+            # (site, orbital) rows in the order of pdos_orbitals
+            pdos = np.array([site_pdos[orb]["densities"][str(spin)]
+                             for site_pdos in dos_dict["pdos"] for orb in site_pdos],
+                            dtype=float).reshape(-1, n_energies)
+            arrays["pdos:{}".format(spin)] = pdos
+            element_dos = np.zeros((len(elements), n_energies))
+            row = 0
+            for el, orbitals in zip(site_elements, pdos_orbitals):
+                element_dos[elements.index(el)] += pdos[row:row + len(orbitals)].sum(axis=0)
+                row += len(orbitals)
+            arrays["element_dos:{}".format(spin)] = element_dos
+    return _pack("CompleteDos", meta, arrays, codec=codec, level=level)
+
+
+def _get_orbital(name):
+    # lm-decomposed orbitals (LORBIT = 11) or s, p, d, f (LORBIT = 10)
+    try:
+        return Orbital[name]
+    except KeyError:
+        return OrbitalType[name]
+
+
+def dos_from_columnar(reader, projections=True):
+    """
+    Read a complete DOS written by dos_to_columnar.
+
+    Args:
+        reader (ColumnarReader)
+        projections (bool): whether to read the site and orbital projected DOS
+
+    Returns:
+        (CompleteDos)
+    """
+    meta = reader.meta
+    structure = Structure.from_dict(meta["structure"])
+    spins = meta["spins"]
+    tdos = Dos(meta["efermi"], reader.read("energies"),
+               {Spin(s): reader.read("densities:{}".format(s)) for s in spins})
+    pdoss = {}
+    if projections and meta["pdos_orbitals"]:
+        pdos = {s: reader.read("pdos:{}".format(s)) for s in spins}
+        row = 0
+        for site, orbitals in zip(structure, meta["pdos_orbitals"]):
+            pdoss[site] = {_get_orbital(orb): {Spin(s): pdos[s][row + i] for s in spins}
+                           for i, orb in enumerate(orbitals)}
+            row += len(orbitals)
+    return CompleteDos(structure, tdos, pdoss)
+
+
+def element_dos_from_columnar(reader):
+    """
+    Read the element projected DOS written by dos_to_columnar, without reading the
+    site projected DOS.
+
+    Args:
+        reader (ColumnarReader)
+
+    Returns:
+        ({Element: Dos})
+    """
+    meta = reader.meta
+    if not meta["pdos_orbitals"]:
+        return {}
+    energies = reader.read("energies")
+    element_dos = {s: reader.read("element_dos:{}".format(s)) for s in meta["spins"]}
+    return {Element(el): Dos(meta["efermi"], energies,
+                             {Spin(s): element_dos[s][i] for s in meta["spins"]})
+            for i, el in enumerate(meta["elements"])}
@@ -8,18 +8,29 @@ from monty.json import MontyEncoder, MontyDecoder
 This module defines the database classes.
 """
 
-import zlib
+import io
+import itertools
 import json
+import struct
+from collections import OrderedDict
 from bson import ObjectId
 
+import numpy as np
+
+from pymatgen.core.structure import Structure
 from pymatgen.electronic_structure.bandstructure import BandStructure, BandStructureSymmLine
 from pymatgen.electronic_structure.dos import CompleteDos
+from pymatgen.io.vasp import Chgcar, Poscar
 
 import gridfs
 from pymongo import ASCENDING, DESCENDING
 
+from atomate.utils.compression import compress as compress_data, \
+    decompress as decompress_data
 from atomate.utils.database import CalcDb
 from atomate.utils.utils import get_logger
+from atomate.vasp.columnar import COLUMNAR_MAGIC, ColumnarReader, band_structure_from_columnar, \
+    band_structure_to_columnar, dos_from_columnar, dos_to_columnar, element_dos_from_columnar
 
 __author__ = 'Kiran Mathew'
 __credits__ = 'Anubhav Jain'
@@ -27,12 +38,77 @@ __email__ = 'kmathew@lbl.gov'
 
 logger = get_logger(__name__)
 
+# first bytes of the binary volumetric data format; JSON blobs start with "{"
+VOLUMETRIC_MAGIC = b"ATOMATE-VOLUMETRIC-1\n"
+
+# the all-electron charge densities, stored and checked together
+AECCAR_FIELDS = ("aeccar0", "aeccar2")
+
+
+def volumetric_to_bytes(chgcar, dtype="float64"):
+    """
+    Serialize a Chgcar (CHGCAR, AECCAR) into the binary volumetric format: the
+    magic bytes, the length of the JSON header as an unsigned 64 bit integer,
+    the JSON header (structure, data_aug, dtype and the key and shape of each
+    grid) and the raw little endian grids, one after the other.
+
+    Args:
+        chgcar (Chgcar): the volumetric data
+        dtype (str): dtype of the stored grids. "float32" halves the size at
+            the cost of precision (lossy).
+
+    Returns:
+        (bytes)
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    header = {"structure": chgcar.structure.as_dict(), "data_aug": chgcar.data_aug,
+              "dtype": dtype.str, "data": []}
+    grids = []
+    for key in sorted(chgcar.data):
+        grid = np.ascontiguousarray(chgcar.data[key], dtype=dtype)
+        header["data"].append({"key": key, "shape": list(grid.shape)})
+        grids.append(grid.tobytes())
+    header = json.dumps(header, cls=MontyEncoder).encode()
+    return b"".join([VOLUMETRIC_MAGIC, struct.pack("<Q", len(header)), header] + grids)
+
+
+def volumetric_from_bytes(blob):
+    """
+    Read the binary volumetric format written by volumetric_to_bytes. The grids
+    are read-only numpy views of the blob, they are not copied.
+
+    Args:
+        blob (bytes): the serialized data
+
+    Returns:
+        (Chgcar)
+    """
+    offset = len(VOLUMETRIC_MAGIC)
+    header_size = struct.unpack_from("<Q", blob, offset)[0]
+    offset += 8
+    header = json.loads(blob[offset:offset + header_size].decode())
+    offset += header_size
+    dtype = np.dtype(header["dtype"])
+    data = {}
+    for grid in header["data"]:
+        count = int(np.prod(grid["shape"]))
+        data[grid["key"]] = np.frombuffer(blob, dtype=dtype, count=count,
+                                          offset=offset).reshape(grid["shape"])
+        offset += count * dtype.itemsize
+    poscar = Poscar(Structure.from_dict(header["structure"]))
+    return Chgcar(poscar, data, data_aug=header["data_aug"])
+
 
 class VaspCalcDb(CalcDb):
     """
     Class to help manage database insertions of Vasp drones
     """
 
+    # fields of the last calculation stored in GridFS -> GridFS collection
+    gridfs_fields = OrderedDict([("bandstructure", "bandstructure_fs"), ("dos", "dos_fs"),
+                                 ("chgcar", "chgcar_fs"), ("aeccar0", "aeccar0_fs"),
+                                 ("aeccar2", "aeccar2_fs")])
+
     def __init__(self, host="localhost", port=27017, database="vasp", collection="tasks", user=None,
                  password=None, **kwargs):
         super(VaspCalcDb, self).__init__(host, port, database, collection, user,
@@ -68,7 +144,8 @@ class VaspCalcDb(CalcDb):
                                           ("completed_at", DESCENDING)],
                                          background=background)
 
-    def insert_task(self, task_doc, use_gridfs=False):
+    def insert_task(self, task_doc, use_gridfs=False, volumetric_dtype="float64", codec="zlib",
+                    level=None, columnar=False):
         """
         Inserts a task document (e.g., as returned by Drone.assimilate()) into the database.
         Handles putting DOS, band structure and charge density into GridFS as needed.
@@ -78,130 +155,189 @@ class VaspCalcDb(CalcDb):
         Args:
             task_doc: (dict) the task document
             use_gridfs (bool) use gridfs for  bandstructures and DOS
+            volumetric_dtype (str): dtype used to store the CHGCAR and AECCAR grids.
+                "float32" halves the storage but is lossy.
+            codec (str): compression codec of the GridFS data, e.g. "zlib" or "zstd".
+                See atomate.utils.compression.
+            level (int): compression level; the default of the codec if None
+            columnar (bool): store the band structure and DOS in the columnar format
+                (see atomate.vasp.columnar), which allows partial reads
         Returns:
             (int) - task_id of inserted document
         """
-        dos = None
-        bs = None
-        chgcar = None
-        aeccar0 = None
-        write_aeccar = False
+        return self.insert_tasks([task_doc], use_gridfs=use_gridfs,
+                                 volumetric_dtype=volumetric_dtype, codec=codec, level=level,
+                                 columnar=columnar)[0]
 
+    def insert_tasks(self, task_docs, use_gridfs=False, volumetric_dtype="float64", codec="zlib",
+                     level=None, columnar=False):
+        """
+        Inserts task documents into the database, see insert_task. The task_ids are
+        assigned first, so that the GridFS files can be uploaded and referenced in the
+        task documents before they are all written with a single bulk write.
+
+        Args:
+            task_docs ([dict]): the task documents
+            use_gridfs (bool) use gridfs for  bandstructures and DOS
+            volumetric_dtype (str): dtype used to store the CHGCAR and AECCAR grids.
+            codec (str): compression codec of the GridFS data
+            level (int): compression level; the default of the codec if None
+            columnar (bool): store the band structure and DOS in the columnar format
+        Returns:
+            ([int]) - task_ids of the inserted documents
+        """
+        task_docs = self.assign_task_ids(task_docs)
         # move dos BS and CHGCAR from doc to gridfs
-        if use_gridfs and "calcs_reversed" in task_doc:
-
-            if "dos" in task_doc["calcs_reversed"][0]:  # only store idx=0 (last step)
-                dos = json.dumps(task_doc["calcs_reversed"][0]["dos"], cls=MontyEncoder)
-                del task_doc["calcs_reversed"][0]["dos"]
-
-            if "bandstructure" in task_doc["calcs_reversed"][0]:  # only store idx=0 (last step)
-                bs = json.dumps(task_doc["calcs_reversed"][0]["bandstructure"], cls=MontyEncoder)
-                del task_doc["calcs_reversed"][0]["bandstructure"]
-
-            if "chgcar" in task_doc["calcs_reversed"][0]:  # only store idx=0 DOS
-                chgcar = json.dumps(task_doc["calcs_reversed"][0]["chgcar"], cls=MontyEncoder)
-                del task_doc["calcs_reversed"][0]["chgcar"]
-
-            if "aeccar0" in task_doc["calcs_reversed"][0]:
-                aeccar0 = task_doc["calcs_reversed"][0]["aeccar0"]
-                aeccar2 = task_doc["calcs_reversed"][0]["aeccar2"]
-                # check if the aeccar is valid before insertion
-                if (aeccar0.data['total'] + aeccar2.data['total']).min() < 0:
-                    logger.warning(f"The AECCAR seems to be corrupted for task_in directory {task_doc['dir_name']}\nSkipping storage of AECCARs")
-                    write_aeccar = False
-                else:
-                    # overwrite the aeccar variable with their string representations to be inserted in GridFS
-                    aeccar0 = json.dumps(task_doc["calcs_reversed"][0]["aeccar0"], cls=MontyEncoder)
-                    aeccar2 = json.dumps(task_doc["calcs_reversed"][0]["aeccar2"], cls=MontyEncoder)
-                    write_aeccar = True
-
-                del task_doc["calcs_reversed"][0]["aeccar0"]
-                del task_doc["calcs_reversed"][0]["aeccar2"]
-
-        # insert the task document
-        t_id = self.insert(task_doc)
-
-        # insert the dos into gridfs and update the task document
-        if dos:
-            dos_gfs_id, compression_type = self.insert_gridfs(dos, "dos_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.dos_compression": compression_type}})
-            self.collection.update_one({"task_id": t_id}, {"$set": {"calcs_reversed.0.dos_fs_id": dos_gfs_id}})
-
-        # insert the bandstructure into gridfs and update the task documents
-        if bs:
-            bfs_gfs_id, compression_type = self.insert_gridfs(bs, "bandstructure_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.bandstructure_compression": compression_type}})
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.bandstructure_fs_id": bfs_gfs_id}})
-
-        # insert the CHGCAR file into gridfs and update the task documents
-        if chgcar:
-            chgcar_gfs_id, compression_type = self.insert_gridfs(chgcar, "chgcar_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.chgcar_compression": compression_type}})
-            self.collection.update_one({"task_id": t_id}, {"$set": {"calcs_reversed.0.chgcar_fs_id": chgcar_gfs_id}})
-
-        # insert the AECCARs file into gridfs and update the task documents
-        if write_aeccar:
-            aeccar0_gfs_id, compression_type = self.insert_gridfs(aeccar0, "aeccar0_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.aeccar0_compression": compression_type}})
-            self.collection.update_one({"task_id": t_id}, {"$set": {"calcs_reversed.0.aeccar0_fs_id": aeccar0_gfs_id}})
-            aeccar2_gfs_id, compression_type = self.insert_gridfs(aeccar2, "aeccar2_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.aeccar2_compression": compression_type}})
-            self.collection.update_one({"task_id": t_id}, {"$set": {"calcs_reversed.0.aeccar2_fs_id": aeccar2_gfs_id}})
-        return t_id
-
-    def retrieve_task(self, task_id):
+        if use_gridfs:
+            for task_doc in task_docs:
+                if "calcs_reversed" not in task_doc:
+                    continue
+                # only store idx=0 (last step)
+                calc = task_doc["calcs_reversed"][0]
+                gridfs_data = self._pop_gridfs_data(task_doc, volumetric_dtype, columnar=columnar,
+                                                    codec=codec, level=level)
+                for name, data in gridfs_data.items():
+                    # the segments of the columnar format are compressed individually
+                    fs_id, compression_type = self.insert_gridfs(
+                        data, self.gridfs_fields[name], task_id=task_doc["task_id"],
+                        compress=not (columnar and name in ("dos", "bandstructure")),
+                        codec=codec, level=level)
+                    calc["{}_fs_id".format(name)] = fs_id
+                    calc["{}_compression".format(name)] = compression_type
+        self.upsert_many(task_docs)
+        return [d["task_id"] for d in task_docs]
+
+    @staticmethod
+    def _pop_gridfs_data(task_doc, volumetric_dtype="float64", columnar=False, codec="zlib",
+                         level=None):
+        """
+        Remove the DOS, band structure and charge densities of the last calculation
+        from a task document and serialize them for GridFS. With columnar=True, the
+        DOS and band structure are serialized in the columnar format, whose segments
+        are compressed with the codec.
+
+        Returns:
+            (OrderedDict) field name -> serialized data
+        """
+        calc = task_doc["calcs_reversed"][0]
+        data = OrderedDict()
+        if "dos" in calc:
+            if columnar:
+                data["dos"] = dos_to_columnar(calc.pop("dos"), codec=codec, level=level)
+            else:
+                data["dos"] = json.dumps(calc.pop("dos"), cls=MontyEncoder)
+        if "bandstructure" in calc:
+            if columnar:
+                data["bandstructure"] = band_structure_to_columnar(calc.pop("bandstructure"),
+                                                                   codec=codec, level=level)
+            else:
+                data["bandstructure"] = json.dumps(calc.pop("bandstructure"), cls=MontyEncoder)
+        if "chgcar" in calc:
+            data["chgcar"] = volumetric_to_bytes(calc.pop("chgcar"), dtype=volumetric_dtype)
+        if "aeccar0" in calc:
+            aeccar0 = calc.pop("aeccar0")
+            aeccar2 = calc.pop("aeccar2")
+            # check if the aeccar is valid before insertion
+            if (aeccar0.data['total'] + aeccar2.data['total']).min() < 0:
+                logger.warning(f"The AECCAR seems to be corrupted for task_in directory {task_doc['dir_name']}\nSkipping storage of AECCARs")
+            else:
+                data["aeccar0"] = volumetric_to_bytes(aeccar0, dtype=volumetric_dtype)
+                data["aeccar2"] = volumetric_to_bytes(aeccar2, dtype=volumetric_dtype)
+        return data
+
+    def retrieve_task(self, task_id, lazy=False):
         """
         Retrieves a task document and unpacks the band structure and DOS as dict
 
         Args:
             task_id: (int) task_id to retrieve
+            lazy (bool): if True, the GridFS backed fields of the last calculation
+                (bandstructure, dos, chgcar, aeccar0, aeccar2) are only fetched and
+                decoded when they are first accessed, see LazyCalcDoc
 
         Returns:
             (dict) complete task document with BS + DOS included
 
         """
         task_doc = self.collection.find_one({"task_id": task_id})
+        if lazy:
+            task_doc["calcs_reversed"][0] = LazyCalcDoc(task_doc["calcs_reversed"][0], self,
+                                                        task_id=task_id)
+            return task_doc
         calc = task_doc["calcs_reversed"][0]
-        if 'bandstructure_fs_id' in calc:
-            bs = self.get_band_structure(task_id)
-            calc["bandstructure"] = bs.as_dict()
-        if 'dos_fs_id' in calc:
-            dos = self.get_dos(task_id)
-            calc["dos"] = dos.as_dict()
-        if 'chgcar_fs_id' in calc:
-            chgcar = self.get_chgcar(task_id)
-            calc["chgcar"] = chgcar
-        if 'aeccar0_fs_id' in calc:
-            aeccar = self.get_aeccar(task_id)
-            calc["aeccar0"] = aeccar['aeccar0']
-            calc["aeccar2"] = aeccar['aeccar2']
+        for name in self.gridfs_fields:
+            if '{}_fs_id'.format(name) in calc:
+                calc[name] = self._load_gridfs_field(calc, name)
+        if 'aeccar0' in calc:
+            self._check_aeccar(calc['aeccar0'], calc['aeccar2'], task_id)
         return task_doc
 
-    def insert_gridfs(self, d, collection="fs", compress=True, oid=None, task_id=None):
+    def retrieve_tasks(self, task_ids, prefetch=None):
+        """
+        Retrieves many task documents at once, with lazily loaded GridFS fields.
+
+        Args:
+            task_ids ([int]): task_ids to retrieve
+            prefetch ([str]): GridFS fields (e.g. ["dos", "bandstructure"]) to fetch
+                up front for all the tasks, with one query per GridFS collection
+                instead of one per task. The other fields are loaded on access. The
+                AECCARs are checked together, so one of them brings the other.
+
+        Returns:
+            ([dict]) the task documents found, in the order of task_ids
+        """
+        docs = {d["task_id"]: d for d in self.collection.find({"task_id": {"$in": list(task_ids)}})}
+        calcs = []
+        for d in docs.values():
+            d["calcs_reversed"][0] = LazyCalcDoc(d["calcs_reversed"][0], self,
+                                                 task_id=d["task_id"])
+            calcs.append(d["calcs_reversed"][0])
+
+        prefetch = list(prefetch or [])
+        if set(AECCAR_FIELDS) & set(prefetch):
+            prefetch.extend(name for name in AECCAR_FIELDS if name not in prefetch)
+        for name in prefetch:
+            fs_key = '{}_fs_id'.format(name)
+            fs_ids = [c[fs_key] for c in calcs if fs_key in c]
+            chunks = {}
+            for chunk in self.db['{}.chunks'.format(self.gridfs_fields[name])].find(
+                    {"files_id": {"$in": fs_ids}}).sort([("files_id", ASCENDING), ("n", ASCENDING)]):
+                chunks.setdefault(chunk["files_id"], []).append(bytes(chunk["data"]))
+            for c in calcs:
+                if fs_key in c:
+                    blob = self._decompress(b"".join(chunks.get(c[fs_key], [])),
+                                            c.get('{}_compression'.format(name), 'zlib'))
+                    c[name] = self._decode_gridfs_field(name, blob)
+        for c in calcs:
+            if all(dict.__contains__(c, name) for name in AECCAR_FIELDS):
+                self._check_aeccar(c['aeccar0'], c['aeccar2'], c.task_id)
+
+        return [docs[t_id] for t_id in task_ids if t_id in docs]
+
+    def insert_gridfs(self, d, collection="fs", compress=True, oid=None, task_id=None,
+                      codec="zlib", level=None):
         """
         Insert the given document into GridFS.
 
         Args:
-            d (dict): the document
+            d (str or bytes): the serialized document
             collection (string): the GridFS collection name
             compress (bool): Whether to compress the data or not
             oid (ObjectId()): the _id of the file; if specified, it must not already exist in GridFS
             task_id(int or str): the task_id to store into the gridfs metadata
+            codec (str): the compression codec, see atomate.utils.compression
+            level (int): compression level; the default of the codec if None
         Returns:
             file id, the type of compression used.
         """
         oid = oid or ObjectId()
         compression_type = None
+        if not isinstance(d, bytes):
+            d = d.encode()
 
         if compress:
-            d = zlib.compress(d.encode(), compress)
-            compression_type = "zlib"
+            d = compress_data(d, codec=codec, level=level)
+            compression_type = codec
 
         fs = gridfs.GridFS(self.db, collection)
         if task_id:
@@ -213,33 +349,56 @@ class VaspCalcDb(CalcDb):
 
         return fs_id, compression_type
 
-    def get_band_structure(self, task_id):
+    def get_band_structure(self, task_id, projections=True):
+        """
+        Read the band structure of a task from GridFS.
+
+        Args:
+            task_id(int or str): the task_id
+            projections (bool): whether to read the projections. Only the columnar
+                format can skip them, they are always read from JSON.
+        Returns:
+            BandStructure or BandStructureSymmLine object
+        """
         m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['bandstructure_fs_id']
-        fs = gridfs.GridFS(self.db, 'bandstructure_fs')
-        bs_json = zlib.decompress(fs.get(fs_id).read())
-        bs_dict = json.loads(bs_json.decode())
-        if bs_dict["@class"] == "BandStructure":
-            return BandStructure.from_dict(bs_dict)
-        elif bs_dict["@class"] == "BandStructureSymmLine":
-            return BandStructureSymmLine.from_dict(bs_dict)
-        else:
-            raise ValueError("Unknown class for band structure! {}".format(bs_dict["@class"]))
+        return self._get_gridfs_object(m_task['calcs_reversed'][0], 'bandstructure',
+                                       projections=projections)
 
-    def get_dos(self, task_id):
+    def get_dos(self, task_id, projections=True):
+        """
+        Read the DOS of a task from GridFS.
+
+        Args:
+            task_id(int or str): the task_id
+            projections (bool): whether to read the site and orbital projected DOS.
+                Only the columnar format can skip them, they are always read from JSON.
+        Returns:
+            CompleteDos object
+        """
         m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['dos_fs_id']
-        fs = gridfs.GridFS(self.db, 'dos_fs')
-        dos_json = zlib.decompress(fs.get(fs_id).read())
-        dos_dict = json.loads(dos_json.decode())
-        return CompleteDos.from_dict(dos_dict)
+        return self._get_gridfs_object(m_task['calcs_reversed'][0], 'dos',
+                                       projections=projections)
+
+    def get_element_dos(self, task_id):
+        """
+        Read the element projected DOS of a task from GridFS. The columnar format
+        stores it precomputed, so the site projected DOS is not read.
+
+        Args:
+            task_id(int or str): the task_id
+        Returns:
+            {Element: Dos}
+        """
+        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
+        reader = self._get_columnar_reader(m_task['calcs_reversed'][0], 'dos')
+        if reader is not None:
+            return element_dos_from_columnar(reader)
+        return self._get_gridfs_object(m_task['calcs_reversed'][0], 'dos').get_element_dos()
 
     def get_chgcar_string(self, task_id):
         # Not really used now, consier deleting
         m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['chgcar_fs_id']
-        fs = gridfs.GridFS(self.db, 'chgcar_fs')
-        return zlib.decompress(fs.get(fs_id).read())
+        return self._read_gridfs(m_task['calcs_reversed'][0], 'chgcar')
 
     def get_chgcar(self, task_id):
         """
@@ -250,11 +409,7 @@ class VaspCalcDb(CalcDb):
             chgcar: Chgcar object
         """
         m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['chgcar_fs_id']
-        fs = gridfs.GridFS(self.db, 'chgcar_fs')
-        chgcar_json = zlib.decompress(fs.get(fs_id).read())
-        chgcar= json.loads(chgcar_json, cls=MontyDecoder)
-        return chgcar
+        return self._get_gridfs_object(m_task['calcs_reversed'][0], 'chgcar')
 
     def get_aeccar(self, task_id, check_valid = True):
         """
@@ -266,20 +421,145 @@ class VaspCalcDb(CalcDb):
             {"aeccar0" : Chgcar, "aeccar2" : Chgcar}: dict of Chgcar objects
         """
         m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['aeccar0_fs_id']
-        fs = gridfs.GridFS(self.db, 'aeccar0_fs')
-        aeccar_json = zlib.decompress(fs.get(fs_id).read())
-        aeccar0 = json.loads(aeccar_json, cls=MontyDecoder)
-        fs_id = m_task['calcs_reversed'][0]['aeccar2_fs_id']
-        fs = gridfs.GridFS(self.db, 'aeccar2_fs')
-        aeccar_json = zlib.decompress(fs.get(fs_id).read())
-        aeccar2 = json.loads(aeccar_json, cls=MontyDecoder)
-
-        if check_valid and (aeccar0.data['total'] + aeccar2.data['total']).min() < 0:
-            ValueError(f"The AECCAR seems to be corrupted for task_id = {task_id}")
+        aeccar0 = self._get_gridfs_object(m_task['calcs_reversed'][0], 'aeccar0')
+        aeccar2 = self._get_gridfs_object(m_task['calcs_reversed'][0], 'aeccar2')
+
+        if check_valid:
+            self._check_aeccar(aeccar0, aeccar2, task_id)
 
         return {'aeccar0': aeccar0, 'aeccar2': aeccar2}
 
+    @staticmethod
+    def _check_aeccar(aeccar0, aeccar2, task_id):
+        if (aeccar0.data['total'] + aeccar2.data['total']).min() < 0:
+            raise ValueError(f"The AECCAR seems to be corrupted for task_id = {task_id}")
+
+    @staticmethod
+    def _decompress(blob, compression):
+        return decompress_data(blob, compression)
+
+    def _read_gridfs(self, calc, name):
+        """
+        Read the decompressed GridFS data of a field of a calculation.
+
+        Args:
+            calc (dict): the calculation with the <name>_fs_id and <name>_compression keys
+            name (str): one of gridfs_fields
+        Returns:
+            (bytes)
+        """
+        fs = gridfs.GridFS(self.db, self.gridfs_fields[name])
+        blob = fs.get(calc['{}_fs_id'.format(name)]).read()
+        return self._decompress(blob, calc.get('{}_compression'.format(name), 'zlib'))
+
+    def _get_columnar_reader(self, calc, name):
+        """
+        Get a reader for GridFS data in the columnar format, which only fetches the
+        GridFS chunks of the segments that are read.
+
+        Returns:
+            ColumnarReader, or None if the data is not in the columnar format
+        """
+        if name not in ("bandstructure", "dos") or \
+                calc.get('{}_compression'.format(name), 'zlib') not in (None, "none"):
+            return None
+        fs = gridfs.GridFS(self.db, self.gridfs_fields[name])
+        f = fs.get(calc['{}_fs_id'.format(name)])
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            return None
+        return ColumnarReader(f)
+
+    def _get_gridfs_object(self, calc, name, projections=True):
+        reader = self._get_columnar_reader(calc, name)
+        if reader is not None:
+            return self._from_columnar(name, reader, projections=projections)
+        return self._decode_gridfs_object(name, self._read_gridfs(calc, name))
+
+    @staticmethod
+    def _from_columnar(name, reader, projections=True):
+        if name == "dos":
+            return dos_from_columnar(reader, projections=projections)
+        return band_structure_from_columnar(reader, projections=projections)
+
+    @staticmethod
+    def _decode_gridfs_object(name, blob):
+        """
+        Decode the decompressed GridFS data of a field into an object.
+        """
+        if name in ("chgcar", "aeccar0", "aeccar2"):
+            # binary volumetric format or JSON (older documents)
+            if blob.startswith(VOLUMETRIC_MAGIC):
+                return volumetric_from_bytes(blob)
+            return json.loads(blob.decode(), cls=MontyDecoder)
+        if blob.startswith(COLUMNAR_MAGIC):
+            f = io.BytesIO(blob)
+            f.seek(len(COLUMNAR_MAGIC))
+            return VaspCalcDb._from_columnar(name, ColumnarReader(f))
+        d = json.loads(blob.decode())
+        if name == "dos":
+            return CompleteDos.from_dict(d)
+        if d["@class"] == "BandStructure":
+            return BandStructure.from_dict(d)
+        elif d["@class"] == "BandStructureSymmLine":
+            return BandStructureSymmLine.from_dict(d)
+        else:
+            raise ValueError("Unknown class for band structure! {}".format(d["@class"]))
+
+    @classmethod
+    def _decode_gridfs_field(cls, name, blob):
+        """
+        Decode the decompressed GridFS data of a field as it is stored in the
+        documents returned by retrieve_task: band structures and DOS as dicts,
+        charge densities as Chgcar objects.
+        """
+        obj = cls._decode_gridfs_object(name, blob)
+        return obj.as_dict() if name in ("bandstructure", "dos") else obj
+
+    def _load_gridfs_field(self, calc, name):
+        return self._decode_gridfs_field(name, self._read_gridfs(calc, name))
+
+    def recompress_gridfs(self, name, codec="zstd", level=None, query=None):
+        """
+        Re-encode existing GridFS data of a field with another compression codec.
+        Each blob is written as a new GridFS file, the task document is pointed to it
+        and only then the old file is deleted.
+
+        Args:
+            name (str): one of gridfs_fields, e.g. "dos"
+            codec (str): the new compression codec
+            level (int): compression level; the default of the codec if None
+            query (dict): restrict the migration to the tasks matching this query
+
+        Returns:
+            (int) number of re-encoded blobs
+        """
+        fs_key = "calcs_reversed.0.{}_fs_id".format(name)
+        compression_key = "calcs_reversed.0.{}_compression".format(name)
+        criteria = dict(query or {})
+        criteria[fs_key] = {"$exists": True}
+        fs = gridfs.GridFS(self.db, self.gridfs_fields[name])
+        n = 0
+        # a positional path such as calcs_reversed.0.dos_fs_id cannot be projected
+        for task in self.collection.find(criteria,
+                                         {"task_id": 1, "calcs_reversed": {"$slice": 1}}):
+            calc = task["calcs_reversed"][0]
+            old_codec = calc.get("{}_compression".format(name), "zlib")
+            if old_codec == codec:
+                continue
+            data = self._read_gridfs(calc, name)
+            if data.startswith(COLUMNAR_MAGIC):
+                # the segments are already compressed
+                continue
+            fs_id, compression_type = self.insert_gridfs(
+                data, self.gridfs_fields[name], task_id=task["task_id"], codec=codec,
+                level=level)
+            self.collection.update_one({"_id": task["_id"]}, {"$set": {
+                fs_key: fs_id, compression_key: compression_type}})
+            fs.delete(calc["{}_fs_id".format(name)])
+            n += 1
+        logger.info("Re-encoded {} {} blobs with {}".format(n, name, codec))
+        return n
+
     def reset(self):
         self.collection.delete_many({})
         self.db.counter.delete_one({"_id": "taskid"})
@@ -294,4 +574,78 @@ class VaspCalcDb(CalcDb):
         self.build_indexes()
 
 
+class LazyCalcDoc(dict):
+    """
+    A calculation document (calcs_reversed.0 of a task) whose GridFS backed fields
+    (bandstructure, dos, chgcar, aeccar0, aeccar2) are fetched and decoded on first
+    access with [] or get(), and then kept. The fields are returned and the AECCARs
+    checked as by VaspCalcDb.retrieve_task. The unloaded fields are part of the keys
+    like the loaded ones; items() and values() load them all.
+    """
+
+    def __init__(self, calc, db, task_id=None):
+        """
+        Args:
+            calc (dict): the calculation document as stored in the tasks collection
+            db (VaspCalcDb): the database to load the GridFS fields from
+            task_id (int): the task_id of the task, for the error messages
+        """
+        super(LazyCalcDoc, self).__init__(calc)
+        self._db = db
+        self.task_id = task_id
+
+    def _is_lazy(self, key):
+        return key in self._db.gridfs_fields and \
+            super(LazyCalcDoc, self).__contains__('{}_fs_id'.format(key))
+
+    def _get_unloaded(self):
+        return [k for k in self._db.gridfs_fields
+                if self._is_lazy(k) and not super(LazyCalcDoc, self).__contains__(k)]
+
+    def __missing__(self, key):
+        if not self._is_lazy(key):
+            raise KeyError(key)
+        values = {key: self._db._load_gridfs_field(self, key)}
+        if key in AECCAR_FIELDS:
+            # the AECCARs are only valid together
+            for name in AECCAR_FIELDS:
+                if name in values:
+                    continue
+                if super(LazyCalcDoc, self).__contains__(name):
+                    values[name] = super(LazyCalcDoc, self).__getitem__(name)
+                else:
+                    values[name] = self._db._load_gridfs_field(self, name)
+            self._db._check_aeccar(values['aeccar0'], values['aeccar2'], self.task_id)
+        self.update(values)
+        return values[key]
+
+    def __contains__(self, key):
+        return super(LazyCalcDoc, self).__contains__(key) or self._is_lazy(key)
+
+    def __iter__(self):
+        return itertools.chain(super(LazyCalcDoc, self).__iter__(), self._get_unloaded())
+
+    def __len__(self):
+        return super(LazyCalcDoc, self).__len__() + len(self._get_unloaded())
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __reduce__(self):
+        # pickle as a plain dict of the loaded fields
+        return dict, (dict(super(LazyCalcDoc, self).items()),)
+
+
 # TODO: @albalu, @matk86, @computron - add BoltztrapCalcDB management here -computron, matk86
@@ -15,7 +15,10 @@ from fnmatch import fnmatch
 from collections import OrderedDict
 import json
 import glob
+import hashlib
 import traceback
+from multiprocessing import Pool, current_process
+from xml.etree import ElementTree as ET
 
 from monty.io import zopen
 from monty.json import jsanitize
@@ -28,12 +31,13 @@ from pymatgen.core.structure import Structure
 from pymatgen.core.operations import SymmOp
 from pymatgen.electronic_structure.bandstructure import BandStructureSymmLine
 from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-from pymatgen.io.vasp import BSVasprun, Vasprun, Outcar, Locpot, Chgcar
+from pymatgen.io.vasp import Vasprun, Outcar, Locpot, Chgcar
 from pymatgen.io.vasp.inputs import Poscar, Potcar, Incar, Kpoints
 from pymatgen.apps.borg.hive import AbstractDrone
 from pymatgen.command_line.bader_caller import bader_analysis_from_path
 
 from atomate.utils.utils import get_uri
+from atomate.vasp.vasprun_lite import VasprunLite
 
 from atomate.utils.utils import get_logger
 from atomate import __version__ as atomate_version
@@ -47,6 +51,76 @@ logger = get_logger(__name__)
 
 bader_exe_exists = which("bader") or which("bader.exe")
 
+# output files whose state decides whether a run directory has to be parsed again
+FINGERPRINT_PATTERNS = ("vasprun.xml*", "OUTCAR*", "custodian.json*")
+
+
+def _parse_vasprun_value(elem):
+    """
+    Convert a vasprun.xml <i> parameter element into a python value.
+    """
+    val_type = elem.attrib.get("type")
+    text = (elem.text or "").strip()
+    if val_type == "string":
+        return text
+    if val_type == "logical":
+        return text.startswith("T")
+    try:
+        return int(text) if val_type == "int" else float(text)
+    except ValueError:
+        return text
+
+
+def _file_hash(filename, blocksize=1 << 20):
+    """
+    sha1 hex digest of the raw (possibly compressed) file contents.
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _parse_output_file(args):
+    """
+    Parse one vasprun.xml or OUTCAR of a run directory; used by VaspDrone.generate_doc
+    to parse the runs of a directory in parallel.
+
+    Args:
+        args (tuple): (drone, "vasprun" or "outcar", dir_name, taskname, filename)
+    """
+    drone, file_type, dir_name, taskname, filename = args
+    if file_type == "vasprun":
+        return drone.process_vasprun(dir_name, taskname, filename)
+    return Outcar(os.path.join(dir_name, filename)).as_dict()
+
+
+def get_vasprun_incar(vasprun_file):
+    """
+    Read only the <incar> block at the top of a vasprun.xml file. This is much
+    cheaper than a full parse and is used to decide up front how the file
+    should be parsed.
+
+    Args:
+        vasprun_file (str): path to the (possibly compressed) vasprun.xml
+
+    Returns:
+        (dict) INCAR parameters as written by VASP
+    """
+    incar = {}
+    with zopen(vasprun_file, "rb") as f:
+        for event, elem in ET.iterparse(f):
+            if elem.tag == "i" and "name" in elem.attrib:
+                incar[elem.attrib["name"]] = _parse_vasprun_value(elem)
+            elif elem.tag == "incar":
+                break
+            elif elem.tag in ("parameters", "calculation"):
+                # no <incar> block; do not scan the rest of the file
+                return {}
+    return incar
+
+
 class VaspDrone(AbstractDrone):
     """
     pymatgen-db VaspToDbTaskDrone with updated schema and documents processing methods.
@@ -83,7 +157,8 @@ class VaspDrone(AbstractDrone):
 
     def __init__(self, runs=None, parse_dos="auto", bandstructure_mode="auto",
                  parse_locpot=True, additional_fields=None, use_full_uri=True,
-                 parse_bader=bader_exe_exists, parse_chgcar=False, parse_aeccar=False):
+                 parse_bader=bader_exe_exists, parse_chgcar=False, parse_aeccar=False,
+                 lite_mode=False, max_workers=1):
         """
         Initialize a Vasp drone to parse vasp outputs
         Args:
@@ -106,7 +181,17 @@ class VaspDrone(AbstractDrone):
             parse_bader (bool): Run and parse Bader charge data. Defaults to True if Bader is present
             parse_chgcar (bool): Run and parse CHGCAR file
             parse_aeccar (bool): Run and parse AECCAR0 and AECCAR2 files
+            lite_mode (bool): Read the vasprun.xml files with the memory-bounded VasprunLite
+             reader, which skips the eigenvalue, projection and DOS blocks. The band gap
+             information is computed from the eigenvalues while streaming. Requires
+             parse_dos and bandstructure_mode to be False.
+            max_workers (int): Number of processes used to parse the vasprun.xml and OUTCAR
+             files of the runs of a directory (e.g. relax1, relax2) in parallel. Pools cannot
+             be started from daemonic processes, so the files are parsed serially when the
+             drone itself runs in a pool worker, e.g. in VaspIngester.
         """
+        if lite_mode and (parse_dos != False or bandstructure_mode != False):
+            raise ValueError("lite_mode requires parse_dos=False and bandstructure_mode=False")
         self.parse_dos = parse_dos
         self.additional_fields = additional_fields or {}
         self.use_full_uri = use_full_uri
@@ -117,6 +202,8 @@ class VaspDrone(AbstractDrone):
         self.parse_bader = parse_bader
         self.parse_chgcar = parse_chgcar
         self.parse_aeccar = parse_aeccar
+        self.lite_mode = lite_mode
+        self.max_workers = max_workers
 
     def assimilate(self, path):
         """
@@ -189,10 +276,13 @@ class VaspDrone(AbstractDrone):
             d = jsanitize(self.additional_fields, strict=True)
             d["schema"] = {"code": "atomate", "version": VaspDrone.__version__}
             d["dir_name"] = fullpath
-            d["calcs_reversed"] = [self.process_vasprun(dir_name, taskname, filename)
-                                   for taskname, filename in vasprun_files.items()]
-            outcar_data = [Outcar(os.path.join(dir_name, filename)).as_dict()
-                           for taskname, filename in outcar_files.items()]
+            jobs = [(self, "vasprun", dir_name, taskname, filename)
+                    for taskname, filename in vasprun_files.items()]
+            jobs += [(self, "outcar", dir_name, taskname, filename)
+                     for taskname, filename in outcar_files.items()]
+            results = self._map(_parse_output_file, jobs)
+            d["calcs_reversed"] = results[:len(vasprun_files)]
+            outcar_data = results[len(vasprun_files):]
             run_stats = {}
             for i, d_calc in enumerate(d["calcs_reversed"]):
                 run_stats[d_calc["task"]["name"]] = outcar_data[i].pop("run_stats")
@@ -314,6 +404,20 @@ class VaspDrone(AbstractDrone):
             logger.error("Error in " + os.path.abspath(dir_name) + ".\n" + traceback.format_exc())
             raise
 
+    def _map(self, func, jobs):
+        """
+        Ordered map over the jobs, with a pool of max_workers processes if possible.
+        """
+        nproc = min(self.max_workers or 1, len(jobs))
+        if nproc > 1 and not current_process().daemon:
+            pool = Pool(nproc)
+            try:
+                return pool.map(func, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        return [func(job) for job in jobs]
+
     def process_vasprun(self, dir_name, taskname, filename):
         """
         Adapted from matgendb.creator
@@ -322,9 +426,18 @@ class VaspDrone(AbstractDrone):
         """
         vasprun_file = os.path.join(dir_name, filename)
 
-        vrun = Vasprun(vasprun_file)
+        if self.lite_mode:
+            vrun = VasprunLite(vasprun_file)
+        else:
+            # parse the vasprun.xml only once; projections are only read if the
+            # band structure that will be stored needs them
+            vrun = Vasprun(vasprun_file,
+                           parse_projected_eigen=self._needs_projections(vasprun_file))
 
+        # projections are only used to build the band structure, keep them out of the dict
+        projected_eigenvalues, vrun.projected_eigenvalues = vrun.projected_eigenvalues, None
         d = vrun.as_dict()
+        vrun.projected_eigenvalues = projected_eigenvalues
 
         # rename formula keys
         for k, v in {"formula_pretty": "pretty_formula",
@@ -350,10 +463,12 @@ class VaspDrone(AbstractDrone):
             d["output"][k] = d["output"].pop(v)
 
         # Process bandstructure and DOS
+        bs = None
         if self.bandstructure_mode != False:
-            bs = self.process_bandstructure(vrun)
-            if bs:
-                d["bandstructure"] = bs
+            bs = self.get_band_structure(vrun)
+            bs_dict = self.process_bandstructure(vrun, bs=bs)
+            if bs_dict:
+                d["bandstructure"] = bs_dict
 
         if self.parse_dos != False:
             dos = self.process_dos(vrun)
@@ -363,17 +478,23 @@ class VaspDrone(AbstractDrone):
         # Parse electronic information if possible.
         # For certain optimizers this is broken and we don't get an efermi resulting in the bandstructure
         try:
-            bs = vrun.get_band_structure()
-            bs_gap = bs.get_band_gap()
-            d["output"]["vbm"] = bs.get_vbm()["energy"]
-            d["output"]["cbm"] = bs.get_cbm()["energy"]
-            d["output"]["bandgap"] = bs_gap["energy"]
-            d["output"]["is_gap_direct"] = bs_gap["direct"]
-            d["output"]["is_metal"] = bs.is_metal()
-            if not bs_gap["direct"]:
-                d["output"]["direct_gap"] = bs.get_direct_band_gap()
-            if isinstance(bs, BandStructureSymmLine):
-                d["output"]["transition"] = bs_gap["transition"]
+            if self.lite_mode:
+                # already reduced from the eigenvalues while streaming
+                d["output"].update(vrun.band_properties)
+            else:
+                # reuse the band structure built above if there is one
+                if bs is None:
+                    bs = vrun.get_band_structure()
+                bs_gap = bs.get_band_gap()
+                d["output"]["vbm"] = bs.get_vbm()["energy"]
+                d["output"]["cbm"] = bs.get_cbm()["energy"]
+                d["output"]["bandgap"] = bs_gap["energy"]
+                d["output"]["is_gap_direct"] = bs_gap["direct"]
+                d["output"]["is_metal"] = bs.is_metal()
+                if not bs_gap["direct"]:
+                    d["output"]["direct_gap"] = bs.get_direct_band_gap()
+                if isinstance(bs, BandStructureSymmLine):
+                    d["output"]["transition"] = bs_gap["transition"]
 
         except Exception:
             logger.warning("Error in parsing bandstructure")
@@ -441,34 +562,69 @@ class VaspDrone(AbstractDrone):
             raise ValueError("Unable to open CHGCAR/AECCAR file" )
         return chgcar
 
-    def process_bandstructure(self, vrun):
+    def _needs_projections(self, vasprun_file):
+        """
+        Whether the band structure parsed from this vasprun.xml needs the
+        projected eigenvalues, i.e. whether it will be stored with projections.
+        """
+        if str(self.bandstructure_mode).lower() == "auto":
+            # only static NSCF calculations are stored with projections
+            incar = get_vasprun_incar(vasprun_file)
+            return incar.get("ICHARG", 0) > 10 and incar.get("NSW", 0) <= 1
+        return bool(self.bandstructure_mode)
+
+    def get_band_structure(self, vrun):
+        """
+        Build the band structure from an already parsed Vasprun according to
+        the bandstructure_mode. The same band structure is used for the stored
+        band structure and for the band gap information, so the vasprun.xml is
+        never parsed more than once.
+
+        Args:
+            vrun (Vasprun): the parsed vasprun.xml
 
-        vasprun_file = vrun.filename
-        # Band structure parsing logic
+        Returns:
+            BandStructure or BandStructureSymmLine
+        """
         if str(self.bandstructure_mode).lower() == "auto":
             # if NSCF calculation
             if vrun.incar.get("ICHARG", 0) > 10:
-                bs_vrun = BSVasprun(vasprun_file, parse_projected_eigen=True)
                 try:
                     # Try parsing line mode
-                    bs = bs_vrun.get_band_structure(line_mode=True)
+                    return vrun.get_band_structure(line_mode=True)
                 except:
                     # Just treat as a regular calculation
-                    bs = bs_vrun.get_band_structure()
+                    return vrun.get_band_structure()
             # else just regular calculation
-            else:
-                bs_vrun = BSVasprun(vasprun_file, parse_projected_eigen=False)
-                bs = bs_vrun.get_band_structure()
+            return vrun.get_band_structure()
 
+        # legacy line/True behavior for bandstructure_mode
+        elif self.bandstructure_mode:
+            return vrun.get_band_structure(
+                line_mode=(str(self.bandstructure_mode).lower() == "line"))
+
+        return vrun.get_band_structure()
+
+    def process_bandstructure(self, vrun, bs=None):
+        """
+        Get the band structure to store in the task document, if any.
+
+        Args:
+            vrun (Vasprun): the parsed vasprun.xml
+            bs (BandStructure): band structure already built from vrun by
+                get_band_structure. Built here if not given.
+
+        Returns:
+            (dict) the band structure as a dict or None if it is not stored
+        """
+        if str(self.bandstructure_mode).lower() == "auto":
             # only save the bandstructure if not moving ions
             if vrun.incar.get("NSW", 0) <= 1:
-                return bs.as_dict()
+                return (bs or self.get_band_structure(vrun)).as_dict()
 
         # legacy line/True behavior for bandstructure_mode
         elif self.bandstructure_mode:
-            bs_vrun = BSVasprun(vasprun_file, parse_projected_eigen=True)
-            bs = bs_vrun.get_band_structure(line_mode=(str(self.bandstructure_mode).lower() == "line"))
-            return bs.as_dict()
+            return (bs or self.get_band_structure(vrun)).as_dict()
 
         return None
 
@@ -601,6 +757,7 @@ class VaspDrone(AbstractDrone):
             d["dir_name"] = get_uri(dir_name)
         if new_tags:
             d["tags"] = new_tags
+        d["fingerprint"] = self.get_fingerprint(fullpath)
 
         # Calculations using custodian generate a *.orig file for the inputs
         # This is useful to know how the calculation originally started
@@ -621,6 +778,91 @@ class VaspDrone(AbstractDrone):
 
         logger.info("Post-processed " + fullpath)
 
+    def get_fingerprint_files(self, path):
+        """
+        The output files that make up the fingerprint of a run directory: all the
+        files matching FINGERPRINT_PATTERNS in the directory and in the run
+        subfolders (e.g. relax1, relax2), relative to path and sorted.
+        """
+        fingerprint_files = []
+        files = os.listdir(path)
+        subdirs = [r for r in self.runs if os.path.isdir(os.path.join(path, r))]
+        for f in files:
+            if any(fnmatch(f, p) for p in FINGERPRINT_PATTERNS):
+                fingerprint_files.append(f)
+        for r in subdirs:
+            for f in os.listdir(os.path.join(path, r)):
+                if any(fnmatch(f, p) for p in FINGERPRINT_PATTERNS):
+                    fingerprint_files.append(os.path.join(r, f))
+        return sorted(fingerprint_files)
+
+    def get_fingerprint(self, path, hash_files=True):
+        """
+        Get the fingerprint of the output files of a run directory. It is stored in
+        the task doc so that unchanged directories can be skipped on re-ingestion.
+        It is a list rather than a dict since the file names contain dots.
+
+        Args:
+            path (str): path to the run directory
+            hash_files (bool): whether to compute the sha1 of the files
+
+        Returns:
+            ([dict]) one {"file", "size", "mtime", "sha1"} dict per file
+        """
+        fingerprint = []
+        for f in self.get_fingerprint_files(path):
+            filename = os.path.join(path, f)
+            stat = os.stat(filename)
+            fingerprint.append({"file": f, "size": stat.st_size, "mtime": stat.st_mtime,
+                                "sha1": _file_hash(filename) if hash_files else None})
+        return fingerprint
+
+    def is_unchanged(self, path, fingerprint):
+        """
+        Check the output files of a run directory against a stored fingerprint.
+        A file is only hashed if its size matches but its mtime does not, e.g.
+        after the directory has been copied.
+
+        Args:
+            path (str): path to the run directory
+            fingerprint ([dict]): fingerprint from a previous get_fingerprint
+
+        Returns:
+            (bool) True if the outputs are the same as when the fingerprint was taken
+        """
+        return self.check_fingerprint(path, fingerprint)[0]
+
+    def check_fingerprint(self, path, fingerprint):
+        """
+        Check the output files of a run directory against a stored fingerprint, see
+        is_unchanged. The files whose mtime changed but not their content are hashed
+        on every check, so the fingerprint with their new mtime is returned to be
+        stored instead.
+
+        Args:
+            path (str): path to the run directory
+            fingerprint ([dict]): fingerprint from a previous get_fingerprint
+
+        Returns:
+            (bool, [dict]) whether the outputs are unchanged, and the refreshed
+            fingerprint if they are but some mtimes changed (None otherwise)
+        """
+        if not fingerprint:
+            return False, None
+        current = self.get_fingerprint(path, hash_files=False)
+        if [f["file"] for f in current] != [f["file"] for f in fingerprint]:
+            return False, None
+        refreshed = False
+        for new, old in zip(current, fingerprint):
+            if new["size"] != old["size"]:
+                return False, None
+            if new["mtime"] != old["mtime"]:
+                if _file_hash(os.path.join(path, new["file"])) != old["sha1"]:
+                    return False, None
+                refreshed = True
+            new["sha1"] = old["sha1"]
+        return True, current if refreshed else None
+
     def validate_doc(self, d):
         """
         Sanity check.
@@ -662,7 +904,9 @@ class VaspDrone(AbstractDrone):
             "bandstructure_mode": self.bandstructure_mode,
             "additional_fields": self.additional_fields,
             "use_full_uri": self.use_full_uri,
-            "runs": self.runs}
+            "runs": self.runs,
+            "lite_mode": self.lite_mode,
+            "max_workers": self.max_workers}
         return {"@module": self.__class__.__module__,
                 "@class": self.__class__.__name__,
                 "version": self.__class__.__version__,
@@ -14,9 +14,9 @@ between different Firetasks and Fireworks. This module also contains tasks that
 flow of the workflow, e.g. tasks to check stability or the gap is within a certain range.
 """
 
-import gzip
 import os
 import re
+from multiprocessing.pool import ThreadPool
 
 from pymatgen import MPRester
 from pymatgen.io.vasp.sets import get_vasprun_outcar
@@ -24,6 +24,7 @@ from pymatgen.core.structure import Structure
 
 from fireworks import explicit_serialize, FiretaskBase, FWAction
 
+from atomate.utils.fileio import FileClient
 from atomate.utils.utils import env_chk, get_logger
 from atomate.common.firetasks.glue_tasks import get_calc_loc, PassResult, \
     CopyFiles, CopyFilesFromCalcLoc
@@ -34,6 +35,15 @@ __author__ = 'Anubhav Jain, Kiran Mathew'
 __email__ = 'ajain@lbl.gov, kmathew@lbl.gov'
 
 
+# base file name and relaxation extension of the outputs of a multi-step relaxation
+RELAX_EXT_RE = re.compile(r"(.+?)(\.relax\d*)")
+
+
+def _relax_number(relax_ext):
+    digits = relax_ext[len(".relax"):]
+    return int(digits) if digits else 0
+
+
 @explicit_serialize
 class CopyVaspOutputs(CopyFiles):
     """
@@ -41,7 +51,7 @@ class CopyVaspOutputs(CopyFiles):
     By default, copies 'INCAR', 'POSCAR' (default: via 'CONTCAR'), 'KPOINTS', 
     'POTCAR', 'OUTCAR', and 'vasprun.xml'. Additional files, e.g. 'CHGCAR', 
     can also be specified. Automatically handles files that have a ".gz" 
-    extension (copies and unzips).
+    extension (decompresses them while copying).
 
     Note that you must specify either "calc_loc" or "calc_dir" to indicate
     the directory containing the previous VASP run.
@@ -59,10 +69,20 @@ class CopyVaspOutputs(CopyFiles):
             everything
         contcar_to_poscar(bool): If True (default), will move CONTCAR to
             POSCAR (original POSCAR is not copied).
+        nthreads (int): number of files copied concurrently from a local
+            filesystem (default: 4). Remote files are copied one at a time, unless
+            they are downloaded by the "async" transfer_backend.
+        transfer_mode (str or dict): "copy" (default), "hardlink", "reflink" or
+            "symlink", for all the files or as a dict of file name (e.g. "CHGCAR")
+            -> mode; see CopyFiles. Gzipped files are always decompressed into a
+            new file.
+        transfer_backend (str): "sftp" (default) or "async", see FileClient. With
+            "async", the files are downloaded all at once by the TransferEngine and
+            the gzipped ones are decompressed afterwards.
     """
 
     optional_params = ["calc_loc", "calc_dir", "filesystem", "additional_files",
-                       "contcar_to_poscar"]
+                       "contcar_to_poscar", "nthreads", "transfer_mode", "transfer_backend"]
 
     def run_task(self, fw_spec):
 
@@ -88,28 +108,27 @@ class CopyVaspOutputs(CopyFiles):
         # setup the copy
         self.setup_copy(self.get("calc_dir", None),
                         filesystem=self.get("filesystem", None),
-                        files_to_copy=files_to_copy, from_path_dict=calc_loc)
+                        files_to_copy=files_to_copy, from_path_dict=calc_loc,
+                        transfer_backend=self.get("transfer_backend", None))
         # do the copying
-        self.copy_files()
+        try:
+            self.copy_files()
+        finally:
+            self.fileclient.close()
 
     def copy_files(self):
-        all_files = self.fileclient.listdir(self.from_dir)
-        # start file copy
+        # list the directory once and resolve the files to copy from the listing
+        all_files = set(self.fileclient.listdir(self.from_dir))
+        relax_exts = self.get_relax_extensions(all_files)
+        # find the source of each file first, then copy them
+        copies = []
         for f in self.files_to_copy:
             prev_path_full = os.path.join(self.from_dir, f)
             dest_fname = 'POSCAR' if f == 'CONTCAR' and self.get(
                 "contcar_to_poscar", True) else f
             dest_path = os.path.join(self.to_dir, dest_fname)
 
-            relax_ext = ""
-            relax_paths = sorted(
-                self.fileclient.glob(prev_path_full + ".relax*"))
-            if relax_paths:
-                if len(relax_paths) > 9:
-                    raise ValueError(
-                        "CopyVaspOutputs doesn't properly handle >9 relaxations!")
-                m = re.search('\.relax\d*', relax_paths[-1])
-                relax_ext = m.group(0)
+            relax_ext = relax_exts.get(f, "")
 
             # detect .gz extension if needed - note that monty zpath() did not seem useful here
             gz_ext = ""
@@ -121,19 +140,76 @@ class CopyVaspOutputs(CopyFiles):
             if not (f + relax_ext + gz_ext) in all_files:
                 raise ValueError("Cannot find file: {}".format(f))
 
-            # copy the file (minus the relaxation extension)
-            self.fileclient.copy(prev_path_full + relax_ext + gz_ext,
-                                 dest_path + gz_ext)
-
-            # unzip the .gz if needed
-            if gz_ext in ['.gz', ".GZ"]:
-                # unzip dest file
-                f = gzip.open(dest_path + gz_ext, 'rt')
-                file_content = f.read()
-                with open(dest_path, 'w') as f_out:
-                    f_out.writelines(file_content)
-                f.close()
-                os.remove(dest_path + gz_ext)
+            copies.append((prev_path_full + relax_ext + gz_ext, dest_path, bool(gz_ext),
+                           self.get_transfer_mode(f)))
+
+        if self.fileclient.ssh and self.fileclient.transfer_backend == "async":
+            self._download(copies)
+            return
+
+        nthreads = min(self.get("nthreads", 4), len(copies))
+        if nthreads > 1 and not self.fileclient.ssh:
+            pool = ThreadPool(nthreads)
+            try:
+                pool.map(self._copy_file, copies)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for c in copies:
+                self._copy_file(c)
+
+    @staticmethod
+    def get_relax_extensions(filenames):
+        """
+        Find the output of the last relaxation of each file, e.g. "OUTCAR.relax2" for
+        "OUTCAR" if the directory has "OUTCAR.relax1" and "OUTCAR.relax2.gz".
+
+        Args:
+            filenames ([str]): listing of the directory
+
+        Returns:
+            (dict) base file name -> extension of its last relaxation
+        """
+        relax_exts = {}
+        for name in filenames:
+            m = RELAX_EXT_RE.match(name)
+            if m:
+                base, ext = m.group(1), m.group(2)
+                if base not in relax_exts or \
+                        _relax_number(ext) > _relax_number(relax_exts[base]):
+                    relax_exts[base] = ext
+        return relax_exts
+
+    def _copy_file(self, args):
+        """
+        Copy one file (minus the relaxation extension), decompressing it if needed.
+
+        Args:
+            args (tuple): (source path, destination path, whether the source is gzipped,
+                transfer mode)
+        """
+        src, dest, gzipped, transfer_mode = args
+        if gzipped:
+            self.fileclient.copy_decompress(src, dest)
+        else:
+            self.fileclient.copy(src, dest, transfer_mode=transfer_mode)
+
+    def _download(self, copies):
+        """
+        Download the files from the remote filesystem at once, then decompress the
+        gzipped ones.
+
+        Args:
+            copies ([tuple]): the arguments of _copy_file of each file
+        """
+        self.fileclient.get([(src, dest + ".gz" if gzipped else dest)
+                             for src, dest, gzipped, transfer_mode in copies])
+        local = FileClient()
+        for src, dest, gzipped, transfer_mode in copies:
+            if gzipped:
+                local.copy_decompress(dest + ".gz", dest)
+                os.remove(dest + ".gz")
 
 
 @explicit_serialize
@@ -30,7 +30,7 @@ from pymatgen.analysis.magnetism import CollinearMagneticStructureAnalyzer, Orde
 from pymatgen.command_line.bader_caller import bader_analysis_from_path
 
 from atomate.common.firetasks.glue_tasks import get_calc_loc
-from atomate.utils.utils import env_chk, get_meta_from_structure
+from atomate.utils.utils import env_chk, get_meta_from_structure, get_uri
 from atomate.utils.utils import get_logger
 from atomate.vasp.database import VaspCalcDb
 from atomate.vasp.drones import VaspDrone
@@ -73,10 +73,17 @@ class VaspToDb(FiretaskBase):
             The path is a full mongo-style path so subdocuments can be referneced
             using dot notation and array keys can be referenced using the index.
             E.g "calcs_reversed.0.output.outar.run_stats"
+        lite_mode (bool): parse the vasprun.xml with a memory-bounded streaming reader that
+            skips eigenvalues, projections and DOS. Only valid if parse_dos and
+            bandstructure_mode are not set. Defaults to False.
+        skip_unchanged (bool): if the directory is already in the database and its
+            output files match the fingerprint stored in the task doc, do not parse
+            and insert it again but use the stored task doc. Defaults to False.
     """
     optional_params = ["calc_dir", "calc_loc", "parse_dos", "bandstructure_mode",
                        "additional_fields", "db_file", "fw_spec_field", "defuse_unsuccessful",
-                       "task_fields_to_push", "parse_chgcar", "parse_aeccar"]
+                       "task_fields_to_push", "parse_chgcar", "parse_aeccar", "lite_mode",
+                       "skip_unchanged"]
 
     def run_task(self, fw_spec):
         # get the directory that contains the VASP dir to parse
@@ -93,30 +100,43 @@ class VaspToDb(FiretaskBase):
                           parse_dos=self.get("parse_dos", False),
                           bandstructure_mode=self.get("bandstructure_mode", False),
                           parse_chgcar=self.get("parse_chgcar", False),
-                          parse_aeccar=self.get("parse_aeccar", False))
-
-        # assimilate (i.e., parse)
-        task_doc = drone.assimilate(calc_dir)
-
-        # Check for additional keys to set based on the fw_spec
-        if self.get("fw_spec_field"):
-            task_doc.update(fw_spec[self.get("fw_spec_field")])
+                          parse_aeccar=self.get("parse_aeccar", False),
+                          lite_mode=self.get("lite_mode", False))
 
         # get the database connection
         db_file = env_chk(self.get('db_file'), fw_spec)
 
-        # db insertion or taskdoc dump
-        if not db_file:
-            with open("task.json", "w") as f:
-                f.write(json.dumps(task_doc, default=DATETIME_HANDLER))
-        else:
+        # reuse the stored task doc if the outputs have not changed since it was parsed
+        task_doc = None
+        if db_file and self.get("skip_unchanged", False):
             mmdb = VaspCalcDb.from_db_file(db_file, admin=True)
-            t_id = mmdb.insert_task(
-                task_doc, use_gridfs=self.get("parse_dos", False)
-                or bool(self.get("bandstructure_mode", False))
-                or self.get("parse_chgcar", False)
-                or self.get("parse_aeccar", False))
-            logger.info("Finished parsing with task_id: {}".format(t_id))
+            dir_name = get_uri(calc_dir) if drone.use_full_uri else os.path.abspath(calc_dir)
+            old_doc = mmdb.collection.find_one({"dir_name": dir_name})
+            if old_doc and drone.is_unchanged(calc_dir, old_doc.get("fingerprint")):
+                logger.info("Outputs unchanged since task_id: {}, skipping parsing".format(
+                    old_doc["task_id"]))
+                task_doc = old_doc
+
+        if task_doc is None:
+            # assimilate (i.e., parse)
+            task_doc = drone.assimilate(calc_dir)
+
+            # Check for additional keys to set based on the fw_spec
+            if self.get("fw_spec_field"):
+                task_doc.update(fw_spec[self.get("fw_spec_field")])
+
+            # db insertion or taskdoc dump
+            if not db_file:
+                with open("task.json", "w") as f:
+                    f.write(json.dumps(task_doc, default=DATETIME_HANDLER))
+            else:
+                mmdb = VaspCalcDb.from_db_file(db_file, admin=True)
+                t_id = mmdb.insert_task(
+                    task_doc, use_gridfs=self.get("parse_dos", False)
+                    or bool(self.get("bandstructure_mode", False))
+                    or self.get("parse_chgcar", False)
+                    or self.get("parse_aeccar", False))
+                logger.info("Finished parsing with task_id: {}".format(t_id))
 
         defuse_children = False
         if task_doc["state"] != "successful":
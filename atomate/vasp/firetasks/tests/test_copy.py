@@ -2,11 +2,14 @@
 
 from __future__ import division, print_function, unicode_literals, absolute_import
 
+import gzip
 import os
 import unittest
 
 from atomate.vasp.firetasks.glue_tasks import CopyVaspOutputs
+from atomate.utils.fileio import FileClient
 from atomate.utils.testing import AtomateTest
+from atomate.utils.tests.test_transfer import LocalSFTP, LocalSSH
 
 __author__ = 'Anubhav Jain'
 __email__ = 'ajain@lbl.gov'
@@ -73,6 +76,20 @@ class TestCopyVaspOutputs(AtomateTest):
             with open(os.path.join(self.scratch_dir, "POSCAR")) as f2:
                 self.assertEqual(f1.read(), f2.read())
 
+    def test_plain_copy_links(self):
+        ct = CopyVaspOutputs(calc_dir=self.plain_outdir,
+                             transfer_mode={"CONTCAR": "symlink", "INCAR": "hardlink",
+                                            "KPOINTS": "reflink"})
+        ct.run_task({})
+        self.assertTrue(os.path.islink(os.path.join(self.scratch_dir, "POSCAR")))
+        self.assertFalse(os.path.islink(os.path.join(self.scratch_dir, "POTCAR")))
+
+        # the links fall back to copies when they are not supported
+        for f, dest in [("CONTCAR", "POSCAR"), ("INCAR", "INCAR"), ("KPOINTS", "KPOINTS")]:
+            with open(os.path.join(self.plain_outdir, f)) as f1:
+                with open(os.path.join(self.scratch_dir, dest)) as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
     def test_gzip_copy(self):
         ct = CopyVaspOutputs(calc_dir=self.gzip_outdir)
         ct.run_task({})
@@ -84,6 +101,34 @@ class TestCopyVaspOutputs(AtomateTest):
         for f in no_files:
             self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, f)))
 
+        # make sure no compressed copy is left behind
+        for f in files:
+            self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, f + ".gz")))
+
+    def test_gzip_copy_serial(self):
+        ct = CopyVaspOutputs(calc_dir=self.gzip_outdir, nthreads=1)
+        ct.run_task({})
+        with gzip.open(os.path.join(self.gzip_outdir, "CONTCAR.gz"), "rb") as f1:
+            with open(os.path.join(self.scratch_dir, "POSCAR"), "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_async_download(self):
+        ct = CopyVaspOutputs(calc_dir=self.relax2_outdir, transfer_backend="async")
+        # download from a stand-in for the remote filesystem
+        ct.fileclient = FileClient(transfer_backend="async")
+        ct.fileclient.ssh = LocalSSH()
+        ct.fileclient.sftp = LocalSFTP()
+        ct.from_dir = self.relax2_outdir
+        ct.to_dir = self.scratch_dir
+        ct.files_to_copy = ["INCAR", "KPOINTS", "POTCAR", "CONTCAR"]
+        ct.copy_files()
+        for f in ["INCAR", "KPOINTS", "POTCAR", "POSCAR"]:
+            self.assertTrue(os.path.exists(os.path.join(self.scratch_dir, f)))
+            self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, f + ".gz")))
+        with gzip.open(os.path.join(self.relax2_outdir, "CONTCAR.relax2.gz"), "rb") as f1:
+            with open(os.path.join(self.scratch_dir, "POSCAR"), "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+
     def test_relax2_copy(self):
         ct = CopyVaspOutputs(calc_dir=self.relax2_outdir, additional_files=["IBZKPT"])
         ct.run_task({})
@@ -95,6 +140,17 @@ class TestCopyVaspOutputs(AtomateTest):
         for f in no_files:
             self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, f)))
 
+        # make sure the last relaxation was copied
+        with gzip.open(os.path.join(self.relax2_outdir, "CONTCAR.relax2.gz"), "rb") as f1:
+            with open(os.path.join(self.scratch_dir, "POSCAR"), "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_get_relax_extensions(self):
+        relax_exts = CopyVaspOutputs.get_relax_extensions(
+            ["OUTCAR.relax1.gz", "OUTCAR.relax2", "OUTCAR.relax10.gz", "POTCAR.gz",
+             "INCAR.orig.gz", "vasprun.xml.relax1", "vasprun.xml.relax2.GZ"])
+        self.assertEqual(relax_exts, {"OUTCAR": ".relax10", "vasprun.xml": ".relax2"})
+
 
 if __name__ == "__main__":
     unittest.main()
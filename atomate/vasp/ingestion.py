@@ -0,0 +1,240 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+"""
+This module defines a bulk ingestion engine that loads existing VASP run
+directories into a tasks database using a pool of VaspDrone workers.
+"""
+
+import os
+import time
+import traceback
+from multiprocessing import Pool, cpu_count
+
+from pymongo import UpdateOne
+from tqdm import tqdm
+
+from atomate.utils.utils import get_logger, get_uri
+from atomate.vasp.database import VaspCalcDb
+from atomate.vasp.drones import VaspDrone
+
+__author__ = 'Kiran Mathew, Anubhav Jain'
+__email__ = 'kmathew@lbl.gov'
+
+logger = get_logger(__name__)
+
+# the drone used by each worker process, set by the pool initializer
+_worker_drone = None
+
+
+def _init_worker(drone):
+    global _worker_drone
+    _worker_drone = drone
+
+
+def _assimilate(args):
+    """
+    Parse one directory in a worker process, unless it still matches the
+    fingerprint of its task document.
+
+    Args:
+        args (tuple): (path, stored fingerprint or None)
+
+    Returns:
+        (path, task doc or None if unchanged, traceback string or None, refreshed
+        fingerprint of an unchanged directory or None, see VaspDrone.check_fingerprint)
+    """
+    path, fingerprint = args
+    try:
+        if fingerprint:
+            unchanged, refreshed = _worker_drone.check_fingerprint(path, fingerprint)
+            if unchanged:
+                return path, None, None, refreshed
+        return path, _worker_drone.assimilate(path), None, None
+    except Exception:
+        return path, None, traceback.format_exc(), None
+
+
+class VaspIngester(object):
+    """
+    Walk a directory tree, parse every VASP run directory found by the drone
+    with a pool of worker processes and insert the task documents into the
+    database in batches. Directories that are already in the tasks collection
+    are skipped if their output files still match the fingerprint stored in the
+    task document and are parsed again otherwise, so the same tree can be
+    ingested repeatedly and an interrupted ingestion can simply be restarted.
+    """
+
+    def __init__(self, db, drone=None, nproc=None, batch_size=100, use_gridfs=False,
+                 skip_existing=True, codec="zlib", columnar=False):
+        """
+        Args:
+            db (VaspCalcDb): the tasks database
+            drone (VaspDrone): drone used to find and parse the run directories.
+                Defaults to VaspDrone(). It is sent once to each worker process.
+            nproc (int): number of worker processes. Defaults to the number of CPUs.
+                Use 1 to parse in the current process.
+            batch_size (int): number of task documents buffered before they are
+                written to the database
+            use_gridfs (bool): store DOS, band structures and charge densities in GridFS
+            skip_existing (bool): skip directories whose dir_name is already in the
+                tasks collection and whose outputs have not changed since. Task
+                documents without a fingerprint are always skipped.
+            codec (str): compression codec of the GridFS data, e.g. "zlib" or "zstd"
+            columnar (bool): store band structures and DOS in the columnar format
+        """
+        self.db = db
+        self.drone = drone or VaspDrone()
+        self.nproc = nproc or cpu_count()
+        self.batch_size = batch_size
+        self.use_gridfs = use_gridfs
+        self.skip_existing = skip_existing
+        self.codec = codec
+        self.columnar = columnar
+
+    def get_valid_paths(self, root):
+        """
+        Get all the VASP run directories under root, as defined by the drone.
+
+        Args:
+            root (str): top of the directory tree
+
+        Returns:
+            ([str]) list of directories
+        """
+        paths = []
+        for parent, subdirs, files in os.walk(root):
+            paths.extend(self.drone.get_valid_paths((parent, subdirs, files)))
+        return paths
+
+    def get_dir_name(self, path):
+        """
+        The dir_name the drone stores in the task document for this path.
+        """
+        return get_uri(path) if self.drone.use_full_uri else os.path.abspath(path)
+
+    def get_fingerprints(self):
+        """
+        Returns:
+            (dict) dir_name -> stored fingerprint (None if there is none) for all
+            the task documents in the database
+        """
+        return {d["dir_name"]: d.get("fingerprint") for d in
+                self.db.collection.find({}, {"dir_name": 1, "fingerprint": 1, "_id": 0})
+                if "dir_name" in d}
+
+    def run(self, root):
+        """
+        Ingest all the VASP run directories under root.
+
+        Args:
+            root (str): top of the directory tree
+
+        Returns:
+            (dict) summary of the ingestion with the number of directories found,
+            skipped, inserted and failed, the failed paths with their tracebacks,
+            the elapsed time and the throughput in directories per second
+        """
+        start = time.time()
+        paths = self.get_valid_paths(root)
+        logger.info("Found {} VASP run directories in {}".format(len(paths), root))
+
+        todo = [(p, None) for p in paths]
+        if self.skip_existing:
+            fingerprints = self.get_fingerprints()
+            todo = []
+            for p in paths:
+                dir_name = self.get_dir_name(p)
+                if dir_name not in fingerprints:
+                    todo.append((p, None))
+                elif fingerprints[dir_name]:
+                    # compared against the files by the worker
+                    todo.append((p, fingerprints[dir_name]))
+            logger.info("Skipping {} directories already in the database without "
+                        "a fingerprint".format(len(paths) - len(todo)))
+
+        failed = {}
+        refreshed = {}
+        n_inserted = 0
+        n_unchanged = 0
+        batch = []
+        if self.nproc > 1 and len(todo) > 1:
+            pool = Pool(self.nproc, initializer=_init_worker, initargs=(self.drone,))
+            results = pool.imap_unordered(_assimilate, todo)
+        else:
+            pool = None
+            _init_worker(self.drone)
+            results = (_assimilate(p) for p in todo)
+
+        try:
+            pbar = tqdm(results, total=len(todo))
+            for path, doc, error, fingerprint in pbar:
+                if error:
+                    logger.error("Error parsing {}:\n{}".format(path, error))
+                    failed[path] = error
+                elif doc is None:
+                    n_unchanged += 1
+                    if fingerprint:
+                        refreshed[self.get_dir_name(path)] = fingerprint
+                else:
+                    batch.append(doc)
+                    if len(batch) >= self.batch_size:
+                        n_inserted += self._insert(batch)
+                        batch = []
+                pbar.set_description("Inserted: {}, unchanged: {}, failed: {}".format(
+                    n_inserted, n_unchanged, len(failed)))
+            n_inserted += self._insert(batch)
+            self._refresh_fingerprints(refreshed)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        elapsed = time.time() - start
+        summary = {"n_paths": len(paths),
+                   "n_skipped": len(paths) - len(todo) + n_unchanged,
+                   "n_inserted": n_inserted, "n_failed": len(failed), "failed": failed,
+                   "elapsed": elapsed,
+                   "throughput": (n_inserted + n_unchanged + len(failed)) / elapsed
+                   if elapsed else 0.0}
+        logger.info("Ingested {} directories ({} failed) in {:.1f} s: {:.2f} dirs/s".format(
+            n_inserted, len(failed), elapsed, summary["throughput"]))
+        return summary
+
+    def _insert(self, docs):
+        """
+        Write a batch of task documents to the database.
+
+        Returns:
+            (int) number of inserted documents
+        """
+        if not docs:
+            return 0
+        return len(self.db.insert_tasks(docs, use_gridfs=self.use_gridfs, codec=self.codec,
+                                        columnar=self.columnar))
+
+    def _refresh_fingerprints(self, fingerprints):
+        """
+        Store the fingerprints of the unchanged directories whose files got new mtimes,
+        so that they are not hashed again by the next ingestion.
+
+        Args:
+            fingerprints (dict): dir_name -> refreshed fingerprint
+        """
+        requests = [UpdateOne({"dir_name": dir_name}, {"$set": {"fingerprint": fingerprint}})
+                    for dir_name, fingerprint in fingerprints.items()]
+        if requests:
+            self.db.collection.bulk_write(requests, ordered=False)
+            logger.info("Refreshed the fingerprints of {} directories".format(len(requests)))
+
+    @classmethod
+    def from_db_file(cls, db_file, **kwargs):
+        """
+        Get a VaspIngester using only a db file.
+
+        Args:
+            db_file (str): path to db file
+            **kwargs: other params to put into VaspIngester
+        """
+        return cls(VaspCalcDb.from_db_file(db_file, admin=True), **kwargs)
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import io
+import os
+import unittest
+
+import numpy as np
+
+from pymatgen.electronic_structure.core import Spin
+from pymatgen.io.vasp import Vasprun
+
+from atomate.vasp.columnar import COLUMNAR_MAGIC, ColumnarReader, band_structure_from_columnar, \
+    band_structure_to_columnar, dos_from_columnar, dos_to_columnar, element_dos_from_columnar
+
+module_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_reader(blob):
+    f = io.BytesIO(blob)
+    assert f.read(len(COLUMNAR_MAGIC)) == COLUMNAR_MAGIC
+    return ColumnarReader(f)
+
+
+class ColumnarFormatTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.vrun = Vasprun(os.path.join(module_dir, "..", "test_files", "Si_static", "outputs",
+                                        "vasprun.xml.gz"), parse_projected_eigen=True)
+
+    def test_dos(self):
+        dos = self.vrun.complete_dos
+        reader = get_reader(dos_to_columnar(dos.as_dict()))
+        new_dos = dos_from_columnar(reader)
+        self.assertEqual(new_dos.efermi, dos.efermi)
+        self.assertTrue(np.allclose(new_dos.energies, dos.energies))
+        self.assertTrue(np.allclose(new_dos.densities[Spin.up], dos.densities[Spin.up]))
+        self.assertEqual(len(new_dos.pdos), len(dos.pdos))
+        for site in dos.structure:
+            for orb, pdos in dos.pdos[site].items():
+                self.assertTrue(np.allclose(new_dos.pdos[site][orb][Spin.up], pdos[Spin.up]))
+
+        new_dos = dos_from_columnar(reader, projections=False)
+        self.assertEqual(new_dos.pdos, {})
+        self.assertTrue(np.allclose(new_dos.densities[Spin.up], dos.densities[Spin.up]))
+
+        element_dos = element_dos_from_columnar(reader)
+        for el, el_dos in dos.get_element_dos().items():
+            self.assertTrue(np.allclose(element_dos[el].densities[Spin.up],
+                                        el_dos.densities[Spin.up]))
+
+    def test_band_structure(self):
+        bs = self.vrun.get_band_structure()
+        reader = get_reader(band_structure_to_columnar(bs.as_dict(), codec="none"))
+        new_bs = band_structure_from_columnar(reader)
+        self.assertEqual(new_bs.__class__, bs.__class__)
+        self.assertEqual(len(new_bs.kpoints), len(bs.kpoints))
+        self.assertTrue(np.allclose(new_bs.bands[Spin.up], bs.bands[Spin.up]))
+        self.assertTrue(np.allclose(new_bs.projections[Spin.up], bs.projections[Spin.up]))
+        self.assertAlmostEqual(new_bs.get_band_gap()["energy"], bs.get_band_gap()["energy"])
+
+        new_bs = band_structure_from_columnar(reader, projections=False)
+        self.assertEqual(len(new_bs.projections), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
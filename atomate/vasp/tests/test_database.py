@@ -0,0 +1,88 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import os
+import unittest
+
+import numpy as np
+
+from pymatgen.io.vasp import Chgcar, Vasprun
+
+from atomate.utils.testing import AtomateTest, DB_DIR
+from atomate.vasp.database import VaspCalcDb, VOLUMETRIC_MAGIC, volumetric_from_bytes, \
+    volumetric_to_bytes
+
+module_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+
+
+class VolumetricFormatTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chgcar = Chgcar.from_file(os.path.join(module_dir, "..", "test_files", "Si_static",
+                                                   "outputs", "CHGCAR.gz"))
+
+    def test_round_trip(self):
+        blob = volumetric_to_bytes(self.chgcar)
+        self.assertTrue(blob.startswith(VOLUMETRIC_MAGIC))
+        chgcar = volumetric_from_bytes(blob)
+        self.assertEqual(chgcar.structure, self.chgcar.structure)
+        self.assertEqual(sorted(chgcar.data.keys()), sorted(self.chgcar.data.keys()))
+        for k, v in self.chgcar.data.items():
+            self.assertEqual(chgcar.data[k].shape, v.shape)
+            self.assertTrue(np.array_equal(chgcar.data[k], v))
+        self.assertAlmostEqual(chgcar.data['total'].sum() / chgcar.ngridpts, 8.0, 4)
+
+    def test_float32(self):
+        blob = volumetric_to_bytes(self.chgcar, dtype="float32")
+        self.assertLess(len(blob), len(volumetric_to_bytes(self.chgcar)))
+        chgcar = volumetric_from_bytes(blob)
+        self.assertEqual(chgcar.data['total'].dtype, np.float32)
+        self.assertTrue(np.allclose(chgcar.data['total'], self.chgcar.data['total'],
+                                    rtol=1e-6))
+
+
+class VaspCalcDbTest(AtomateTest):
+
+    def setUp(self):
+        super(VaspCalcDbTest, self).setUp()
+        self.mmdb = VaspCalcDb.from_db_file(os.path.join(DB_DIR, "db.json"))
+
+    def test_insert_tasks(self):
+        docs = [{"dir_name": "/calc/{}".format(i), "state": "successful"} for i in range(3)]
+        task_ids = self.mmdb.insert_tasks(docs)
+        self.assertEqual(len(task_ids), 3)
+        self.assertEqual(task_ids, list(range(task_ids[0], task_ids[0] + 3)))
+        self.assertEqual(self.mmdb.collection.count(), 3)
+
+        # existing directories keep their task_id, new ones get the next ids
+        docs = [{"dir_name": "/calc/2", "state": "failed"}, {"dir_name": "/calc/3"}]
+        self.assertEqual(self.mmdb.insert_tasks(docs), [task_ids[2], task_ids[2] + 1])
+        self.assertEqual(self.mmdb.collection.find_one({"dir_name": "/calc/2"})["state"],
+                         "failed")
+        self.assertEqual(self.mmdb.insert_task({"dir_name": "/calc/4"}), task_ids[2] + 2)
+        self.assertIsNone(self.mmdb.insert({"dir_name": "/calc/4"}, update_duplicates=False))
+
+    def test_recompress_gridfs(self):
+        vrun = Vasprun(os.path.join(module_dir, "..", "test_files", "Si_static", "outputs",
+                                    "vasprun.xml.gz"))
+        dos = vrun.complete_dos.as_dict()
+        doc = {"dir_name": "/calc/dos", "calcs_reversed": [{"dos": dos}]}
+        task_id = self.mmdb.insert_task(doc, use_gridfs=True, codec="zlib")
+
+        self.assertEqual(self.mmdb.recompress_gridfs("dos", codec="none"), 1)
+        calc = self.mmdb.collection.find_one({"task_id": task_id})["calcs_reversed"][0]
+        self.assertEqual(calc["dos_compression"], "none")
+        # the old blob is deleted
+        self.assertEqual(self.mmdb.db["dos_fs.files"].count(), 1)
+        self.assertEqual(self.mmdb.retrieve_task(task_id)["calcs_reversed"][0]["dos"], dos)
+
+        # the blobs that already have the codec are not re-encoded
+        self.assertEqual(self.mmdb.recompress_gridfs("dos", codec="zlib"), 1)
+        self.assertEqual(self.mmdb.recompress_gridfs("dos", codec="zlib"), 0)
+        self.assertEqual(self.mmdb.retrieve_task(task_id)["calcs_reversed"][0]["dos"], dos)
+
+
+if __name__ == "__main__":
+    unittest.main()
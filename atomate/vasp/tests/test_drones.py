@@ -6,11 +6,13 @@ from __future__ import division, print_function, unicode_literals, \
     absolute_import
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from pymatgen.io.vasp import Outcar, Oszicar
 
-from atomate.vasp.drones import VaspDrone
+from atomate.vasp.drones import VaspDrone, get_vasprun_incar
 
 import numpy as np
 
@@ -70,6 +72,14 @@ class VaspToDbTaskDroneTest(unittest.TestCase):
         self.assertEqual(doc["calcs_reversed"][0]["output"]["outcar"], outcar2)
         self.assertEqual(doc["calcs_reversed"][1]["output"]["outcar"], outcar1)
 
+        # the runs parsed in parallel are merged in the same order
+        doc_parallel = VaspDrone(runs=["relax1", "relax2"], max_workers=2).assimilate(self.relax2)
+        self.assertEqual([c["task"]["name"] for c in doc_parallel["calcs_reversed"]],
+                         ["relax2", "relax1"])
+        self.assertEqual(doc_parallel["run_stats"], doc["run_stats"])
+        self.assertEqual(doc_parallel["calcs_reversed"][1]["output"]["outcar"], outcar1)
+        self.assertAlmostEqual(doc_parallel["output"]["energy"], doc["output"]["energy"])
+
     def test_bandstructure(self):
         drone = VaspDrone()
 
@@ -115,6 +125,77 @@ class VaspToDbTaskDroneTest(unittest.TestCase):
             self.assertTrue(d["is_metal"])
             self.assertEqual(doc["calcs_reversed"][0]["bandstructure"]["@class"],"BandStructureSymmLine")
 
+    def test_assimilate_lite(self):
+        self.assertRaises(ValueError, VaspDrone, lite_mode=True)
+        drone = VaspDrone(parse_dos=False, bandstructure_mode=False)
+        lite_drone = VaspDrone(parse_dos=False, bandstructure_mode=False, lite_mode=True)
+        for path in [self.relax, self.Si_static, self.Al]:
+            doc = drone.assimilate(path)
+            lite_doc = lite_drone.assimilate(path)
+            self.assertAlmostEqual(lite_doc["output"]["energy"], doc["output"]["energy"])
+            self.assertTrue(np.allclose(lite_doc["output"]["forces"], doc["output"]["forces"]))
+            self.assertTrue(np.allclose(lite_doc["output"]["stress"], doc["output"]["stress"]))
+            self.assertEqual(lite_doc["input"]["incar"], doc["input"]["incar"])
+            self.assertEqual(lite_doc["output"]["structure"], doc["output"]["structure"])
+            for k in ["bandgap", "is_gap_direct", "is_metal", "direct_gap"]:
+                if doc["output"].get(k) is None:
+                    self.assertIsNone(lite_doc["output"].get(k))
+                else:
+                    self.assertAlmostEqual(lite_doc["output"][k], doc["output"][k], 4)
+            self.assertNotIn("eigenvalues", lite_doc["calcs_reversed"][0]["output"])
+
+    def test_get_vasprun_incar(self):
+        incar = get_vasprun_incar(os.path.join(self.Al, "vasprun.xml.gz"))
+        self.assertEqual(incar["ICHARG"], 11)
+        self.assertEqual(incar["NSW"], 0)
+        self.assertEqual(incar["PREC"], "accurate")
+        self.assertFalse(incar["LCHARG"])
+        self.assertAlmostEqual(incar["ENCUT"], 520)
+
+        drone = VaspDrone()
+        self.assertTrue(drone._needs_projections(os.path.join(self.Al, "vasprun.xml.gz")))
+        self.assertFalse(drone._needs_projections(
+            os.path.join(self.Si_static, "vasprun.xml.gz")))
+
+    def test_fingerprint(self):
+        drone = VaspDrone()
+        scratch = tempfile.mkdtemp()
+        try:
+            path = os.path.join(scratch, "outputs")
+            shutil.copytree(self.Si_static, path)
+            fingerprint = drone.get_fingerprint(path)
+            self.assertEqual([f["file"] for f in fingerprint],
+                             ["OUTCAR.gz", "custodian.json.gz", "vasprun.xml.gz"])
+            self.assertTrue(all(len(f["sha1"]) == 40 for f in fingerprint))
+            self.assertTrue(drone.is_unchanged(path, fingerprint))
+            self.assertFalse(drone.is_unchanged(path, None))
+
+            self.assertEqual(drone.check_fingerprint(path, fingerprint), (True, None))
+
+            # a new mtime alone is not a change, but it is refreshed in the fingerprint
+            os.utime(os.path.join(path, "OUTCAR.gz"), (0, 0))
+            self.assertTrue(drone.is_unchanged(path, fingerprint))
+            unchanged, refreshed = drone.check_fingerprint(path, fingerprint)
+            self.assertTrue(unchanged)
+            self.assertEqual(refreshed[0]["mtime"], 0)
+            self.assertEqual([f["sha1"] for f in refreshed], [f["sha1"] for f in fingerprint])
+            self.assertEqual(drone.check_fingerprint(path, refreshed), (True, None))
+
+            with open(os.path.join(path, "OUTCAR.gz"), "ab") as f:
+                f.write(b"\0")
+            self.assertFalse(drone.is_unchanged(path, fingerprint))
+
+            fingerprint = drone.get_fingerprint(path)
+            with open(os.path.join(path, "vasprun.xml.relax1"), "w") as f:
+                f.write("[]")
+            self.assertFalse(drone.is_unchanged(path, fingerprint))
+        finally:
+            shutil.rmtree(scratch)
+
+        doc = drone.assimilate(self.relax2)
+        self.assertEqual([f["file"] for f in doc["fingerprint"]],
+                         drone.get_fingerprint_files(self.relax2))
+
     def test_detect_output_file_paths(self):
         drone = VaspDrone()
         doc = drone.assimilate(self.Si_static)
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import gzip
+import os
+import shutil
+import unittest
+
+from atomate.utils.testing import AtomateTest, DB_DIR
+from atomate.vasp.database import VaspCalcDb
+from atomate.vasp.drones import VaspDrone
+from atomate.vasp.ingestion import VaspIngester
+
+module_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+
+
+class VaspIngesterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_files = os.path.join(module_dir, "..", "test_files")
+        self.ingester = VaspIngester(None, drone=VaspDrone(use_full_uri=False), nproc=1)
+
+    def test_get_valid_paths(self):
+        paths = self.ingester.get_valid_paths(self.test_files)
+        for d in [os.path.join("Si_static", "outputs"), "Al",
+                  os.path.join("Si_structure_optimization_relax2", "outputs")]:
+            self.assertIn(os.path.join(self.test_files, d), paths)
+        self.assertEqual(len(paths), len(set(paths)))
+
+    def test_get_dir_name(self):
+        path = os.path.join(self.test_files, "Al")
+        self.assertEqual(self.ingester.get_dir_name(path), os.path.abspath(path))
+
+
+class VaspIngesterRunTest(AtomateTest):
+
+    def setUp(self):
+        super(VaspIngesterRunTest, self).setUp()
+        self.root = os.path.join(self.scratch_dir, "runs")
+        for d in ["Si_static", "Si_structure_optimization"]:
+            shutil.copytree(os.path.join(module_dir, "..", "test_files", d, "outputs"),
+                            os.path.join(self.root, d))
+        self.mmdb = VaspCalcDb.from_db_file(os.path.join(DB_DIR, "db.json"))
+        drone = VaspDrone(parse_dos=False, bandstructure_mode=False, use_full_uri=False)
+        self.ingester = VaspIngester(self.mmdb, drone=drone, nproc=1, batch_size=1)
+
+    def test_run(self):
+        summary = self.ingester.run(self.root)
+        self.assertEqual(summary["n_paths"], 2)
+        self.assertEqual(summary["n_inserted"], 2)
+        self.assertEqual(summary["n_skipped"], 0)
+        self.assertEqual(summary["n_failed"], 0)
+        self.assertEqual(self.mmdb.collection.count(), 2)
+        for doc in self.mmdb.collection.find():
+            self.assertTrue(doc["fingerprint"])
+
+        # the unchanged directories are skipped
+        summary = self.ingester.run(self.root)
+        self.assertEqual(summary["n_skipped"], 2)
+        self.assertEqual(summary["n_inserted"], 0)
+        self.assertEqual(self.mmdb.collection.count(), 2)
+
+        # the fingerprint of a directory whose files only got new mtimes is refreshed
+        os.utime(os.path.join(self.root, "Si_static", "OUTCAR.gz"), (0, 0))
+        summary = self.ingester.run(self.root)
+        self.assertEqual(summary["n_skipped"], 2)
+        self.assertEqual(summary["n_inserted"], 0)
+        doc = self.mmdb.collection.find_one(
+            {"dir_name": self.ingester.get_dir_name(os.path.join(self.root, "Si_static"))})
+        self.assertEqual([f["mtime"] for f in doc["fingerprint"] if f["file"] == "OUTCAR.gz"],
+                         [0])
+
+        # a directory whose outputs changed is parsed and updated again
+        custodian_file = os.path.join(self.root, "Si_static", "custodian.json.gz")
+        with gzip.open(custodian_file, "rb") as f:
+            data = f.read()
+        with gzip.open(custodian_file, "wb") as f:
+            f.write(data + b"\n")
+        summary = self.ingester.run(self.root)
+        self.assertEqual(summary["n_skipped"], 1)
+        self.assertEqual(summary["n_inserted"], 1)
+        self.assertEqual(self.mmdb.collection.count(), 2)
+
+        # all the directories are parsed again without skip_existing
+        self.ingester.skip_existing = False
+        summary = self.ingester.run(self.root)
+        self.assertEqual(summary["n_skipped"], 0)
+        self.assertEqual(summary["n_inserted"], 2)
+        self.assertEqual(self.mmdb.collection.count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
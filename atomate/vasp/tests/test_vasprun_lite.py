@@ -0,0 +1,74 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import pymatgen
+from pymatgen.io.vasp import Vasprun
+
+from atomate.vasp.vasprun_lite import VasprunLite, check_vasprun_api, \
+    SUPPORTED_PYMATGEN_VERSION
+
+__author__ = 'Kiran Mathew, Anubhav Jain'
+__email__ = 'kmathew@lbl.gov'
+
+module_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+
+
+class VasprunLiteTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.vasprun = os.path.join(module_dir, "..", "test_files",
+                                   "Si_structure_optimization_plain", "outputs", "vasprun.xml")
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch_dir)
+
+    @unittest.skipIf(getattr(pymatgen, "__version__", None) != SUPPORTED_PYMATGEN_VERSION,
+                     "VasprunLite overrides private Vasprun methods of pymatgen {}".format(
+                         SUPPORTED_PYMATGEN_VERSION))
+    def test_supported_pymatgen(self):
+        check_vasprun_api()
+        vrun = Vasprun(self.vasprun, parse_dos=False, parse_potcar_file=False)
+        vrun_lite = VasprunLite(self.vasprun, parse_potcar_file=False)
+        self.assertAlmostEqual(vrun_lite.efermi, vrun.efermi)
+        gap, cbm, vbm, is_direct = vrun.eigenvalue_band_properties
+        # without the Fermi level, the band edges are not corrected for metals
+        vrun_lite.efermi = None
+        props = vrun_lite.band_properties
+        self.assertAlmostEqual(props["bandgap"], gap, 4)
+        self.assertAlmostEqual(props["cbm"], cbm, 4)
+        self.assertAlmostEqual(props["vbm"], vbm, 4)
+        self.assertEqual(props["is_gap_direct"], is_direct)
+        self.assertEqual(len(vrun_lite.ionic_steps), len(vrun.ionic_steps))
+        self.assertAlmostEqual(vrun_lite.final_energy, vrun.final_energy)
+
+    def test_last_ionic_step_eigenvalues(self):
+        with io.open(self.vasprun, encoding="utf-8") as f:
+            xml = f.read()
+        # give the first ionic step shifted eigenvalues, which must not be used
+        eigenvalues = re.search(r"<eigenvalues>.*?</eigenvalues>", xml, re.S).group(0)
+        shifted = re.sub(r"<r>\s*(\S+)", lambda m: "<r> {:.4f}".format(float(m.group(1)) - 10),
+                         eigenvalues)
+        end = xml.index("</calculation>")
+        multi = os.path.join(self.scratch_dir, "vasprun.xml")
+        with io.open(multi, "w", encoding="utf-8") as f:
+            f.write(xml[:end] + shifted + "\n" + xml[end:])
+
+        props = VasprunLite(self.vasprun, parse_potcar_file=False).band_properties
+        multi_props = VasprunLite(multi, parse_potcar_file=False).band_properties
+        self.assertEqual(multi_props, props)
+
+
+if __name__ == "__main__":
+    unittest.main()
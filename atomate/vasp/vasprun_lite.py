@@ -0,0 +1,232 @@
+# coding: utf-8
+
+from __future__ import division, print_function, unicode_literals, absolute_import
+
+"""
+This module defines a memory-bounded vasprun.xml reader for task documents
+that do not need eigenvalues, projections or densities of states.
+"""
+
+import inspect
+from xml.etree import ElementTree as ET
+
+import pymatgen
+from pymatgen.io.vasp import Vasprun
+
+__author__ = 'Kiran Mathew, Anubhav Jain'
+__email__ = 'kmathew@lbl.gov'
+
+# blocks that are never kept in memory by VasprunLite
+_SKIPPED_BLOCKS = {"eigenvalues", "projected", "dos", "dielectricfunction"}
+
+# pymatgen version VasprunLite is tested with (see requirements.txt)
+SUPPORTED_PYMATGEN_VERSION = "2019.5.8"
+
+# private Vasprun methods VasprunLite overrides or calls, with the arguments of the
+# overridden ones
+_VASPRUN_PRIVATE_API = {
+    "_parse": ["self", "stream", "parse_dos", "parse_eigen", "parse_projected_eigen"],
+    "_parse_params": None,
+    "_parse_kpoints": None,
+    "_parse_structure": None,
+    "_parse_atominfo": None,
+    "_parse_calculation": None,
+    "_parse_chemical_shielding_calculation": None,
+}
+
+
+def check_vasprun_api():
+    """
+    Check that the private Vasprun methods VasprunLite relies on are still there.
+
+    Raises:
+        RuntimeError: if the installed pymatgen changed them
+    """
+    getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
+    changed = []
+    for name, args in _VASPRUN_PRIVATE_API.items():
+        method = getattr(Vasprun, name, None)
+        if method is None or (args is not None and getargspec(method).args != args):
+            changed.append(name)
+    if changed:
+        raise RuntimeError(
+            "VasprunLite is not compatible with pymatgen {}: Vasprun.{} changed. Use "
+            "pymatgen {} or read the vasprun.xml with Vasprun.".format(
+                getattr(pymatgen, "__version__", "?"), ", ".join(sorted(changed)),
+                SUPPORTED_PYMATGEN_VERSION))
+
+
+class _BandEdges(object):
+    """
+    Reduces the <eigenvalues> rows of a vasprun.xml to the band edges, one
+    k-point at a time, so the eigenvalues never have to be stored.
+    """
+
+    def __init__(self, occu_tol=1e-8):
+        self.occu_tol = occu_tol
+        self.vbm = -float("inf")
+        self.cbm = float("inf")
+        self.vbm_kpoint = None
+        self.cbm_kpoint = None
+        self.direct_gap = float("inf")
+        # (spin, band index) -> [min energy, max energy] over all k-points
+        self.band_ranges = {}
+
+    def add_kpoint(self, spin, kpoint, rows):
+        """
+        Args:
+            spin (int): spin channel index
+            kpoint (int): k-point index
+            rows ([(float, float)]): (eigenvalue, occupation) for each band
+        """
+        k_vbm = -float("inf")
+        k_cbm = float("inf")
+        for band, (eigenval, occu) in enumerate(rows):
+            # same band edge definition as Vasprun.eigenvalue_band_properties
+            if occu > self.occu_tol and eigenval > self.vbm:
+                self.vbm = eigenval
+                self.vbm_kpoint = kpoint
+            elif occu <= self.occu_tol and eigenval < self.cbm:
+                self.cbm = eigenval
+                self.cbm_kpoint = kpoint
+            if occu > self.occu_tol:
+                k_vbm = max(k_vbm, eigenval)
+            else:
+                k_cbm = min(k_cbm, eigenval)
+            e_range = self.band_ranges.setdefault((spin, band), [eigenval, eigenval])
+            e_range[0] = min(e_range[0], eigenval)
+            e_range[1] = max(e_range[1], eigenval)
+        self.direct_gap = min(self.direct_gap, k_cbm - k_vbm)
+
+    def is_metal(self, efermi, efermi_tol=1e-4):
+        """
+        Same criterion as BandStructure.is_metal: a band crosses the Fermi level.
+        """
+        return any(e_min - efermi < -efermi_tol and e_max - efermi > efermi_tol
+                   for e_min, e_max in self.band_ranges.values())
+
+
+class VasprunLite(Vasprun):
+    """
+    A Vasprun that streams through the vasprun.xml with a bounded-memory
+    iterparse. Only the header (incar, kpoints, parameters, atominfo), the
+    structures, energies, forces and stresses of the ionic steps and the Fermi
+    level are kept. The eigenvalue, projection and DOS blocks are reduced or
+    discarded as they are read, so memory does not grow with the size of
+    those blocks: the band edges are computed on the fly from the eigenvalues
+    of the last ionic step and are available from band_properties.
+
+    The frequency-dependent dielectric function, optical transitions and the
+    DFPT dynamical matrix are not parsed; use Vasprun for those calculations.
+    """
+
+    def __init__(self, filename, parse_potcar_file=True, occu_tol=1e-8,
+                 exception_on_bad_xml=True):
+        """
+        Args:
+            filename (str): path to the (possibly compressed) vasprun.xml
+            parse_potcar_file (bool/str): see Vasprun
+            occu_tol (float): occupation below which a band is considered empty
+            exception_on_bad_xml (bool): see Vasprun
+        """
+        check_vasprun_api()
+        super(VasprunLite, self).__init__(
+            filename, parse_dos=False, parse_eigen=False, parse_projected_eigen=False,
+            parse_potcar_file=parse_potcar_file, occu_tol=occu_tol,
+            exception_on_bad_xml=exception_on_bad_xml)
+
+    def _parse(self, stream, parse_dos, parse_eigen, parse_projected_eigen):
+        self.efermi = None
+        self.eigenvalues = None
+        self.projected_eigenvalues = None
+        self.dielectric_data = {}
+        self.other_dielectric = {}
+        self._band_edges = _BandEdges(self.occu_tol)
+        ionic_steps = []
+        parsed_header = False
+        # stack of the currently open elements
+        elems = []
+        try:
+            for event, elem in ET.iterparse(stream, events=("start", "end")):
+                if event == "start":
+                    elems.append(elem)
+                    if elem.tag == "calculation":
+                        # only the eigenvalues of the last ionic step are used
+                        self._band_edges = _BandEdges(self.occu_tol)
+                    continue
+                elems.pop()
+                tag = elem.tag
+                skipped = [e.tag for e in elems if e.tag in _SKIPPED_BLOCKS]
+
+                if skipped:
+                    if skipped == ["eigenvalues"] and tag == "set" and \
+                            elem.attrib.get("comment", "").startswith("kpoint"):
+                        spin = int(elems[-1].attrib["comment"].split()[-1]) - 1
+                        kpoint = int(elem.attrib["comment"].split()[-1]) - 1
+                        rows = [[float(x) for x in r.text.split()[:2]]
+                                for r in elem.findall("r")]
+                        self._band_edges.add_kpoint(spin, kpoint, rows)
+                    if tag == "set":
+                        elem.clear()
+                    continue
+
+                if not parsed_header:
+                    if tag == "generator":
+                        self.generator = self._parse_params(elem)
+                    elif tag == "incar":
+                        self.incar = self._parse_params(elem)
+                    elif tag == "kpoints":
+                        self.kpoints, self.actual_kpoints, self.actual_kpoints_weights = \
+                            self._parse_kpoints(elem)
+                    elif tag == "parameters":
+                        self.parameters = self._parse_params(elem)
+                    elif tag == "structure" and elem.attrib.get("name") == "initialpos":
+                        self.initial_structure = self._parse_structure(elem)
+                    elif tag == "atominfo":
+                        self.atomic_symbols, self.potcar_symbols = self._parse_atominfo(elem)
+                        self.potcar_spec = [{"titel": p, "hash": None}
+                                            for p in self.potcar_symbols]
+                if tag == "calculation":
+                    parsed_header = True
+                    if not self.parameters.get("LCHIMAG", False):
+                        ionic_steps.append(self._parse_calculation(elem))
+                    else:
+                        ionic_steps.extend(self._parse_chemical_shielding_calculation(elem))
+                    elem.clear()
+                elif tag == "dos":
+                    for i in elem.findall("i"):
+                        if i.attrib.get("name") == "efermi":
+                            self.efermi = float(i.text)
+                    elem.clear()
+                elif tag in _SKIPPED_BLOCKS:
+                    elem.clear()
+                elif tag == "structure" and elem.attrib.get("name") == "finalpos":
+                    self.final_structure = self._parse_structure(elem)
+        except ET.ParseError:
+            if self.exception_on_bad_xml:
+                raise
+        self.ionic_steps = ionic_steps
+        self.vasp_version = self.generator["version"]
+
+    @property
+    def band_properties(self):
+        """
+        Band gap information computed from the streamed eigenvalues, with the
+        same keys as the band structure based fields of the task document.
+        Metals have a zero gap and no band edges. is_metal and direct_gap are
+        only set if the Fermi level is known.
+        """
+        edges = self._band_edges
+        if edges.vbm_kpoint is None and edges.cbm_kpoint is None:
+            return {}
+        d = {"vbm": edges.vbm, "cbm": edges.cbm,
+             "bandgap": max(edges.cbm - edges.vbm, 0),
+             "is_gap_direct": edges.vbm_kpoint == edges.cbm_kpoint}
+        if self.efermi is not None:
+            d["is_metal"] = edges.is_metal(self.efermi)
+            if d["is_metal"]:
+                d.update({"vbm": None, "cbm": None, "bandgap": 0.0,
+                          "is_gap_direct": False})
+            elif not d["is_gap_direct"]:
+                d["direct_gap"] = edges.direct_gap
+        return d
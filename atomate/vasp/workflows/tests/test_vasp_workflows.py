@@ -306,6 +306,27 @@ class TestVaspWorkflows(AtomateTest):
         ret_aeccar = ret_aeccar0 + ret_aeccar2
         self.assertAlmostEqual(ret_chgcar.data['total'].sum()/ret_chgcar.ngridpts, 8.0, 4)
         self.assertAlmostEqual(ret_aeccar.data['total'].sum()/ret_aeccar.ngridpts, 31.2667331015, 4)
+        # the lazy task doc only loads the GridFS fields when they are accessed
+        lazy_task = mmdb.retrieve_task(t_id, lazy=True)
+        lazy_calc = lazy_task['calcs_reversed'][0]
+        self.assertIn('chgcar', lazy_calc)
+        self.assertIn('chgcar', list(lazy_calc.keys()))
+        self.assertNotIn('chgcar', dict.keys(lazy_calc))
+        self.assertEqual(len(lazy_calc), len(list(lazy_calc.keys())))
+        self.assertIsNone(lazy_calc.get('dos'))
+        self.assertNotIn('dos', lazy_calc)
+        self.assertAlmostEqual(lazy_calc['chgcar'].data['total'].sum()/ret_chgcar.ngridpts, 8.0, 4)
+        self.assertIn('chgcar', dict.keys(lazy_calc))
+        # the AECCARs are loaded and checked together
+        self.assertAlmostEqual(lazy_calc['aeccar2'].data['total'].sum()/cc.ngridpts,
+                               8.01314480789829, 4)
+        self.assertIn('aeccar0', dict.keys(lazy_calc))
+        self.assertEqual(sorted(dict(lazy_calc.items()).keys()), sorted(lazy_calc.keys()))
+        prefetched = mmdb.retrieve_tasks([t_id], prefetch=['aeccar0'])
+        self.assertEqual(len(prefetched), 1)
+        self.assertIn('aeccar0', list(prefetched[0]['calcs_reversed'][0].keys()))
+        self.assertAlmostEqual(prefetched[0]['calcs_reversed'][0]['aeccar0'].data['total'].sum()/cc.ngridpts,
+                               23.253588293583313, 4)
 
     def test_chgcar_db_read(self):
         # add the workflow